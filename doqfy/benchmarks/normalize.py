@@ -0,0 +1,47 @@
+"""Micro-benchmark of the validation and normalization of the long URLs.
+
+Run it from the project directory with `python -m benchmarks.normalize`.
+"""
+
+import timeit
+from collections.abc import Callable
+
+from django.core.validators import URLValidator
+from shorten.normalize import normalize_url
+
+URLS: dict[str, str] = {
+    "simple": "https://example.com/some/path",
+    "messy": "HTTPS://Example.COM:443/a%2fb?utm_source=x&b=2&a=1",
+    "idna": "https://bücher.example/katalog?seite=2",
+}
+
+_shared_validator = URLValidator()
+
+
+def _new_validator(url: str) -> None:
+    URLValidator()(url)
+
+
+def _shared(url: str) -> None:
+    _shared_validator(url)
+
+
+BENCHMARKS: dict[str, Callable[[str], object]] = {
+    "URLValidator per call": _new_validator,
+    "shared URLValidator": _shared,
+    "normalize_url": normalize_url,
+}
+
+
+def main() -> None:
+    print(f"{'benchmark':<24}{'url':<10}{'per call':>12}")  # noqa: T201
+    for name, fn in BENCHMARKS.items():
+        for kind, url in URLS.items():
+            timer = timeit.Timer(lambda fn=fn, url=url: fn(url))
+            number, _ = timer.autorange()
+            best = min(timer.repeat(repeat=5, number=number)) / number
+            print(f"{name:<24}{kind:<10}{best * 1e6:>10.2f}µs")  # noqa: T201
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,421 @@
+"""Benchmarks of the shorten and shareme endpoints.
+
+Seeds a temporary SQLite database, with its own shared memory caches and ID filters, drives each scenario
+with `--concurrency` threads and prints the throughput and the latency percentiles of every scenario as
+JSON, along with the commit they were run on, so that the results of different commits can be compared.
+Run it from the project directory:
+
+    python -m benchmarks.run --transport wsgi --concurrency 8 --requests 2000 --output results.json
+
+The transports are `inprocess` (the WSGI application is called directly), `wsgi` (a threaded `wsgiref`
+server) and `asgi` (a uvicorn server, which has to be installed separately). All of them go through
+`doqfy.wsgi`/`doqfy.asgi`, including the redirect fast path.
+"""
+
+import argparse
+import contextlib
+import http.client
+import io
+import json
+import os
+import platform
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections.abc import Callable, Iterator
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from http import HTTPStatus
+from http.cookies import SimpleCookie
+from pathlib import Path
+from socketserver import ThreadingMixIn
+from typing import Any, Protocol
+from urllib.parse import urlencode
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+from wsgiref.util import setup_testing_defaults
+
+import django
+from core.shmcache import SHARED_DIRECTORY
+from django.conf import settings
+
+SNIPPET_KEY = "benchmark-key"
+SNIPPET = "def main() -> None:\n    print('hello, world')\n" * 20
+
+
+@dataclass
+class Response:
+    status: int
+    headers: list[tuple[str, str]]
+    body: bytes
+
+
+class Transport(Protocol):
+    def request(self, method: str, path: str, body: bytes, headers: dict[str, str]) -> Response: ...
+
+
+class InProcessTransport:
+    def __init__(self, application: Callable[..., Any]) -> None:
+        self.application = application
+
+    def request(self, method: str, path: str, body: bytes, headers: dict[str, str]) -> Response:
+        environ: dict[str, Any] = {
+            "REQUEST_METHOD": method,
+            "PATH_INFO": path,
+            "CONTENT_LENGTH": str(len(body)),
+            "wsgi.input": io.BytesIO(body),
+        }
+        for name, value in headers.items():
+            key = name.upper().replace("-", "_")
+            environ[key if key == "CONTENT_TYPE" else f"HTTP_{key}"] = value
+        setup_testing_defaults(environ)
+
+        started: list[Any] = []
+        result = self.application(environ, lambda status, headers, *_: started.extend((status, headers)))
+        try:
+            response_body = b"".join(result)
+        finally:
+            if hasattr(result, "close"):
+                result.close()
+
+        return Response(int(started[0].split()[0]), started[1], response_body)
+
+
+class HttpTransport:
+    def __init__(self, host: str, port: int) -> None:
+        self.connection = http.client.HTTPConnection(host, port, timeout=30)
+
+    def request(self, method: str, path: str, body: bytes, headers: dict[str, str]) -> Response:
+        for attempt in range(2):
+            try:
+                self.connection.request(method, path, body, headers)
+                response = self.connection.getresponse()
+
+                return Response(response.status, response.getheaders(), response.read())
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                # The server closed the kept alive connection.
+                self.connection.close()
+                if attempt:
+                    raise
+
+        raise AssertionError
+
+
+class Client:
+    """Sends the requests of a single worker, with the CSRF token that the forms need."""
+
+    def __init__(self, transport: Transport) -> None:
+        self.transport = transport
+        self.csrf_token: str | None = None
+
+    def get(self, path: str) -> Response:
+        return self.transport.request("GET", path, b"", {"Host": "127.0.0.1"})
+
+    def post(self, path: str, data: dict[str, str]) -> Response:
+        if self.csrf_token is None:
+            cookies = SimpleCookie()
+            for name, value in self.get("/shorten/").headers:
+                if name.lower() == "set-cookie":
+                    cookies.load(value)
+            self.csrf_token = cookies[settings.CSRF_COOKIE_NAME].value
+
+        headers = {
+            "Host": "127.0.0.1",
+            "Content-Type": "application/x-www-form-urlencoded",
+            "Cookie": f"{settings.CSRF_COOKIE_NAME}={self.csrf_token}",
+            "X-CSRFToken": self.csrf_token,
+        }
+
+        return self.transport.request("POST", path, urlencode(data).encode(), headers)
+
+
+@dataclass
+class Seed:
+    short_ids: list[str] = field(default_factory=list)
+    snippet_ids: list[str] = field(default_factory=list)
+    encrypted_snippet_ids: list[str] = field(default_factory=list)
+
+
+def redirect(client: Client, seed: Seed, rng: random.Random) -> bool:
+    return client.get(f"/shorten/{rng.choice(seed.short_ids)}/").status == HTTPStatus.FOUND
+
+
+def shorten_url(client: Client, _: Seed, __: random.Random) -> bool:
+    return (
+        client.post("/shorten/", {"long_url": f"https://bench.example/{uuid.uuid4().hex}"}).status == HTTPStatus.FOUND
+    )
+
+
+def create_shareable_link(client: Client, _: Seed, __: random.Random) -> bool:
+    return client.post("/shareme/", {"snippet": SNIPPET}).status == HTTPStatus.FOUND
+
+
+def get_encrypted_snippet(client: Client, seed: Seed, rng: random.Random) -> bool:
+    response = client.post(f"/shareme/{rng.choice(seed.encrypted_snippet_ids)}/", {"key": SNIPPET_KEY})
+
+    return response.status == HTTPStatus.OK and b"Invalid encryption key" not in response.body
+
+
+SCENARIOS: dict[str, Callable[[Client, Seed, random.Random], bool]] = {
+    "redirect_to_long_url": redirect,
+    "shorten_url": shorten_url,
+    "create_shareable_link": create_shareable_link,
+    "get_snippet_encrypted": get_encrypted_snippet,
+}
+
+
+def main() -> None:
+    args = _parse_args()
+    with (
+        tempfile.TemporaryDirectory(prefix="doqfy-bench-") as directory,
+        tempfile.TemporaryDirectory(prefix="doqfy-bench-", dir=SHARED_DIRECTORY) as shared_directory,
+    ):
+        _configure(Path(directory) / "db.sqlite3", Path(shared_directory), args)
+        seed = _seed(args)
+
+        import doqfy.asgi  # noqa: PLC0415
+        import doqfy.wsgi  # noqa: PLC0415
+
+        results: dict[str, Any] = {}
+        with _serve(args.transport, doqfy.wsgi.application, doqfy.asgi.application) as address:
+
+            def create_transport() -> Transport:
+                if address is None:
+                    return InProcessTransport(doqfy.wsgi.application)
+
+                return HttpTransport(*address)
+
+            clients = [Client(create_transport()) for _ in range(args.concurrency)]
+            for name in args.scenarios:
+                _run(SCENARIOS[name], clients, seed, args.warmup, args.concurrency)
+                results[name] = _run(SCENARIOS[name], clients, seed, args.requests, args.concurrency)
+
+        _tear_down()
+
+    report = {
+        "commit": _get_commit(),
+        "python": platform.python_version(),
+        "transport": args.transport,
+        "concurrency": args.concurrency,
+        "seed": {
+            "urls": len(seed.short_ids),
+            "snippets": len(seed.snippet_ids),
+            "encrypted_snippets": len(seed.encrypted_snippet_ids),
+        },
+        "scenarios": results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(output + "\n")
+    else:
+        print(output)  # noqa: T201
+
+
+def _parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--transport", choices=("inprocess", "wsgi", "asgi"), default="inprocess")
+    parser.add_argument("--concurrency", type=int, default=8, help="Number of concurrent workers.")
+    parser.add_argument("--requests", type=int, default=1000, help="Number of measured requests per scenario.")
+    parser.add_argument("--warmup", type=int, default=100, help="Number of unmeasured requests per scenario.")
+    parser.add_argument("--urls", type=int, default=1000, help="Number of URLs to seed.")
+    parser.add_argument("--snippets", type=int, default=100, help="Number of unencrypted snippets to seed.")
+    parser.add_argument("--encrypted-snippets", type=int, default=10, help="Number of encrypted snippets to seed.")
+    parser.add_argument("--kdf-iterations", type=int, help="Override the PBKDF2 iterations of the new snippets.")
+    parser.add_argument("--group-commit", action="store_true", help="Commit the creates in groups.")
+    parser.add_argument(
+        "--scenarios",
+        type=lambda value: value.split(","),
+        default=list(SCENARIOS),
+        help=f"Comma separated scenarios out of {', '.join(SCENARIOS)}.",
+    )
+    parser.add_argument("--output", help="Write the JSON report to this file instead of stdout.")
+
+    args = parser.parse_args()
+    if unknown := set(args.scenarios) - SCENARIOS.keys():
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    return args
+
+
+def _configure(database: Path, shared_directory: Path, args: argparse.Namespace) -> None:
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "doqfy.settings")
+    for alias in settings.DATABASES.values():
+        alias["NAME"] = database
+    # The shared memory caches and ID filters are shared with the servers of the host, which mustn't
+    # see the seeded rows nor lose their entries when the caches are cleared.
+    for config in settings.CACHES.values():
+        if config["BACKEND"] == "core.shmcache.SharedMemoryCache":
+            config["LOCATION"] = str(shared_directory / Path(config["LOCATION"]).name)
+    for config in getattr(settings, "ID_FILTERS", {}).values():
+        config["LOCATION"] = str(shared_directory / Path(config["LOCATION"]).name)
+    settings.DEBUG = False
+    settings.ALLOWED_HOSTS = ["127.0.0.1"]
+    if args.kdf_iterations is not None:
+        settings.SHAREME_KDF = {"ALGORITHM": "pbkdf2-sha256", "PARAMS": {"iterations": args.kdf_iterations}}
+    if args.group_commit:
+        settings.GROUP_COMMIT = {**settings.GROUP_COMMIT, "ENABLED": True}
+
+    django.setup()
+
+    from django.core.management import call_command  # noqa: PLC0415
+
+    call_command("migrate", verbosity=0)
+
+
+def _seed(args: argparse.Namespace) -> Seed:
+    from django.core.cache import caches  # noqa: PLC0415
+    from shareme.services import SnippetService  # noqa: PLC0415
+    from shorten.services import ShortenerService  # noqa: PLC0415
+
+    seed = Seed()
+    long_urls = [f"https://seed.example/{index}" for index in range(args.urls)]
+    for result in ShortenerService().bulk_get_or_create_short_ids(long_urls):
+        assert result.short_id is not None
+        seed.short_ids.append(result.short_id)
+
+    seed.snippet_ids = [SnippetService().add_snipppet(SNIPPET) for _ in range(args.snippets)]
+    seed.encrypted_snippet_ids = [
+        SnippetService().add_snipppet(SNIPPET, key=SNIPPET_KEY) for _ in range(args.encrypted_snippets)
+    ]
+
+    # Start from cold caches like a freshly started server would.
+    for alias in settings.CACHES:
+        caches[alias].clear()
+    ShortenerService._url_cache.clear()  # noqa: SLF001
+    SnippetService._derived_key_cache.clear()  # noqa: SLF001
+
+    return seed
+
+
+def _run(
+    scenario: Callable[[Client, Seed, random.Random], bool],
+    clients: list[Client],
+    seed: Seed,
+    requests: int,
+    concurrency: int,
+) -> dict[str, Any]:
+    latencies: list[list[float]] = [[] for _ in range(concurrency)]
+    errors = [0] * concurrency
+
+    def work(worker: int) -> None:
+        client = clients[worker]
+        rng = random.Random(worker)  # noqa: S311
+        for _ in range(requests // concurrency + (worker < requests % concurrency)):
+            start = time.perf_counter()
+            try:
+                ok = scenario(client, seed, rng)
+            except Exception:  # noqa: BLE001
+                ok = False
+            latencies[worker].append(time.perf_counter() - start)
+            errors[worker] += not ok
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        list(executor.map(work, range(concurrency)))
+    duration = time.perf_counter() - start
+
+    all_latencies = sorted(latency * 1000 for worker_latencies in latencies for latency in worker_latencies)
+    if not all_latencies:
+        return {"requests": 0, "errors": 0}
+
+    percentiles = statistics.quantiles(all_latencies, n=100, method="inclusive")
+
+    return {
+        "requests": len(all_latencies),
+        "errors": sum(errors),
+        "duration_s": round(duration, 3),
+        "throughput_rps": round(len(all_latencies) / duration, 1),
+        "latency_ms": {
+            "mean": round(statistics.fmean(all_latencies), 3),
+            "p50": round(percentiles[49], 3),
+            "p90": round(percentiles[89], 3),
+            "p99": round(percentiles[98], 3),
+            "max": round(all_latencies[-1], 3),
+        },
+    }
+
+
+class _ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class _QuietWSGIRequestHandler(WSGIRequestHandler):
+    def log_message(self, *_: Any) -> None:  # noqa: ANN401
+        pass
+
+
+@contextlib.contextmanager
+def _serve(transport: str, wsgi_application: Any, asgi_application: Any) -> Iterator[tuple[str, int] | None]:  # noqa: ANN401
+    if transport == "inprocess":
+        yield None
+        return
+
+    if transport == "wsgi":
+        server = make_server(
+            "127.0.0.1",
+            0,
+            wsgi_application,
+            server_class=_ThreadingWSGIServer,
+            handler_class=_QuietWSGIRequestHandler,
+        )
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            yield "127.0.0.1", server.server_port
+        finally:
+            server.shutdown()
+            server.server_close()
+        return
+
+    try:
+        import uvicorn  # noqa: PLC0415
+    except ImportError:
+        sys.exit("The asgi transport needs uvicorn, install it with `pip install uvicorn`.")
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+
+    uvicorn_server = uvicorn.Server(
+        uvicorn.Config(asgi_application, host="127.0.0.1", port=port, lifespan="off", log_level="warning")
+    )
+    thread = threading.Thread(target=uvicorn_server.run, daemon=True)
+    thread.start()
+    while not uvicorn_server.started:
+        time.sleep(0.01)
+    try:
+        yield "127.0.0.1", port
+    finally:
+        uvicorn_server.should_exit = True
+        thread.join()
+
+
+def _tear_down() -> None:
+    from django.db import connections  # noqa: PLC0415
+    from shorten.analytics import click_recorder  # noqa: PLC0415
+
+    # Write the clicks before the database is deleted.
+    click_recorder.flush()
+    connections.close_all()
+
+
+def _get_commit() -> str | None:
+    try:
+        # A fixed command, without any input.
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],  # noqa: S607
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == "__main__":
+    main()
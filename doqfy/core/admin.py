@@ -0,0 +1,5 @@
+from django.contrib import admin
+
+from .models import IdSequence
+
+admin.site.register(IdSequence)
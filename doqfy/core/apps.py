@@ -0,0 +1,19 @@
+from django.apps import AppConfig
+from django.core.signals import request_started
+from django.db.backends.signals import connection_created
+
+from .db import configure_sqlite
+from .expiry import start_sweeper, sweeper
+from .metrics import instrument_queries, metrics
+
+
+class CoreConfig(AppConfig):
+    default_auto_field = "django.db.models.BigAutoField"
+    name = "core"
+
+    def ready(self) -> None:
+        connection_created.connect(configure_sqlite, dispatch_uid="core.db.configure_sqlite")
+        if metrics.enabled:
+            connection_created.connect(instrument_queries, dispatch_uid="core.metrics.instrument_queries")
+        if sweeper.interval is not None:
+            request_started.connect(start_sweeper, dispatch_uid="core.expiry.start_sweeper")
@@ -0,0 +1,301 @@
+import asyncio
+import random
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable, Hashable
+from dataclasses import dataclass, field
+from typing import Any, Final, Generic, TypeVar
+
+from django.core.cache.backends.base import BaseCache
+
+from .metrics import metrics
+
+T = TypeVar("T")
+
+_MISSING: Final = object()
+
+
+class _NegativeEntry:
+    """Marks a key that is known to not have a value.
+
+    Instances compare equal to each other so that the marker survives a trip through a cache
+    backend that pickles the values.
+    """
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, _NegativeEntry)
+
+    def __hash__(self) -> int:
+        return hash(_NegativeEntry)
+
+
+NEGATIVE_ENTRY: Final = _NegativeEntry()
+
+
+class LocalLRUCache:
+    """A bounded, thread safe, in-process LRU cache where every entry has its own expiry."""
+
+    def __init__(self, max_entries: int) -> None:
+        self.max_entries = max_entries
+        self._entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:  # noqa: ANN401
+        with self._lock:
+            try:
+                expires_at, value = self._entries[key]
+            except KeyError:
+                return default
+
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return default
+
+            self._entries.move_to_end(key)
+
+            return value
+
+    def set(self, key: Hashable, value: Any, timeout: float) -> None:  # noqa: ANN401
+        with self._lock:
+            self._entries[key] = (time.monotonic() + timeout, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: Hashable) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+@dataclass
+class _Call(Generic[T]):
+    done: threading.Event = field(default_factory=threading.Event)
+    result: T | None = None
+    error: BaseException | None = None
+
+
+class SingleFlight:
+    """Coalesces concurrent calls for the same key so that only one of them does the work.
+
+    The callers that arrive while a call for the key is in progress wait for it and get the
+    same result (or exception).
+    """
+
+    def __init__(self) -> None:
+        self._calls: dict[Hashable, _Call[Any]] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: Hashable, fn: Callable[[], T]) -> T:
+        with self._lock:
+            call = self._calls.get(key)
+            is_leader = call is None
+            if call is None:
+                call = self._calls[key] = _Call()
+
+        if not is_leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+
+            return call.result
+
+        try:
+            call.result = fn()
+        except BaseException as ex:
+            call.error = ex
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+        return call.result
+
+
+class AsyncSingleFlight:
+    """The `SingleFlight` for coroutines.
+
+    The calls are only coalesced with the ones running on the same event loop.
+    """
+
+    def __init__(self) -> None:
+        self._calls: dict[tuple[int, Hashable], asyncio.Future[Any]] = {}
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        loop = asyncio.get_running_loop()
+        call_key = (id(loop), key)
+        if (future := self._calls.get(call_key)) is not None:
+            return await asyncio.shield(future)
+
+        future = self._calls[call_key] = loop.create_future()
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as ex:
+            future.set_exception(ex)
+            # Nobody may be waiting for the result, so don't let asyncio complain about it.
+            future.exception()
+            raise
+        finally:
+            del self._calls[call_key]
+
+        future.set_result(result)
+
+        return result
+
+
+class TieredCache:
+    """Read-through cache with a bounded in-process LRU in front of a shared Django cache.
+
+    Values that the loader couldn't find are cached as well (for `negative_timeout` seconds), so
+    repeated lookups for keys that don't exist don't reach the database. All the timeouts are
+    randomly spread by `jitter` (a fraction of the timeout) so that entries created together
+    don't all expire together.
+
+    Other processes only see the writes to the shared cache, so an entry in the local cache can
+    be stale for up to `local_timeout` seconds.
+
+    The lookups are counted in the `cache_requests_total` metric and the calls to the shared cache
+    are timed in `cache_seconds`, both labelled with `name`.
+    """
+
+    def __init__(  # noqa: PLR0913
+        self,
+        backend: BaseCache,
+        *,
+        max_local_entries: int = 1024,
+        local_timeout: float = 30,
+        timeout: float = 3600,
+        negative_timeout: float = 60,
+        jitter: float = 0.1,
+        name: str = "default",
+    ) -> None:
+        self.backend = backend
+        self.name = name
+        self.local = LocalLRUCache(max_local_entries)
+        self.local_timeout = local_timeout
+        self.timeout = timeout
+        self.negative_timeout = negative_timeout
+        self.jitter = jitter
+        self._single_flight = SingleFlight()
+        self._async_single_flight = AsyncSingleFlight()
+
+    def get_or_load(self, key: str, loader: Callable[[], T | None]) -> T | None:
+        """Get the value for the key, calling `loader` to get it on a miss.
+
+        The loader should return `None` if there's no value for the key. Concurrent misses for the
+        same key within this process call the loader only once.
+        """
+
+        if (value := self.local.get(key, _MISSING)) is not _MISSING:
+            metrics.inc("cache_requests_total", cache=self.name, result="local_hit")
+            return None if value == NEGATIVE_ENTRY else value
+
+        return self._single_flight.do(key, lambda: self._load(key, loader))
+
+    async def aget_or_load(self, key: str, loader: Callable[[], Awaitable[T | None]]) -> T | None:
+        """Get the value like `get_or_load`, with an async loader."""
+
+        if (value := self.local.get(key, _MISSING)) is not _MISSING:
+            metrics.inc("cache_requests_total", cache=self.name, result="local_hit")
+            return None if value == NEGATIVE_ENTRY else value
+
+        return await self._async_single_flight.do(key, lambda: self._aload(key, loader))
+
+    def get(self, key: str, default: Any = None) -> Any:  # noqa: ANN401
+        """Get the cached value for the key without loading it on a miss.
+
+        Keys that are cached as not having a value give `NEGATIVE_ENTRY`.
+        """
+
+        if (value := self.local.get(key, _MISSING)) is not _MISSING:
+            metrics.inc("cache_requests_total", cache=self.name, result="local_hit")
+            return value
+
+        with metrics.timer("cache_seconds", cache=self.name, operation="get"):
+            value = self.backend.get(key, _MISSING)
+        if value is not _MISSING:
+            metrics.inc("cache_requests_total", cache=self.name, result="shared_hit")
+            self._set_local(key, value)
+            return value
+
+        metrics.inc("cache_requests_total", cache=self.name, result="miss")
+
+        return default
+
+    def set(self, key: str, value: Any) -> None:  # noqa: ANN401
+        with metrics.timer("cache_seconds", cache=self.name, operation="set"):
+            self.backend.set(key, value, self._jittered(self.timeout))
+        self.local.set(key, value, self._jittered(self.local_timeout))
+
+    async def aset(self, key: str, value: Any) -> None:  # noqa: ANN401
+        with metrics.timer("cache_seconds", cache=self.name, operation="set"):
+            await self.backend.aset(key, value, self._jittered(self.timeout))
+        self.local.set(key, value, self._jittered(self.local_timeout))
+
+    def delete(self, key: str) -> None:
+        self.backend.delete(key)
+        self.local.delete(key)
+
+    def clear(self) -> None:
+        self.backend.clear()
+        self.local.clear()
+
+    def _load(self, key: str, loader: Callable[[], T | None]) -> T | None:
+        with metrics.timer("cache_seconds", cache=self.name, operation="get"):
+            value = self.backend.get(key, _MISSING)
+        if value is not _MISSING:
+            metrics.inc("cache_requests_total", cache=self.name, result="shared_hit")
+            self._set_local(key, value)
+
+            return None if value == NEGATIVE_ENTRY else value
+
+        metrics.inc("cache_requests_total", cache=self.name, result="miss")
+        if (value := loader()) is None:
+            with metrics.timer("cache_seconds", cache=self.name, operation="set"):
+                self.backend.set(key, NEGATIVE_ENTRY, self._jittered(self.negative_timeout))
+            self._set_local(key, NEGATIVE_ENTRY)
+
+            return None
+
+        self.set(key, value)
+
+        return value
+
+    async def _aload(self, key: str, loader: Callable[[], Awaitable[T | None]]) -> T | None:
+        with metrics.timer("cache_seconds", cache=self.name, operation="get"):
+            value = await self.backend.aget(key, _MISSING)
+        if value is not _MISSING:
+            metrics.inc("cache_requests_total", cache=self.name, result="shared_hit")
+            self._set_local(key, value)
+
+            return None if value == NEGATIVE_ENTRY else value
+
+        metrics.inc("cache_requests_total", cache=self.name, result="miss")
+        if (value := await loader()) is None:
+            with metrics.timer("cache_seconds", cache=self.name, operation="set"):
+                await self.backend.aset(key, NEGATIVE_ENTRY, self._jittered(self.negative_timeout))
+            self._set_local(key, NEGATIVE_ENTRY)
+
+            return None
+
+        await self.aset(key, value)
+
+        return value
+
+    def _set_local(self, key: str, value: Any) -> None:  # noqa: ANN401
+        timeout = self.local_timeout if value != NEGATIVE_ENTRY else min(self.local_timeout, self.negative_timeout)
+        self.local.set(key, value, self._jittered(timeout))
+
+    def _jittered(self, timeout: float) -> float:
+        return timeout * random.uniform(1 - self.jitter, 1 + self.jitter)  # noqa: S311
@@ -0,0 +1,114 @@
+"""Tuning of the SQLite connections and the routing of the reads to a read-only connection.
+
+Every new SQLite connection runs the PRAGMAs in the `SQLITE_PRAGMAS` setting. With WAL, the readers
+don't block the writer and the writer doesn't block the readers, but there's still only one writer
+at a time. So the reads of the apps in `DATABASE_ROUTING["APPS"]` are sent to a separate, read-only
+connection (`DATABASE_ROUTING["READ_ALIAS"]`, which points to the same file) so that they never wait
+on a connection that's busy writing:
+
+    DATABASE_ROUTING = {
+        "READ_ALIAS": "readonly",
+        "APPS": ["shorten", "shareme"],
+    }
+
+The state kept about a database outside of it, in shared memory, is named after the fingerprint of the
+database (`get_database_fingerprint`).
+"""
+
+import contextlib
+import hashlib
+from pathlib import Path
+from typing import Any, Final
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, models
+from django.db.backends.base.base import BaseDatabaseWrapper
+
+DEFAULT_PRAGMAS: Final[dict[str, str | int]] = {
+    "journal_mode": "wal",
+    "synchronous": "normal",
+    "busy_timeout": 5000,
+}
+
+
+def configure_sqlite(sender: Any, connection: BaseDatabaseWrapper, **kwargs: Any) -> None:  # noqa: ANN401, ARG001
+    """Run the PRAGMAs on the new SQLite connection. Connected to `connection_created`."""
+
+    if connection.vendor != "sqlite":
+        return
+
+    pragmas: dict[str, str | int] = {**DEFAULT_PRAGMAS, **getattr(settings, "SQLITE_PRAGMAS", {})}
+    if connection.alias == _get_routing().get("READ_ALIAS"):
+        pragmas["query_only"] = "on"
+
+    with connection.cursor() as cursor:
+        for name, value in pragmas.items():
+            # PRAGMAs can't be parametrized, but these come from the settings only.
+            cursor.execute(f"PRAGMA {name} = {value}")
+
+
+def get_database_fingerprint(alias: str = DEFAULT_DB_ALIAS) -> str:
+    """Get a short digest that tells the database apart from the others opened with the same settings.
+
+    Such as the temporary databases of the tests and the benchmarks. The digest covers the engine, the
+    name, the host and the port of the database and, for a file, its device and inode, so that a file
+    swapped in at the same path isn't mistaken for the previous one.
+    """
+
+    settings_dict = settings.DATABASES[alias]
+    identity = [
+        settings_dict["ENGINE"],
+        settings_dict["NAME"],
+        settings_dict.get("HOST", ""),
+        settings_dict.get("PORT", ""),
+    ]
+    with contextlib.suppress(OSError, TypeError, ValueError):
+        stat = Path(settings_dict["NAME"]).stat()
+        identity += [str(stat.st_dev), str(stat.st_ino)]
+
+    return hashlib.blake2b("\n".join(map(str, identity)).encode(), digest_size=8).hexdigest()
+
+
+class ReadWriteRouter:
+    """Sends the reads of the routed apps to the read-only alias and all the writes to the default one.
+
+    The reads within a transaction on the default alias stay on it, so that a transaction always
+    sees its own writes.
+    """
+
+    def __init__(self) -> None:
+        routing = _get_routing()
+        self.read_alias: str | None = routing.get("READ_ALIAS")
+        self.apps: frozenset[str] = frozenset(routing.get("APPS", ()))
+
+    def db_for_read(self, model: type[models.Model], **hints: Any) -> str | None:  # noqa: ANN401, ARG002
+        if self.read_alias is None or model._meta.app_label not in self.apps:  # noqa: SLF001
+            return None
+
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+
+        return self.read_alias
+
+    def db_for_write(self, model: type[models.Model], **hints: Any) -> str | None:  # noqa: ANN401, ARG002
+        if model._meta.app_label not in self.apps:  # noqa: SLF001
+            return None
+
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1: models.Model, obj2: models.Model, **hints: Any) -> bool | None:  # noqa: ANN401, ARG002
+        # Both the aliases are the same database.
+        if {obj1._state.db, obj2._state.db} <= {DEFAULT_DB_ALIAS, self.read_alias}:  # noqa: SLF001
+            return True
+
+        return None
+
+    def allow_migrate(self, db: str, app_label: str, **hints: Any) -> bool | None:  # noqa: ANN401, ARG002
+        if db == self.read_alias:
+            return False
+
+        return None
+
+
+def _get_routing() -> dict[str, Any]:
+    return getattr(settings, "DATABASE_ROUTING", {})
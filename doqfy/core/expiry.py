@@ -0,0 +1,138 @@
+"""Expiry of the short URLs and the snippets.
+
+The expired rows are refused by the reads as soon as they expire, without writing anything, and are
+deleted later on by the sweeper: either `python manage.py purge_expired` (from cron, say) or, with
+`EXPIRY["SWEEP_INTERVAL"]` set, a background thread in each server process. The rows are deleted in
+batches of `EXPIRY["BATCH_SIZE"]`, each in its own transaction, so the sweep never holds the write
+lock for long.
+
+The apps register what's expired for them with `sweeper.register` in their `AppConfig.ready`.
+"""
+
+import logging
+import threading
+import time
+from collections.abc import Callable
+from datetime import datetime, timedelta
+from typing import Any, Final, NamedTuple
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import QuerySet
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+
+class ExpiryChoice(NamedTuple):
+    label: str
+    period: timedelta
+
+
+EXPIRY_CHOICES: Final[dict[str, ExpiryChoice]] = {
+    "1h": ExpiryChoice("1 hour", timedelta(hours=1)),
+    "1d": ExpiryChoice("1 day", timedelta(days=1)),
+    "1w": ExpiryChoice("1 week", timedelta(weeks=1)),
+    "30d": ExpiryChoice("30 days", timedelta(days=30)),
+}
+"""The expiry periods offered by the forms, by the value of the form field."""
+
+
+def get_expires_at(expires_in: str | None) -> datetime | None:
+    """Get the expiry time for one of the `EXPIRY_CHOICES`. An empty value never expires.
+
+    Raises `ValueError` for the unknown choices.
+    """
+
+    if not expires_in:
+        return None
+
+    try:
+        return timezone.now() + EXPIRY_CHOICES[expires_in].period
+    except KeyError as ex:
+        raise ValueError(f"unknown expiry {expires_in!r}") from ex
+
+
+def is_expired(expires_at: float | None) -> bool:
+    """Whether the POSIX timestamp is in the past. `None` never expires."""
+
+    return expires_at is not None and expires_at <= time.time()
+
+
+class ExpirySweeper:
+    """Deletes the expired rows in bounded batches.
+
+    Each source is a callable that gives the queryset of the currently expired rows of a model. The
+    background thread is started by `start`, and with an `interval` of `None` there's no thread and
+    `sweep` has to be called explicitly.
+    """
+
+    def __init__(self, *, interval: float | None = None, batch_size: int = 500) -> None:
+        self.interval = interval
+        self.batch_size = batch_size
+        self._sources: dict[str, Callable[[], QuerySet]] = {}
+        self._thread: threading.Thread | None = None
+        self._thread_lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls) -> "ExpirySweeper":
+        config: dict[str, Any] = getattr(settings, "EXPIRY", {})
+
+        return cls(interval=config.get("SWEEP_INTERVAL"), batch_size=config.get("BATCH_SIZE", 500))
+
+    def register(self, name: str, get_expired: Callable[[], QuerySet]) -> None:
+        self._sources[name] = get_expired
+
+    def sweep(self, batch_size: int | None = None) -> dict[str, int]:
+        """Delete all the expired rows. Returns the number of rows deleted per source."""
+
+        batch_size = batch_size or self.batch_size
+        deleted: dict[str, int] = {}
+        for name, get_expired in self._sources.items():
+            deleted[name] = 0
+            while True:
+                expired = get_expired()
+                pks = list(expired.values_list("pk", flat=True)[:batch_size])
+                if not pks:
+                    break
+
+                # A sliced queryset can't be deleted. Filtering the expired rows again skips the ones
+                # that changed in the meantime.
+                get_expired().filter(pk__in=pks).delete()
+                deleted[name] += len(pks)
+
+        return deleted
+
+    def start(self) -> None:
+        if self._thread is not None or self.interval is None:
+            return
+
+        with self._thread_lock:
+            if self._thread is not None:
+                return
+
+            self._thread = threading.Thread(target=self._run, args=(self.interval,), name="expiry-sweeper", daemon=True)
+            self._thread.start()
+
+    def _run(self, interval: float) -> None:
+        while True:
+            time.sleep(interval)
+            try:
+                self.sweep()
+            except Exception:
+                logger.exception("failed to delete the expired rows")
+            finally:
+                close_old_connections()
+
+
+sweeper = ExpirySweeper.from_settings()
+
+
+def start_sweeper(sender: Any, **kwargs: Any) -> None:  # noqa: ANN401, ARG001
+    """Start the sweeper on the first request. Connected to `request_started` if it has an interval.
+
+    The redirects that take the fast path in `shorten.fastpath` don't send the signal, so it starts the
+    sweeper itself.
+    """
+
+    sweeper.start()
@@ -0,0 +1,136 @@
+"""Group commit of the small write transactions.
+
+SQLite has a single writer, and every commit takes the write lock and syncs the WAL, so the concurrent
+creates of short URLs and snippets end up committing one after the other at the speed of the disk.
+With `GROUP_COMMIT["ENABLED"]`, the writes are handed to a writer thread instead:
+
+    group_commit.run(functools.partial(url.save, force_insert=True))
+
+The writer thread commits the writes that arrived within `MAX_DELAY` seconds of the first one, up to
+`MAX_BATCH` of them, in a single transaction and only then wakes up the callers. Each write runs in its
+own savepoint, so a write that fails (say with an `IntegrityError`) is rolled back on its own and its
+exception is raised to its caller, just as if it had its own transaction.
+
+The writes that are run within a transaction, and all of them when the group commit is disabled, are
+run right away in a transaction (or savepoint) of their own.
+"""
+
+import copy
+import logging
+import queue
+import threading
+import time
+from collections.abc import Callable
+from concurrent.futures import Future
+from typing import Any, TypeVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+_Write = tuple[Callable[[], Any], Future]
+
+
+class GroupCommitWriter:
+    def __init__(self, *, enabled: bool = False, max_delay: float = 0.002, max_batch: int = 64) -> None:
+        self.enabled = enabled
+        self.max_delay = max_delay
+        self.max_batch = max_batch
+        self._writes: queue.SimpleQueue[_Write] = queue.SimpleQueue()
+        self._thread: threading.Thread | None = None
+        self._thread_lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls) -> "GroupCommitWriter":
+        config: dict[str, Any] = getattr(settings, "GROUP_COMMIT", {})
+
+        return cls(
+            enabled=config.get("ENABLED", False),
+            max_delay=config.get("MAX_DELAY", 0.002),
+            max_batch=config.get("MAX_BATCH", 64),
+        )
+
+    def run(self, write: Callable[[], T]) -> T:
+        """Run the write in a transaction, which may be shared with other writes.
+
+        Returns once the transaction is committed. Raises whatever the write raised, or the error of the
+        commit if the whole transaction failed.
+        """
+
+        # The writer thread couldn't see the writes of the ongoing transaction, nor get the write lock
+        # until it's over.
+        if not self.enabled or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            with transaction.atomic():
+                return write()
+
+        self._start()
+        future: Future[T] = Future()
+        self._writes.put((write, future))
+
+        return future.result()
+
+    def _start(self) -> None:
+        if self._thread is not None:
+            return
+
+        with self._thread_lock:
+            if self._thread is not None:
+                return
+
+            self._thread = threading.Thread(target=self._run, name="group-commit", daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._writes.get()]
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._writes.get(timeout=max(deadline - time.monotonic(), 0)))
+                except queue.Empty:
+                    break
+
+            self._commit(batch)
+
+    def _commit(self, batch: list[_Write]) -> None:
+        outcomes: list[tuple[Any, BaseException | None]] = []
+        try:
+            with metrics.timer("group_commit_seconds"), transaction.atomic():
+                for write, _ in batch:
+                    try:
+                        with transaction.atomic():
+                            outcomes.append((write(), None))
+                    except Exception as ex:  # noqa: BLE001
+                        outcomes.append((None, ex))
+        except Exception as ex:
+            logger.exception("failed to commit %d write(s)", len(batch))
+            # The connection may be broken, the next batch opens a new one.
+            connections[DEFAULT_DB_ALIAS].close()
+            # An exception per caller, since raising one changes its traceback.
+            outcomes = [(None, _copy_error(ex)) for _ in batch]
+
+        metrics.inc("group_commit_batches_total")
+        metrics.inc("group_commit_writes_total", len(batch))
+        # Only once committed, so that the callers see each other's writes.
+        for (_, future), (result, error) in zip(batch, outcomes, strict=True):
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+
+group_commit = GroupCommitWriter.from_settings()
+
+
+def _copy_error(ex: Exception) -> Exception:
+    """Copy the exception, as if raised `from` the original."""
+
+    error = copy.copy(ex)
+    error.__cause__ = ex
+
+    return error
@@ -0,0 +1,325 @@
+"""Bloom filters of the issued IDs, for answering the unknown IDs without looking them up.
+
+The redirects and the snippets are looked up by the ID in their path, so the scanners and the typos
+would otherwise each cost a cache miss and a query. The filters are configured through the
+`ID_FILTERS` setting, with the same aliases as `ID_ALLOCATORS`:
+
+    ID_FILTERS = {
+        "short-url": {"LOCATION": "doqfy-short-url-ids", "CAPACITY": 1_000_000, "ERROR_RATE": 0.01},
+    }
+
+and are accessed through `id_filters`. The apps `track` the model of each filter in their
+`AppConfig.ready`, which adds the IDs of the rows saved from then on, and the filter is built from the
+primary keys of the table by the first server process that starts (see `IdFilterHandler.build_on_startup`)
+or by `python manage.py build_id_filters`. The rows created with `bulk_create` have to be added
+explicitly.
+
+Like `core.shmcache`, the bits are in a memory-mapped file shared by all the processes of the host,
+since a filter per process wouldn't know about the IDs created by the other processes. `LOCATION` is
+relative to the same directory, and an absolute path on disk keeps the filter across reboots. The fingerprint of
+the database (see `core.db.get_database_fingerprint`) is added to the name of the file, so that another
+database opened with the same settings gets a filter of its own.
+
+A filter that was already built is still checked against the database by every process before it
+rejects anything: if a sample of the IDs of the table isn't in it, say after the database was restored
+in place, the IDs of the table are added again. Until then, every ID may exist. The file is never
+rebuilt from scratch, so the deleted IDs stay in it as false positives until it's deleted with the
+servers stopped. Only for Unix.
+"""
+
+import contextlib
+import fcntl
+import functools
+import hashlib
+import logging
+import math
+import mmap
+import os
+import struct
+import threading
+from collections.abc import Iterable, Iterator
+from pathlib import Path
+from typing import Any, Final
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DEFAULT_DB_ALIAS, connections, models
+from django.db.models.signals import post_save
+
+from .db import get_database_fingerprint
+from .ids import IdAllocator
+from .metrics import metrics
+from .shmcache import get_shared_directory
+
+logger = logging.getLogger(__name__)
+
+_MAGIC: Final[bytes] = b"doqfyidf"
+
+_HEADER: Final[struct.Struct] = struct.Struct("<8sQI")
+"""Magic, number of bits and number of hashes."""
+
+_READY_OFFSET: Final[int] = _HEADER.size
+"""The byte set once the filter has been built."""
+
+_BUILD_BATCH_SIZE: Final[int] = 10_000
+
+_CHECK_SAMPLE_SIZE: Final[int] = 1000
+"""How many IDs of the table a built filter is checked against. The IDs are permuted, so the last ones by
+primary key are a sample of them all."""
+
+
+class _BloomFile:
+    def __init__(self, path: Path, *, capacity: int, error_rate: float) -> None:
+        if capacity < 1 or not 0 < error_rate < 1:
+            raise ImproperlyConfigured(f"invalid CAPACITY or ERROR_RATE for the ID filter {path}")
+
+        self.bits = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        self.hashes = max(round(self.bits / capacity * math.log(2)), 1)
+        self._data_offset = mmap.PAGESIZE
+        size = self._data_offset + (self.bits + 7) // 8
+        # The lock is on the byte past the end of the file, which doesn't need to have it.
+        self._lock_offset = size
+        self._thread_lock = threading.Lock()
+
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        with self.lock():
+            header = _HEADER.pack(_MAGIC, self.bits, self.hashes)
+            if os.fstat(self._fd).st_size == 0:
+                # See `core.shmcache._Table`.
+                if hasattr(os, "posix_fallocate"):
+                    os.posix_fallocate(self._fd, 0, size)
+                else:
+                    os.ftruncate(self._fd, size)
+                os.pwrite(self._fd, header, 0)
+            elif os.pread(self._fd, _HEADER.size, 0) != header:
+                raise ImproperlyConfigured(f"{path} was created with a different CAPACITY or ERROR_RATE, delete it")
+
+        self._mmap = mmap.mmap(self._fd, size)
+
+    @property
+    def ready(self) -> bool:
+        return bool(self._mmap[_READY_OFFSET])
+
+    def set_ready(self) -> None:
+        self._mmap[_READY_OFFSET] = 1
+
+    def might_contain(self, item: str) -> bool:
+        # Without the lock: the bits are only ever set, and a byte is read or written at once.
+        return all(self._mmap[self._data_offset + (bit >> 3)] & (1 << (bit & 7)) for bit in self._get_bits(item))
+
+    def add_locked(self, item: str) -> None:
+        """Add the item within `lock`, which keeps the other writers from losing the bits of the same byte."""
+
+        for bit in self._get_bits(item):
+            self._mmap[self._data_offset + (bit >> 3)] |= 1 << (bit & 7)
+
+    @contextlib.contextmanager
+    def lock(self) -> Iterator[None]:
+        # The fcntl locks belong to the process, so they don't keep out the other threads of the process.
+        with self._thread_lock:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, 1, self._lock_offset)
+            try:
+                yield
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, self._lock_offset)
+
+    def _get_bits(self, item: str) -> Iterator[int]:
+        # Double hashing, with the second hash odd so that it never repeats the first bit.
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        for index in range(self.hashes):
+            yield (first + index * second) % self.bits
+
+
+class IdFilter:
+    """Tells the IDs that were never issued apart from the ones that may have been.
+
+    A filter without a location is disabled: every ID may have been issued. So is a filter that this
+    process hasn't built or checked against the database yet, see `build`.
+    """
+
+    max_skips: Final[int] = 3
+    """How many allocated IDs in a row `allocate` skips before handing out one the filter knows about."""
+
+    def __init__(
+        self, name: str, location: str | None = None, capacity: int = 1_000_000, error_rate: float = 0.01
+    ) -> None:
+        self.name = name
+        self._location = location
+        self._capacity = capacity
+        self._error_rate = error_rate
+        self._model: type[models.Model] | None = None
+        # Whether the filter was built or checked against the database by this process.
+        self._checked = False
+
+    @property
+    def ready(self) -> bool:
+        return self._checked and self._bloom is not None and self._bloom.ready
+
+    @functools.cached_property
+    def _bloom(self) -> _BloomFile | None:
+        # Opened on first use, once the database is configured.
+        if self._location is None:
+            return None
+
+        path = get_shared_directory() / f"{self._location}-{get_database_fingerprint(DEFAULT_DB_ALIAS)}"
+
+        return _BloomFile(path, capacity=self._capacity, error_rate=self._error_rate)
+
+    def is_unknown(self, id_: str) -> bool:
+        """Whether the ID was definitely never issued, in which case there's no need to look it up."""
+
+        if self._might_contain(id_):
+            return False
+
+        metrics.inc("id_filter_rejections_total", filter=self.name)
+
+        return True
+
+    def add(self, id_: str) -> None:
+        self.add_many((id_,))
+
+    def add_many(self, ids: Iterable[str]) -> None:
+        """Add the IDs of new rows, before the rows are committed so that they're never rejected."""
+
+        if self._bloom is None:
+            return
+
+        with self._bloom.lock():
+            for id_ in ids:
+                self._bloom.add_locked(id_)
+
+    def allocate(self, allocator: IdAllocator) -> str:
+        """Allocate an ID, skipping the ones that may have been issued already.
+
+        This saves a failing insert on the IDs that are known to be taken. Since the filter can't tell
+        them apart from the false positives, it gives up after `max_skips` of them in a row.
+        """
+
+        for _ in range(self.max_skips):
+            id_ = allocator.allocate()
+            if not self._is_known(id_):
+                return id_
+
+            metrics.inc("id_filter_skips_total", filter=self.name)
+
+        return allocator.allocate()
+
+    def allocate_many(self, allocator: IdAllocator, count: int) -> list[str]:
+        ids = allocator.allocate_many(count)
+        for index, id_ in enumerate(ids):
+            if self._is_known(id_):
+                metrics.inc("id_filter_skips_total", filter=self.name)
+                ids[index] = self.allocate(allocator)
+
+        return ids
+
+    def track(self, model: type[models.Model]) -> None:
+        """Add the primary keys of the rows of the model as they're saved, and build the filter from them."""
+
+        self._model = model
+        post_save.connect(self._on_save, sender=model, dispatch_uid=f"core.idfilter.{self.name}")
+
+    def build(self, *, force: bool = False) -> int | None:
+        """Add all the IDs of the tracked model, unless the filter was already built from the database.
+
+        A filter that was already built is checked against a sample of the IDs of the table, and built
+        again if any of them is missing. Returns the number of IDs added, or `None` if the filter was
+        already built. The other processes can't add IDs in the meantime, so the IDs created during the
+        build can't be missed.
+        """
+
+        if self._bloom is None or self._model is None:
+            return None
+
+        with self._bloom.lock():
+            if self._bloom.ready and not force:
+                if self._matches_database(self._bloom, self._model):
+                    self._checked = True
+                    return None
+
+                logger.warning("the ID filter %s doesn't match the database, building it again", self.name)
+
+            count = 0
+            for id_ in self._model._default_manager.values_list("pk", flat=True).iterator(  # noqa: SLF001
+                chunk_size=_BUILD_BATCH_SIZE
+            ):
+                self._bloom.add_locked(id_)
+                count += 1
+
+            self._bloom.set_ready()
+
+        self._checked = True
+
+        return count
+
+    def _might_contain(self, id_: str) -> bool:
+        """Whether the ID may have been issued, which is always the case until the filter is ready."""
+
+        return not self.ready or self._bloom is None or self._bloom.might_contain(id_)
+
+    def _is_known(self, id_: str) -> bool:
+        """Whether the ready filter knows about the ID, which is then likely to have been issued."""
+
+        return self.ready and self._bloom is not None and self._bloom.might_contain(id_)
+
+    @staticmethod
+    def _matches_database(bloom: _BloomFile, model: type[models.Model]) -> bool:
+        # A filter has no false negatives, so a missing ID means it was built from another database.
+        sample = model._default_manager.order_by("-pk").values_list("pk", flat=True)[:_CHECK_SAMPLE_SIZE]  # noqa: SLF001
+
+        return all(bloom.might_contain(id_) for id_ in sample)
+
+    def _on_save(self, sender: Any, instance: models.Model, created: bool, **kwargs: Any) -> None:  # noqa: ANN401, ARG002, FBT001
+        if created:
+            self.add(instance.pk)
+
+
+class IdFilterHandler:
+    """Lazily creates the filters configured in `ID_FILTERS` and keeps one per alias.
+
+    The aliases that aren't configured get a disabled filter.
+    """
+
+    def __init__(self) -> None:
+        self._filters: dict[str, IdFilter] = {}
+        self._lock = threading.Lock()
+
+    def __getitem__(self, alias: str) -> IdFilter:
+        if (id_filter := self._filters.get(alias)) is not None:
+            return id_filter
+
+        with self._lock:
+            if alias not in self._filters:
+                config: dict[str, Any] = getattr(settings, "ID_FILTERS", {}).get(alias, {})
+                self._filters[alias] = IdFilter(
+                    alias,
+                    location=config.get("LOCATION"),
+                    capacity=config.get("CAPACITY", 1_000_000),
+                    error_rate=config.get("ERROR_RATE", 0.01),
+                )
+
+            return self._filters[alias]
+
+    def build(self, *, force: bool = False) -> dict[str, int | None]:
+        """Build or check the filters, or build all of them with `force`. See `IdFilter.build`."""
+
+        return {alias: id_filter.build(force=force) for alias, id_filter in self._filters.items()}
+
+    def build_on_startup(self) -> None:
+        """Build or check the filters, without ever failing the startup. Until then, they reject nothing."""
+
+        try:
+            built = {alias: count for alias, count in self.build().items() if count is not None}
+        except Exception:
+            logger.exception("failed to build the ID filters")
+        else:
+            if built:
+                logger.info("built the ID filters: %s", built)
+        finally:
+            # The connections mustn't be shared with the processes forked from this one.
+            connections.close_all()
+
+
+id_filters = IdFilterHandler()
@@ -0,0 +1,234 @@
+"""Allocation of the short, random looking IDs used by the apps.
+
+The allocators are configured through the `ID_ALLOCATORS` setting, similar to `CACHES`:
+
+    ID_ALLOCATORS = {
+        "short-url": {
+            "BACKEND": "core.ids.SequenceIdAllocator",
+            "OPTIONS": {"length": 8},
+        },
+    }
+
+and are accessed through `allocators`, e.g. `allocators["short-url"].allocate()`.
+"""
+
+import hashlib
+import hmac
+import secrets
+import string
+import threading
+from abc import ABC, abstractmethod
+from typing import Any, Final
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils.module_loading import import_string
+
+from .models import IdSequence
+
+BASE62_ALPHABET: Final[str] = string.digits + string.ascii_uppercase + string.ascii_lowercase
+
+
+class IdSpaceExhaustedError(Exception):
+    ...
+
+
+class IdAllocator(ABC):
+    """Base class for the ID allocators."""
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+
+    @abstractmethod
+    def allocate(self) -> str:
+        """Get a new ID."""
+
+    def allocate_many(self, count: int) -> list[str]:
+        """Get `count` new IDs."""
+
+        return [self.allocate() for _ in range(count)]
+
+
+class RandomIdAllocator(IdAllocator):
+    """Allocator that generates random IDs made up of ASCII letters.
+
+    The IDs are not guaranteed to be unique, so callers must be ready to handle collisions.
+    """
+
+    def __init__(self, name: str, length: int = 8) -> None:
+        super().__init__(name)
+        self.length = length
+
+    def allocate(self) -> str:
+        return "".join(secrets.choice(string.ascii_letters) for _ in range(self.length))
+
+
+class SequenceIdAllocator(IdAllocator):
+    """Allocator that derives the IDs from a database backed sequence.
+
+    Each process reserves a block of `block_size` sequence numbers with a single write and then
+    hands them out from memory. Every number is mapped through a keyed permutation of the
+    `62 ** length` possible IDs before being base62 encoded so that the IDs don't reveal the
+    order in which they were created and can't be enumerated without the key.
+
+    Since the permutation is a bijection, two different sequence numbers never map to the same
+    ID. Changing the key (which defaults to one derived from `SECRET_KEY`) changes the mapping
+    though, and the new IDs may then collide with the ones already issued.
+    """
+
+    def __init__(self, name: str, length: int = 8, block_size: int = 1000, key: str | bytes | None = None) -> None:
+        super().__init__(name)
+        if block_size < 1:
+            raise ImproperlyConfigured("`block_size` must be positive")
+
+        self.length = length
+        self.block_size = block_size
+        self._permutation = FeistelPermutation(len(BASE62_ALPHABET) ** length, _get_key(name, key))
+
+        self._lock = threading.Lock()
+        self._next = 0
+        self._end = 0
+
+    def allocate(self) -> str:
+        return self.allocate_many(1)[0]
+
+    def allocate_many(self, count: int) -> list[str]:
+        numbers: list[int] = []
+        with self._lock:
+            while len(numbers) < count:
+                if self._next >= self._end:
+                    self._next = self._reserve_block()
+                    self._end = self._next + self.block_size
+
+                take = min(count - len(numbers), self._end - self._next)
+                numbers.extend(range(self._next, self._next + take))
+                self._next += take
+
+        if numbers[-1] >= self._permutation.domain:
+            raise IdSpaceExhaustedError(f"all the IDs of length {self.length} for {self.name!r} have been used")
+
+        return [encode_base62(self._permutation.permute(number), self.length) for number in numbers]
+
+    def _reserve_block(self) -> int:
+        """Reserve the next block of sequence numbers and return the first number in it.
+
+        This should not be called from within a transaction that may be rolled back since the
+        same block would then be handed out again.
+        """
+
+        while True:
+            with transaction.atomic():
+                updated = IdSequence.objects.filter(name=self.name).update(
+                    next_value=F("next_value") + self.block_size
+                )
+                if updated:
+                    # The row is locked until the end of the transaction, so this is the value we set.
+                    return IdSequence.objects.get(name=self.name).next_value - self.block_size
+
+            try:
+                with transaction.atomic():
+                    IdSequence.objects.create(name=self.name, next_value=self.block_size)
+                    return 0
+            except IntegrityError:
+                # Another process created the sequence first.
+                continue
+
+
+class FeistelPermutation:
+    """A keyed pseudo random permutation of the integers in `[0, domain)`.
+
+    This is a balanced Feistel network over the smallest even number of bits that covers the
+    domain, with cycle walking to map the values that fall outside of the domain back into it.
+    """
+
+    ROUNDS: Final[int] = 4
+
+    def __init__(self, domain: int, key: bytes) -> None:
+        self.domain = domain
+        self._half_bits = (max(domain - 1, 1).bit_length() + 1) // 2
+        self._half_mask = (1 << self._half_bits) - 1
+        self._key = key
+
+    def permute(self, value: int) -> int:
+        if not 0 <= value < self.domain:
+            raise ValueError(f"{value} is outside of the domain [0, {self.domain})")
+
+        value = self._encrypt(value)
+        while value >= self.domain:
+            value = self._encrypt(value)
+
+        return value
+
+    def _encrypt(self, value: int) -> int:
+        left = value >> self._half_bits
+        right = value & self._half_mask
+        for round_ in range(self.ROUNDS):
+            left, right = right, left ^ self._round_function(round_, right)
+
+        return (left << self._half_bits) | right
+
+    def _round_function(self, round_: int, value: int) -> int:
+        digest = hashlib.blake2b(
+            round_.to_bytes(1, "big") + value.to_bytes(8, "big"), key=self._key, digest_size=8
+        ).digest()
+
+        return int.from_bytes(digest, "big") & self._half_mask
+
+
+def encode_base62(value: int, length: int) -> str:
+    """Encode the value as a base62 string padded to `length` characters."""
+
+    chars = ["0"] * length
+    for index in range(length - 1, -1, -1):
+        value, remainder = divmod(value, 62)
+        chars[index] = BASE62_ALPHABET[remainder]
+
+    if value:
+        raise ValueError(f"value does not fit in {length} base62 characters")
+
+    return "".join(chars)
+
+
+class AllocatorHandler:
+    """Lazily creates the allocators configured in `ID_ALLOCATORS` and keeps one per alias."""
+
+    def __init__(self) -> None:
+        self._allocators: dict[str, IdAllocator] = {}
+        self._lock = threading.Lock()
+
+    def __getitem__(self, alias: str) -> IdAllocator:
+        if (allocator := self._allocators.get(alias)) is not None:
+            return allocator
+
+        with self._lock:
+            if alias not in self._allocators:
+                self._allocators[alias] = self._create(alias)
+
+            return self._allocators[alias]
+
+    def _create(self, alias: str) -> IdAllocator:
+        configs: dict[str, dict[str, Any]] = getattr(settings, "ID_ALLOCATORS", {})
+        try:
+            config = configs[alias]
+        except KeyError as ex:
+            raise ImproperlyConfigured(f"the ID allocator {alias!r} is not configured in ID_ALLOCATORS") from ex
+
+        backend = import_string(config.get("BACKEND", "core.ids.SequenceIdAllocator"))
+
+        return backend(alias, **config.get("OPTIONS", {}))
+
+
+allocators = AllocatorHandler()
+
+
+def _get_key(name: str, key: str | bytes | None) -> bytes:
+    if key is None:
+        key = settings.SECRET_KEY
+
+    if isinstance(key, str):
+        key = key.encode()
+
+    # Derive a separate key per allocator so that the sequences map to unrelated IDs.
+    return hmac.new(key, f"core.ids.{name}".encode(), hashlib.sha256).digest()
@@ -0,0 +1,21 @@
+from typing import Any
+
+from django.core.management.base import BaseCommand, CommandParser
+
+from core.idfilter import id_filters
+
+
+class Command(BaseCommand):
+    help = (
+        "Build the filters of the issued IDs from the database. The server processes build the ones that "
+        "weren't built yet on startup, --force adds all the IDs again, say after restoring the database."
+    )
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument("--force", action="store_true", help="Also add the IDs to the filters already built.")
+
+    def handle(self, *_: Any, **options: Any) -> None:  # noqa: ANN401
+        for alias, count in id_filters.build(force=options["force"]).items():
+            self.stdout.write(f"{alias}: {'already built' if count is None else count}")
+
+        self.stdout.write(self.style.SUCCESS("Done."))
@@ -0,0 +1,21 @@
+from typing import Any
+
+from django.core.management.base import BaseCommand, CommandParser
+
+from core.expiry import sweeper
+
+
+class Command(BaseCommand):
+    help = "Delete the expired short URLs and snippets, and the snippets that ran out of reads."
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument(
+            "--batch-size", type=int, default=sweeper.batch_size, help="Number of rows deleted per transaction."
+        )
+
+    def handle(self, *_: Any, **options: Any) -> None:  # noqa: ANN401
+        deleted = sweeper.sweep(options["batch_size"])
+        for name, count in deleted.items():
+            self.stdout.write(f"{name}: {count}")
+
+        self.stdout.write(self.style.SUCCESS(f"Deleted {sum(deleted.values())} expired row(s)."))
@@ -0,0 +1,27 @@
+from typing import Any
+
+from django.core.management.base import BaseCommand, CommandParser
+
+from core.warmup import warmer
+
+
+class Command(BaseCommand):
+    help = (
+        "Preload the most clicked short URLs and the most recent snippets into the caches. Only useful "
+        "with cache backends shared between the processes, the server processes warm their own on startup."
+    )
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument(
+            "--max-items", type=int, default=warmer.max_items, help="Maximum number of items loaded per source."
+        )
+        parser.add_argument(
+            "--time-budget", type=float, default=warmer.time_budget, help="Maximum number of seconds spent loading."
+        )
+
+    def handle(self, *_: Any, **options: Any) -> None:  # noqa: ANN401
+        loaded = warmer.warm(options["max_items"], options["time_budget"])
+        for name, count in loaded.items():
+            self.stdout.write(f"{name}: {count}")
+
+        self.stdout.write(self.style.SUCCESS(f"Loaded {sum(loaded.values())} item(s)."))
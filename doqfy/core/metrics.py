@@ -0,0 +1,191 @@
+"""In-process counters and timers, exposed in the Prometheus text format at `/metrics`.
+
+    metrics.inc("id_collisions_total", allocator="short-url")
+    with metrics.timer("kdf_seconds", kdf="scrypt"):
+        ...
+
+The metrics are per process, so each worker process has to be scraped on its own. They're off unless
+`METRICS["ENABLED"]` is set, since `/metrics` isn't authenticated. When off, `inc` returns right away and
+`timer` gives a shared no-op context manager.
+"""
+
+import bisect
+import contextlib
+import threading
+import time
+from collections.abc import Callable
+from contextlib import AbstractContextManager
+from typing import Any, Final
+
+from django.conf import settings
+from django.db.backends.base.base import BaseDatabaseWrapper
+
+PREFIX: Final[str] = "doqfy_"
+
+BUCKETS: Final[tuple[float, ...]] = (
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+)
+"""The upper bounds of the buckets of the timers, in seconds."""
+
+_NULL_TIMER: Final[AbstractContextManager[None]] = contextlib.nullcontext()
+
+Labels = tuple[tuple[str, str], ...]
+
+
+class _Histogram:
+    __slots__ = ("counts", "sum")
+
+    def __init__(self) -> None:
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+
+
+class _Timer:
+    __slots__ = ("_key", "_metrics", "_start")
+
+    def __init__(self, metrics: "Metrics", key: tuple[str, Labels]) -> None:
+        self._metrics = metrics
+        self._key = key
+        self._start = 0.0
+
+    def __enter__(self) -> None:
+        self._start = time.perf_counter()
+
+    def __exit__(self, *_: object) -> None:
+        self._metrics._observe(self._key, time.perf_counter() - self._start)  # noqa: SLF001
+
+
+class Metrics:
+    def __init__(self, *, enabled: bool = False) -> None:
+        self.enabled = enabled
+        self._counters: dict[tuple[str, Labels], float] = {}
+        self._histograms: dict[tuple[str, Labels], _Histogram] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls) -> "Metrics":
+        config: dict[str, Any] = getattr(settings, "METRICS", {})
+
+        return cls(enabled=config.get("ENABLED", False))
+
+    def inc(self, name: str, value: float = 1, **labels: str) -> None:
+        if not self.enabled:
+            return
+
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def timer(self, name: str, **labels: str) -> AbstractContextManager[None]:
+        """Time the block, in seconds."""
+
+        if not self.enabled:
+            return _NULL_TIMER
+
+        return _Timer(self, (name, tuple(sorted(labels.items()))))
+
+    def observe(self, name: str, seconds: float, **labels: str) -> None:
+        if self.enabled:
+            self._observe((name, tuple(sorted(labels.items()))), seconds)
+
+    def render(self) -> str:
+        """Render the metrics in the Prometheus text format."""
+
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(
+                ((key, list(histogram.counts), histogram.sum) for key, histogram in self._histograms.items()),
+                key=lambda item: item[0],
+            )
+
+        lines: list[str] = []
+        typed: set[str] = set()
+        for (name, labels), value in counters:
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {PREFIX}{name} counter")
+            lines.append(f"{PREFIX}{name}{_render_labels(labels)} {_format(value)}")
+
+        for (name, labels), counts, total in histograms:
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {PREFIX}{name} histogram")
+            cumulative = 0
+            for bound, count in zip((*BUCKETS, "+Inf"), counts, strict=True):
+                cumulative += count
+                lines.append(f"{PREFIX}{name}_bucket{_render_labels((*labels, ('le', f'{bound}')))} {cumulative}")
+            lines.append(f"{PREFIX}{name}_sum{_render_labels(labels)} {_format(total)}")
+            lines.append(f"{PREFIX}{name}_count{_render_labels(labels)} {cumulative}")
+
+        return "\n".join(lines) + "\n" if lines else ""
+
+    def clear(self) -> None:
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def _observe(self, key: tuple[str, Labels], seconds: float) -> None:
+        index = bisect.bisect_left(BUCKETS, seconds)
+        with self._lock:
+            if (histogram := self._histograms.get(key)) is None:
+                histogram = self._histograms[key] = _Histogram()
+            histogram.counts[index] += 1
+            histogram.sum += seconds
+
+
+metrics = Metrics.from_settings()
+
+
+def instrument_queries(sender: Any, connection: BaseDatabaseWrapper, **kwargs: Any) -> None:  # noqa: ANN401, ARG001
+    """Time every query of the new connection. Connected to `connection_created` when the metrics are enabled."""
+
+    # Sent again every time the connection is reopened, on the same wrapper.
+    if _time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_time_query)
+
+
+def _time_query(
+    execute: Callable[..., Any],
+    sql: str,
+    params: Any,  # noqa: ANN401
+    many: bool,  # noqa: FBT001
+    context: dict[str, Any],
+) -> Any:  # noqa: ANN401
+    statement = sql.lstrip()[:6].lower()
+    if statement not in ("select", "insert", "update", "delete"):
+        statement = "other"
+
+    with metrics.timer("db_query_seconds", alias=context["connection"].alias, statement=statement):
+        return execute(sql, params, many, context)
+
+
+def _format(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _render_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+
+    rendered = ",".join(f'{name}="{_escape(value)}"' for name, value in labels)
+
+    return f"{{{rendered}}}"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
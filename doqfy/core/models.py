@@ -0,0 +1,11 @@
+from django.db import models
+
+
+class IdSequence(models.Model):
+    """A named counter from which the ID allocators reserve blocks of numbers."""
+
+    name = models.CharField(primary_key=True, max_length=50)
+    next_value = models.BigIntegerField(default=0)
+
+    def __str__(self) -> str:
+        return f"IdSequence(name={self.name}, next_value={self.next_value})"
@@ -0,0 +1,362 @@
+"""A cache backend in shared memory, shared by all the processes on the host.
+
+    CACHES = {
+        "long-url": {
+            "BACKEND": "core.shmcache.SharedMemoryCache",
+            "LOCATION": "doqfy-long-url",
+            "OPTIONS": {"SLOTS": 32768, "SLOT_SIZE": 512},
+        },
+    }
+
+The entries are kept in a fixed size hash table in a memory-mapped file, `LOCATION`, which is relative
+to `/dev/shm` (or the temporary directory if there's no `/dev/shm`, or the `SHARED_MEMORY_DIRECTORY`
+setting, see `get_shared_directory`). With the `DATABASE` option, the alias of the database the entries
+come from, the fingerprint of the database (see `core.db.get_database_fingerprint`) is added to the name
+of the file, so that the processes using another database with the same settings, like the benchmarks,
+get a file of their own. So is the `VERSION` of the cache, which is bumped when the classes of the cached
+values change: the processes of another version start from an empty file, and the files of the other
+versions are deleted. The file is opened on first use, once the database is configured. The table is
+made of `SLOTS` slots of `SLOT_SIZE` bytes, grouped into buckets of `WAYS` slots. A key can only be
+stored in the slots of its bucket, and when they're all taken the least recently used entry of the
+bucket is evicted. The entries that don't fit in a slot, key included, aren't cached at all.
+
+The buckets are guarded by `STRIPES` locks, each of which is a lock between the threads of a process and
+a `fcntl` lock on a byte of the file between the processes. The reads take the locks shared.
+
+The file outlives the processes, so the entries are still there after a restart. The file is created
+(and its memory allocated) by the first process that opens it, and has to be deleted for any change of
+`SLOTS` or `SLOT_SIZE` to take effect. The entries that can't be unpickled anymore are missing. Only
+for Unix.
+"""
+
+import contextlib
+import fcntl
+import functools
+import hashlib
+import math
+import mmap
+import os
+import pickle
+import struct
+import tempfile
+import threading
+import time
+from collections.abc import Iterator
+from pathlib import Path
+from typing import Any, Final
+
+from django.conf import settings
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.core.exceptions import ImproperlyConfigured
+
+from .db import get_database_fingerprint
+
+_MAGIC: Final[bytes] = b"doqfyshm"
+
+_HEADER: Final[struct.Struct] = struct.Struct("<8sII")
+"""Magic, number of slots and slot size."""
+
+_SLOT: Final[struct.Struct] = struct.Struct("<QddHI")
+"""Hash of the key (0 if the slot is empty), expiry, last access, key length and value length."""
+
+_DEV_SHM: Final[Path] = Path("/dev/shm")  # noqa: S108
+
+SHARED_DIRECTORY: Final[Path] = _DEV_SHM if _DEV_SHM.is_dir() else Path(tempfile.gettempdir())
+"""Where the relative locations of the shared memory files are by default, see `get_shared_directory`."""
+
+_UNPICKLING_ERRORS: Final[tuple[type[Exception], ...]] = (
+    pickle.UnpicklingError,
+    AttributeError,
+    ImportError,
+    EOFError,
+    TypeError,
+)
+"""Raised by the entries pickled by another version of the code, say of a class that was moved or reshaped."""
+
+_tables: dict[Path, "_Table"] = {}
+_tables_lock = threading.Lock()
+
+
+class _Table:
+    def __init__(self, path: Path, *, slots: int, slot_size: int, ways: int, stripes: int) -> None:
+        if slot_size <= _SLOT.size or slots < ways:
+            raise ImproperlyConfigured(f"the shared memory cache {path} is too small")
+
+        self.slot_size = slot_size
+        self.ways = ways
+        self.buckets = slots // ways
+        self._data_offset = mmap.PAGESIZE
+        size = self._data_offset + self.buckets * ways * slot_size
+        # The locks are on the bytes past the end of the file, which doesn't need to have them.
+        self._locks_offset = size
+        self._thread_locks = [threading.Lock() for _ in range(stripes)]
+
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.lockf(self._fd, fcntl.LOCK_EX, 1, size + stripes)
+        try:
+            if os.fstat(self._fd).st_size == 0:
+                # Allocated up front, so that running out of shared memory fails here rather than with a
+                # SIGBUS when a page is first written to.
+                if hasattr(os, "posix_fallocate"):
+                    os.posix_fallocate(self._fd, 0, size)
+                else:
+                    os.ftruncate(self._fd, size)
+                os.pwrite(self._fd, _HEADER.pack(_MAGIC, slots, slot_size), 0)
+            elif os.pread(self._fd, _HEADER.size, 0) != _HEADER.pack(_MAGIC, slots, slot_size):
+                raise ImproperlyConfigured(f"{path} was created with different SLOTS or SLOT_SIZE, delete it")
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, size + stripes)
+
+        self._mmap = mmap.mmap(self._fd, size)
+
+    def get(self, key: bytes) -> bytes | None:
+        _, bucket = self._locate(key)
+        with self._lock(bucket, exclusive=False):
+            # Racing with the other readers on the last access is harmless, it'd be about the same time.
+            return self._read(key, accessed=True)
+
+    def set(self, key: bytes, value: bytes, expires_at: float, *, only_if_missing: bool = False) -> bool:
+        key_hash, bucket = self._locate(key)
+        fits = _SLOT.size + len(key) + len(value) <= self.slot_size
+        with self._lock(bucket, exclusive=True):
+            offset = self._find(bucket, key_hash, key)
+            now = time.time()
+            if only_if_missing and offset is not None and _SLOT.unpack_from(self._mmap, offset)[1] > now:
+                return False
+
+            if not fits:
+                # Drop the previous value rather than leave it behind.
+                if offset is not None:
+                    self._clear_slot(offset)
+                return False
+
+            if offset is None:
+                offset = self._get_victim(bucket, now)
+
+            _SLOT.pack_into(self._mmap, offset, key_hash, expires_at, now, len(key), len(value))
+            start = offset + _SLOT.size
+            self._mmap[start : start + len(key)] = key
+            self._mmap[start + len(key) : start + len(key) + len(value)] = value
+
+            return True
+
+    def touch(self, key: bytes, expires_at: float) -> bool:
+        key_hash, bucket = self._locate(key)
+        with self._lock(bucket, exclusive=True):
+            if (offset := self._find(bucket, key_hash, key)) is None:
+                return False
+
+            if _SLOT.unpack_from(self._mmap, offset)[1] <= time.time():
+                return False
+
+            struct.pack_into("<d", self._mmap, offset + 8, expires_at)
+
+            return True
+
+    def delete(self, key: bytes) -> bool:
+        key_hash, bucket = self._locate(key)
+        with self._lock(bucket, exclusive=True):
+            if (offset := self._find(bucket, key_hash, key)) is None:
+                return False
+
+            live = _SLOT.unpack_from(self._mmap, offset)[1] > time.time()
+            self._clear_slot(offset)
+
+            return live
+
+    @contextlib.contextmanager
+    def update(self, key: bytes) -> Iterator[bytes | None]:
+        """Hold the lock of the key while its value is read and then set again, for `incr`."""
+
+        _, bucket = self._locate(key)
+        with self._lock(bucket, exclusive=True):
+            yield self._read(key, accessed=False)
+
+    def set_locked(self, key: bytes, value: bytes) -> bool:
+        """Replace the value of the key within `update`, keeping its expiry."""
+
+        key_hash, bucket = self._locate(key)
+        offset = self._find(bucket, key_hash, key)
+        assert offset is not None
+
+        expires_at = _SLOT.unpack_from(self._mmap, offset)[1]
+        if _SLOT.size + len(key) + len(value) > self.slot_size:
+            return False
+
+        _SLOT.pack_into(self._mmap, offset, key_hash, expires_at, time.time(), len(key), len(value))
+        start = offset + _SLOT.size + len(key)
+        self._mmap[start : start + len(value)] = value
+
+        return True
+
+    def clear(self) -> None:
+        for bucket in range(min(self.buckets, len(self._thread_locks))):
+            with self._lock(bucket, exclusive=True):
+                # Every bucket of the stripe of `bucket`.
+                for other in range(bucket, self.buckets, len(self._thread_locks)):
+                    for way in range(self.ways):
+                        offset = self._get_offset(other, way)
+                        if struct.unpack_from("<Q", self._mmap, offset)[0]:
+                            self._clear_slot(offset)
+
+    def _read(self, key: bytes, *, accessed: bool) -> bytes | None:
+        key_hash, bucket = self._locate(key)
+        if (offset := self._find(bucket, key_hash, key)) is None:
+            return None
+
+        _, expires_at, _, key_length, value_length = _SLOT.unpack_from(self._mmap, offset)
+        now = time.time()
+        if expires_at <= now:
+            return None
+
+        if accessed:
+            struct.pack_into("<d", self._mmap, offset + 16, now)
+        start = offset + _SLOT.size + key_length
+
+        return self._mmap[start : start + value_length]
+
+    def _locate(self, key: bytes) -> tuple[int, int]:
+        # Python's `hash` differs between the processes.
+        key_hash = int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), "little") or 1
+
+        return key_hash, key_hash % self.buckets
+
+    def _find(self, bucket: int, key_hash: int, key: bytes) -> int | None:
+        for way in range(self.ways):
+            offset = self._get_offset(bucket, way)
+            slot_hash, _, _, key_length, _ = _SLOT.unpack_from(self._mmap, offset)
+            if slot_hash != key_hash or key_length != len(key):
+                continue
+
+            start = offset + _SLOT.size
+            if self._mmap[start : start + key_length] == key:
+                return offset
+
+        return None
+
+    def _get_victim(self, bucket: int, now: float) -> int:
+        """Get the slot for a new entry: an empty or expired one, or else the least recently used one."""
+
+        victim, victim_accessed_at = 0, math.inf
+        for way in range(self.ways):
+            offset = self._get_offset(bucket, way)
+            slot_hash, expires_at, accessed_at, _, _ = _SLOT.unpack_from(self._mmap, offset)
+            if not slot_hash or expires_at <= now:
+                return offset
+
+            if accessed_at < victim_accessed_at:
+                victim, victim_accessed_at = offset, accessed_at
+
+        return victim
+
+    def _get_offset(self, bucket: int, way: int) -> int:
+        return self._data_offset + (bucket * self.ways + way) * self.slot_size
+
+    def _clear_slot(self, offset: int) -> None:
+        _SLOT.pack_into(self._mmap, offset, 0, 0, 0, 0, 0)
+
+    @contextlib.contextmanager
+    def _lock(self, bucket: int, *, exclusive: bool) -> Iterator[None]:
+        # The fcntl locks belong to the process, so they don't keep out the other threads of the process.
+        stripe = bucket % len(self._thread_locks)
+        with self._thread_locks[stripe]:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH, 1, self._locks_offset + stripe)
+            try:
+                yield
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, self._locks_offset + stripe)
+
+
+def get_shared_directory() -> Path:
+    """Get the directory of the relative locations of the shared memory files, see also `core.idfilter`.
+
+    It's `SHARED_DIRECTORY` unless the `SHARED_MEMORY_DIRECTORY` setting is set, as it is for the tests.
+    """
+
+    return Path(getattr(settings, "SHARED_MEMORY_DIRECTORY", SHARED_DIRECTORY))
+
+
+class SharedMemoryCache(BaseCache):
+    pickle_protocol = pickle.HIGHEST_PROTOCOL
+
+    def __init__(self, location: str, params: dict[str, Any]) -> None:
+        super().__init__(params)
+        self._location = location
+        self._options: dict[str, Any] = params.get("OPTIONS", {})
+
+    @functools.cached_property
+    def _table(self) -> _Table:
+        stem = self._location
+        if (database := self._options.get("DATABASE")) is not None:
+            stem = f"{stem}-{get_database_fingerprint(database)}"
+
+        path = get_shared_directory() / f"{stem}@v{self.version}"
+        # Django creates a backend per thread, while the table has to be one per process for its locks.
+        with _tables_lock:
+            if (table := _tables.get(path)) is None:
+                table = _tables[path] = _Table(
+                    path,
+                    slots=self._options.get("SLOTS", 16384),
+                    slot_size=self._options.get("SLOT_SIZE", 1024),
+                    ways=self._options.get("WAYS", 8),
+                    stripes=self._options.get("STRIPES", 64),
+                )
+                # The processes of the other versions still have them mapped if they're running.
+                for other in path.parent.glob(f"{Path(stem).name}@v*"):
+                    if other != path:
+                        other.unlink(missing_ok=True)
+
+        return table
+
+    def add(self, key: str, value: Any, timeout: float | None = DEFAULT_TIMEOUT, version: int | None = None) -> bool:  # noqa: ANN401
+        key = self.make_and_validate_key(key, version=version)
+
+        return self._table.set(key.encode(), self._dumps(value), self._get_expiry(timeout), only_if_missing=True)
+
+    def get(self, key: str, default: Any = None, version: int | None = None) -> Any:  # noqa: ANN401
+        key = self.make_and_validate_key(key, version=version)
+        if (data := self._table.get(key.encode())) is None:
+            return default
+
+        try:
+            return pickle.loads(data)  # noqa: S301
+        except _UNPICKLING_ERRORS:
+            self._table.delete(key.encode())
+
+            return default
+
+    def set(self, key: str, value: Any, timeout: float | None = DEFAULT_TIMEOUT, version: int | None = None) -> None:  # noqa: ANN401
+        key = self.make_and_validate_key(key, version=version)
+        self._table.set(key.encode(), self._dumps(value), self._get_expiry(timeout))
+
+    def touch(self, key: str, timeout: float | None = DEFAULT_TIMEOUT, version: int | None = None) -> bool:
+        key = self.make_and_validate_key(key, version=version)
+
+        return self._table.touch(key.encode(), self._get_expiry(timeout))
+
+    def incr(self, key: str, delta: int = 1, version: int | None = None) -> int:
+        key = self.make_and_validate_key(key, version=version)
+        with self._table.update(key.encode()) as data:
+            if data is None:
+                raise ValueError(f"Key '{key}' not found")
+
+            value = pickle.loads(data) + delta  # noqa: S301
+            self._table.set_locked(key.encode(), self._dumps(value))
+
+        return value
+
+    def delete(self, key: str, version: int | None = None) -> bool:
+        key = self.make_and_validate_key(key, version=version)
+
+        return self._table.delete(key.encode())
+
+    def clear(self) -> None:
+        self._table.clear()
+
+    def _dumps(self, value: Any) -> bytes:  # noqa: ANN401
+        return pickle.dumps(value, self.pickle_protocol)
+
+    def _get_expiry(self, timeout: float | None) -> float:
+        expires_at = self.get_backend_timeout(timeout)
+
+        return math.inf if expires_at is None else expires_at
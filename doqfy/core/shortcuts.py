@@ -0,0 +1,24 @@
+from collections.abc import Mapping
+from typing import Any
+
+from django.http import HttpRequest, HttpResponse
+from django.shortcuts import render as django_render
+from django.template import loader
+
+from .metrics import metrics
+
+
+def render(
+    request: HttpRequest, template_name: str, context: Mapping[str, Any] | None = None, status: int | None = None
+) -> HttpResponse:
+    """`django.shortcuts.render` that times the rendering of the template."""
+
+    with metrics.timer("render_seconds", template=template_name):
+        return django_render(request, template_name, context, status=status)
+
+
+def render_to_string(template_name: str, context: Mapping[str, Any] | None = None) -> str:
+    """`django.template.loader.render_to_string` that times the rendering of the template."""
+
+    with metrics.timer("render_seconds", template=template_name):
+        return loader.render_to_string(template_name, context)
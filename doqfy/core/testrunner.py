@@ -0,0 +1,27 @@
+import shutil
+import tempfile
+from typing import Any
+
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+from .shmcache import SHARED_DIRECTORY
+
+
+class TestRunner(DiscoverRunner):
+    """Runs the tests with a shared memory directory of their own, deleted once they're done.
+
+    The test databases are all alike and allocate the same IDs, so the caches and the ID filters of a
+    run would otherwise answer for the rows of the runs after it. See `core.shmcache.get_shared_directory`.
+    """
+
+    def setup_test_environment(self, **kwargs: Any) -> None:  # noqa: ANN401
+        super().setup_test_environment(**kwargs)
+        self._shared_directory = tempfile.mkdtemp(prefix="doqfy-test-", dir=SHARED_DIRECTORY)
+        self._shared_memory_settings = override_settings(SHARED_MEMORY_DIRECTORY=self._shared_directory)
+        self._shared_memory_settings.enable()
+
+    def teardown_test_environment(self, **kwargs: Any) -> None:  # noqa: ANN401
+        self._shared_memory_settings.disable()
+        shutil.rmtree(self._shared_directory, ignore_errors=True)
+        super().teardown_test_environment(**kwargs)
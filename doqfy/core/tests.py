@@ -0,0 +1,514 @@
+import asyncio
+import os
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import timedelta
+from http import HTTPStatus
+from io import StringIO
+from pathlib import Path
+from unittest.mock import Mock, patch
+
+from django.conf import settings
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.db import IntegrityError, OperationalError, connection, transaction
+from django.db.models.signals import post_save
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from django.utils import timezone
+from shareme.models import Snippet
+from shorten.models import Url
+
+from . import shmcache
+from .cache import NEGATIVE_ENTRY, LocalLRUCache, TieredCache
+from .db import ReadWriteRouter, get_database_fingerprint
+from .groupcommit import GroupCommitWriter
+from .idfilter import IdFilter
+from .ids import BASE62_ALPHABET, FeistelPermutation, IdAllocator, SequenceIdAllocator, encode_base62
+from .metrics import Metrics, metrics
+from .models import IdSequence
+from .shmcache import SharedMemoryCache
+from .warmup import CacheWarmer, WarmUp
+
+
+class FeistelPermutationTest(TestCase):
+    def test_permute_is_a_bijection(self) -> None:
+        permutation = FeistelPermutation(62**2, b"key")
+
+        permuted = {permutation.permute(value) for value in range(62**2)}
+
+        assert permuted == set(range(62**2))
+
+
+class SequenceIdAllocatorTest(TestCase):
+    def test_allocate_many_gives_unique_ids_across_blocks(self) -> None:
+        allocator = SequenceIdAllocator("test", length=4, block_size=7)
+
+        ids = allocator.allocate_many(50)
+
+        assert len(set(ids)) == len(ids)
+        assert all(len(id_) == allocator.length and set(id_) <= set(BASE62_ALPHABET) for id_ in ids)
+        # The 50 IDs take 8 whole blocks.
+        assert IdSequence.objects.get(name="test").next_value == 8 * allocator.block_size
+
+    def test_allocators_with_the_same_name_share_the_sequence(self) -> None:
+        first = SequenceIdAllocator("test", length=4, block_size=10)
+        second = SequenceIdAllocator("test", length=4, block_size=10)
+
+        ids = [first.allocate(), second.allocate(), first.allocate(), second.allocate()]
+
+        assert len(set(ids)) == len(ids)
+
+
+class EncodeBase62Test(TestCase):
+    def test_encode_base62_pads_to_length(self) -> None:
+        assert encode_base62(0, 3) == "000"
+        assert encode_base62(62**3 - 1, 3) == "zzz"
+
+
+class LocalLRUCacheTest(SimpleTestCase):
+    def test_set_evicts_least_recently_used(self) -> None:
+        cache = LocalLRUCache(max_entries=2)
+        cache.set("a", 1, timeout=60)
+        cache.set("b", 2, timeout=60)
+        cache.get("a")
+
+        cache.set("c", 3, timeout=60)
+
+        assert [cache.get(key) for key in "abc"] == [1, None, 3]
+
+    def test_get_ignores_expired_entries(self) -> None:
+        cache = LocalLRUCache(max_entries=2)
+        cache.set("a", 1, timeout=0)
+
+        assert cache.get("a", "default") == "default"
+
+
+class TieredCacheTest(SimpleTestCase):
+    def setUp(self) -> None:
+        self.backend = LocMemCache("tiered-cache-test", {})
+        self.backend.clear()
+        self.cache = TieredCache(self.backend)
+
+    def test_get_or_load_caches_missing_values(self) -> None:
+        calls: list[str] = []
+
+        def loader() -> str | None:
+            calls.append("called")
+            return None
+
+        assert self.cache.get_or_load("key", loader) is None
+        assert self.cache.get_or_load("key", loader) is None
+
+        self.cache.local.clear()
+        assert self.cache.get_or_load("key", loader) is None
+
+        assert calls == ["called"]
+
+    def test_get_or_load_reads_through_the_shared_backend(self) -> None:
+        assert self.cache.get_or_load("key", lambda: "value") == "value"
+        self.cache.local.clear()
+
+        assert self.cache.get_or_load("key", lambda: "other") == "value"
+
+    def test_set_replaces_negative_entries(self) -> None:
+        self.cache.get_or_load("key", lambda: None)
+
+        self.cache.set("key", "value")
+
+        assert self.cache.get_or_load("key", lambda: None) == "value"
+
+    def test_get_or_load_coalesces_concurrent_misses(self) -> None:
+        calls: list[str] = []
+        results: list[str | None] = []
+
+        def loader() -> str:
+            calls.append("called")
+            time.sleep(0.05)
+            return "value"
+
+        threads = [
+            threading.Thread(target=lambda: results.append(self.cache.get_or_load("key", loader))) for _ in range(5)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert calls == ["called"]
+        assert results == ["value"] * 5
+
+    async def test_aget_or_load_coalesces_concurrent_misses(self) -> None:
+        calls: list[str] = []
+
+        async def loader() -> str:
+            calls.append("called")
+            await asyncio.sleep(0.05)
+            return "value"
+
+        results = await asyncio.gather(*(self.cache.aget_or_load("key", loader) for _ in range(5)))
+
+        assert calls == ["called"]
+        assert results == ["value"] * 5
+        assert await self.cache.aget_or_load("missing", _load_nothing) is None
+        assert self.cache.get("missing") == NEGATIVE_ENTRY
+
+
+async def _load_nothing() -> None:
+    return None
+
+
+class SharedMemoryCacheTest(SimpleTestCase):
+    def setUp(self) -> None:
+        directory = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, directory)
+        self.location = str(directory / "cache")
+        self.addCleanup(shmcache._tables.pop, Path(f"{self.location}@v1"), None)  # noqa: SLF001
+        self.cache = self.make_cache()
+
+    def make_cache(self, **options: int) -> SharedMemoryCache:
+        return SharedMemoryCache(self.location, {"OPTIONS": {"SLOTS": 16, "SLOT_SIZE": 256, **options}})
+
+    def test_set_get_and_delete(self) -> None:
+        self.cache.set("key", {"value": 1})
+
+        assert self.cache.get("key") == {"value": 1}
+        assert not self.cache.add("key", "other")
+        assert self.cache.delete("key")
+        assert self.cache.get("key", "default") == "default"
+        assert self.cache.add("key", "other")
+        assert self.cache.get("key") == "other"
+
+    def test_incr_keeps_the_expiry(self) -> None:
+        self.cache.set("key", 1, timeout=60)
+
+        assert [self.cache.incr("key", 2), self.cache.get("key")] == [3, 3]
+        with self.assertRaisesMessage(ValueError, "Key ':1:missing' not found"):
+            self.cache.incr("missing")
+
+    def test_expired_entries_are_missing(self) -> None:
+        self.cache.set("key", "value", timeout=0.05)
+        self.cache.set("forever", "value", timeout=None)
+        assert self.cache.touch("key", timeout=0.1)
+
+        time.sleep(0.15)
+
+        assert self.cache.get("key") is None
+        assert not self.cache.touch("key")
+        assert self.cache.add("key", "other")
+        assert self.cache.get("forever") == "value"
+
+    def test_set_evicts_the_least_recently_used_entry_of_the_bucket(self) -> None:
+        cache = SharedMemoryCache(self.location + "-small", {"OPTIONS": {"SLOTS": 2, "WAYS": 2, "SLOT_SIZE": 256}})
+        self.addCleanup(shmcache._tables.pop, Path(f"{self.location}-small@v1"), None)  # noqa: SLF001
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+
+        cache.set("c", 3)
+
+        assert [cache.get(key) for key in "abc"] == [1, None, 3]
+
+    def test_entries_larger_than_a_slot_are_not_cached(self) -> None:
+        self.cache.set("key", "value")
+
+        self.cache.set("key", "x" * 256)
+
+        assert self.cache.get("key") is None
+
+    def test_clear(self) -> None:
+        self.cache.set_many({f"key-{index}": index for index in range(10)})
+
+        self.cache.clear()
+
+        assert self.cache.get_many([f"key-{index}" for index in range(10)]) == {}
+
+    def test_entries_are_shared_between_processes(self) -> None:
+        self.cache.set("parent", "value")
+        if (pid := os.fork()) == 0:
+            # A table of its own, as if the process had been started on its own.
+            shmcache._tables.clear()  # noqa: SLF001
+            cache = self.make_cache()
+            cache.set("child", cache.get("parent"))
+            os._exit(0)
+
+        os.waitpid(pid, 0)
+
+        assert self.cache.get("child") == "value"
+
+    def test_entries_that_cannot_be_unpickled_are_missing(self) -> None:
+        self.cache.set("key", "value")
+
+        with patch.object(shmcache.pickle, "loads", side_effect=AttributeError):
+            assert self.cache.get("key", "default") == "default"
+
+        assert not self.cache.delete("key")
+
+    def test_the_other_versions_are_deleted(self) -> None:
+        self.cache.set("key", "value")
+        self.addCleanup(shmcache._tables.pop, Path(f"{self.location}@v2"), None)  # noqa: SLF001
+
+        cache = SharedMemoryCache(self.location, {"VERSION": 2, "OPTIONS": {"SLOTS": 16, "SLOT_SIZE": 256}})
+
+        assert cache.get("key") is None
+        assert not Path(f"{self.location}@v1").exists()
+
+    def test_a_different_geometry_is_rejected(self) -> None:
+        self.cache.get("key")
+        shmcache._tables.pop(Path(f"{self.location}@v1"))  # noqa: SLF001
+
+        with self.assertRaisesMessage(ImproperlyConfigured, "was created with different SLOTS or SLOT_SIZE"):
+            self.make_cache(SLOTS=32).get("key")
+
+    def test_the_databases_get_a_file_each(self) -> None:
+        with patch.object(shmcache, "get_database_fingerprint", side_effect=["one", "two"]):
+            one = self.make_cache(DATABASE="default")
+            one.set("key", "value")
+            two = self.make_cache(DATABASE="default")
+
+            assert two.get("key") is None
+        for fingerprint in ("one", "two"):
+            shmcache._tables.pop(Path(f"{self.location}-{fingerprint}@v1"))  # noqa: SLF001
+
+
+class DatabaseFingerprintTest(SimpleTestCase):
+    def test_a_file_swapped_in_at_the_same_path_is_another_database(self) -> None:
+        directory = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, directory)
+        database = {"ENGINE": "django.db.backends.sqlite3", "NAME": directory / "db.sqlite3"}
+        database["NAME"].touch()
+
+        with patch.dict(settings.DATABASES, {"other": database}):
+            fingerprint = get_database_fingerprint("other")
+            (directory / "restored.sqlite3").touch()
+            (directory / "restored.sqlite3").replace(database["NAME"])
+
+            assert get_database_fingerprint("other") != fingerprint
+            assert get_database_fingerprint("other") == get_database_fingerprint("other")
+            assert get_database_fingerprint() != fingerprint
+
+
+class SqliteTuningTest(TestCase):
+    def test_pragmas_are_set_on_connect(self) -> None:
+        with connection.cursor() as cursor:
+            cursor.execute("PRAGMA synchronous")
+            synchronous = cursor.fetchone()[0]
+            cursor.execute("PRAGMA busy_timeout")
+            busy_timeout = cursor.fetchone()[0]
+
+        # 1 is NORMAL.
+        assert (synchronous, busy_timeout) == (1, 5000)
+
+
+class ReadWriteRouterTest(SimpleTestCase):
+    def test_routes_the_reads_outside_of_transactions(self) -> None:
+        router = ReadWriteRouter()
+
+        assert router.db_for_read(Url) == "readonly"
+        assert router.db_for_read(Snippet) == "readonly"
+        assert router.db_for_read(IdSequence) is None
+        assert router.db_for_write(Url) == "default"
+        assert router.allow_migrate("readonly", "shorten") is False
+
+
+class ReadWriteRouterTransactionTest(TestCase):
+    def test_reads_within_transactions_stay_on_the_writer(self) -> None:
+        assert ReadWriteRouter().db_for_read(Url) == "default"
+
+
+class MetricsTest(SimpleTestCase):
+    def test_renders_the_counters_and_the_timers(self) -> None:
+        instance = Metrics(enabled=True)
+        instance.inc("id_collisions_total", allocator="snippet")
+        instance.inc("id_collisions_total", allocator="snippet")
+        with instance.timer("kdf_seconds", kdf="scrypt"):
+            pass
+
+        rendered = instance.render()
+
+        assert "# TYPE doqfy_id_collisions_total counter" in rendered
+        assert 'doqfy_id_collisions_total{allocator="snippet"} 2' in rendered
+        assert 'doqfy_kdf_seconds_bucket{kdf="scrypt",le="+Inf"} 1' in rendered
+        assert 'doqfy_kdf_seconds_count{kdf="scrypt"} 1' in rendered
+
+    def test_does_nothing_when_disabled(self) -> None:
+        instance = Metrics(enabled=False)
+        instance.inc("id_collisions_total")
+        with instance.timer("kdf_seconds"):
+            pass
+
+        assert instance.render() == ""
+
+    @patch.object(metrics, "enabled", new=True)
+    def test_metrics_endpoint(self) -> None:
+        metrics.inc("decryption_failures_total")
+
+        response = self.client.get("/metrics")
+
+        assert response.status_code == HTTPStatus.OK
+        assert response["Content-Type"].startswith("text/plain; version=0.0.4")
+        assert b"doqfy_decryption_failures_total " in response.content
+
+    def test_metrics_endpoint_is_disabled_by_default(self) -> None:
+        assert self.client.get("/metrics").status_code == HTTPStatus.NOT_FOUND
+
+
+class IdFilterTest(TestCase):
+    def setUp(self) -> None:
+        directory = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, directory)
+        self.location = str(directory / "ids")
+        self.id_filter = IdFilter("test", self.location, capacity=100)
+        self.id_filter.track(Url)
+        self.addCleanup(post_save.disconnect, sender=Url, dispatch_uid="core.idfilter.test")
+
+    def test_is_unknown_once_built(self) -> None:
+        Url.objects.bulk_create([Url(short_id="old", long_url="https://example.com/")])
+        assert not self.id_filter.is_unknown("missing")
+
+        assert self.id_filter.build() == 1
+        assert self.id_filter.build() is None
+
+        assert self.id_filter.is_unknown("missing")
+        assert not self.id_filter.is_unknown("old")
+
+    def test_a_filter_built_from_another_database_is_built_again(self) -> None:
+        Url.objects.bulk_create([Url(short_id="other", long_url="https://example.com/")])
+        self.id_filter.build()
+        Url.objects.all().delete()
+        Url.objects.bulk_create([Url(short_id="real", long_url="https://example.com/")])
+
+        # As in a process started once the database was swapped.
+        id_filter = IdFilter("test", self.location, capacity=100)
+        id_filter.track(Url)
+
+        assert not id_filter.is_unknown("missing")
+        with self.assertLogs("core.idfilter", "WARNING") as logs:
+            assert id_filter.build() == 1
+        assert logs.output == ["WARNING:core.idfilter:the ID filter test doesn't match the database, building it again"]
+        assert not id_filter.is_unknown("real")
+        assert id_filter.is_unknown("missing")
+        checked = IdFilter("test", self.location, capacity=100)
+        checked.track(Url)
+        assert checked.build() is None
+        assert checked.is_unknown("missing")
+
+    def test_saved_rows_are_added(self) -> None:
+        self.id_filter.build()
+
+        Url.objects.create(short_id="new", long_url="https://example.com/")
+
+        assert not self.id_filter.is_unknown("new")
+
+    def test_allocate_skips_the_known_ids(self) -> None:
+        self.id_filter.add_many(["a", "b", "c", "d"])
+        self.id_filter.build()
+        allocator = Mock(spec=IdAllocator)
+        allocator.allocate.side_effect = ["a", "b", "e", "g"]
+        allocator.allocate_many.return_value = ["c", "f"]
+
+        assert self.id_filter.allocate(allocator) == "e"
+        assert self.id_filter.allocate_many(allocator, 2) == ["g", "f"]
+
+    def test_allocate_gives_up_on_skipping(self) -> None:
+        self.id_filter.add_many(["a", "b", "c", "d"])
+        self.id_filter.build()
+        allocator = Mock(spec=IdAllocator)
+        allocator.allocate.side_effect = ["a", "b", "c", "d"]
+
+        assert self.id_filter.allocate(allocator) == "d"
+
+    def test_disabled_filter_knows_every_id(self) -> None:
+        id_filter = IdFilter("disabled")
+        allocator = Mock(spec=IdAllocator)
+        allocator.allocate.return_value = "a"
+
+        assert id_filter.build() is None
+        assert not id_filter.is_unknown("missing")
+        assert id_filter.allocate(allocator) == "a"
+
+
+class PurgeExpiredTest(TestCase):
+    def test_deletes_the_expired_and_burned_rows(self) -> None:
+        expired = timezone.now() - timedelta(seconds=1)
+        live = timezone.now() + timedelta(hours=1)
+        Url.objects.create(short_id="expired", long_url="https://example.com/", expires_at=expired)
+        Url.objects.create(short_id="live", long_url="https://example.com/", expires_at=live)
+        Snippet.objects.create(snippet_id="expired", expires_at=expired)
+        Snippet.objects.create(snippet_id="burned", reads_remaining=0)
+        Snippet.objects.create(snippet_id="live", reads_remaining=1)
+
+        call_command("purge_expired", batch_size=1, stdout=StringIO())
+
+        assert list(Url.objects.values_list("short_id", flat=True)) == ["live"]
+        assert list(Snippet.objects.values_list("snippet_id", flat=True)) == ["live"]
+
+
+class CacheWarmerTest(SimpleTestCase):
+    def test_warm_stops_once_the_time_budget_runs_out(self) -> None:
+        warmer = CacheWarmer(max_items=5, time_budget=0.05)
+        calls: list[tuple[str, int]] = []
+
+        def warm_up(name: str, seconds: float) -> WarmUp:
+            def load(max_items: int, deadline: float) -> int:  # noqa: ARG001
+                calls.append((name, max_items))
+                time.sleep(seconds)
+                return max_items
+
+            return load
+
+        warmer.register("slow", warm_up("slow", 0.1))
+        warmer.register("skipped", warm_up("skipped", 0))
+
+        assert warmer.warm() == {"slow": 5}
+        assert calls == [("slow", 5)]
+        assert warmer.warm(max_items=1, time_budget=1) == {"slow": 1, "skipped": 1}
+
+
+class GroupCommitWriterTest(TransactionTestCase):
+    databases = frozenset({"default", "readonly"})
+
+    def test_commits_the_concurrent_writes_together(self) -> None:
+        writer = GroupCommitWriter(enabled=True, max_delay=0.2)
+
+        def create(short_id: str) -> str:
+            return writer.run(lambda: Url.objects.create(short_id=short_id, long_url="https://example.com/")).short_id
+
+        with patch.object(writer, "_commit", wraps=writer._commit) as commit:  # noqa: SLF001
+            with ThreadPoolExecutor(4) as executor:
+                short_ids = list(executor.map(create, ["a", "b", "c", "d"]))
+            with self.assertRaisesMessage(IntegrityError, "UNIQUE constraint failed: shorten_url.short_id"):
+                create("a")
+
+        assert short_ids == ["a", "b", "c", "d"]
+        assert sorted(Url.objects.values_list("short_id", flat=True)) == short_ids
+        # Fewer commits than writes.
+        assert commit.call_count <= len(short_ids)
+
+    def test_the_writes_of_a_failed_commit_get_an_error_each(self) -> None:
+        writer = GroupCommitWriter(enabled=True)
+        futures: list[Future] = [Future(), Future()]
+
+        with (
+            patch.object(metrics, "timer", side_effect=OperationalError("database is locked")),
+            self.assertLogs("core.groupcommit", "ERROR"),
+        ):
+            writer._commit([(Mock(), future) for future in futures])  # noqa: SLF001
+
+        first, second = (future.exception() for future in futures)
+        assert isinstance(first, OperationalError)
+        assert first is not second
+        assert str(first) == str(second) == "database is locked"
+        assert first.__cause__ is second.__cause__
+
+    def test_runs_the_writes_within_transactions_right_away(self) -> None:
+        writer = GroupCommitWriter(enabled=True)
+
+        with transaction.atomic():
+            writer.run(lambda: Url.objects.create(short_id="a", long_url="https://example.com/"))
+
+        assert writer._thread is None  # noqa: SLF001
+        assert Url.objects.filter(short_id="a").exists()
@@ -0,0 +1,10 @@
+from django.http import HttpRequest, HttpResponse, HttpResponseNotFound
+
+from .metrics import metrics
+
+
+def get_metrics(_: HttpRequest) -> HttpResponse:
+    if not metrics.enabled:
+        return HttpResponseNotFound()
+
+    return HttpResponse(metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
@@ -0,0 +1,87 @@
+"""Preloading of the caches when a server process starts.
+
+The caches are per process, so every new worker would otherwise start cold and send all of its
+traffic to the database at once. The apps register what's worth preloading with `warmer.register` in
+their `AppConfig.ready`, and the WSGI and ASGI entry points call `warmer.warm_on_startup` once the
+application is loaded. With `gunicorn --preload`, that's once in the master process and the forked
+workers inherit the warm caches.
+
+Each source is given the maximum number of items it may load and a deadline, and loads them in
+batches so that it can stop once the deadline passes. The whole warm-up is bounded by
+`CACHE_WARMUP["MAX_ITEMS"]` items per source and `CACHE_WARMUP["TIME_BUDGET"]` seconds, so
+restarting many workers at once can't swamp the database. `python manage.py warm_caches` runs the
+same warm-up, which is only useful with cache backends that are shared between the processes.
+"""
+
+import logging
+import time
+from collections.abc import Callable
+from typing import Any
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+WarmUp = Callable[[int, float], int]
+"""Loads at most the given number of items before the given `time.monotonic` deadline, and returns
+the number of items loaded.
+"""
+
+
+class CacheWarmer:
+    def __init__(self, *, max_items: int = 1000, time_budget: float = 2, on_startup: bool = True) -> None:
+        self.max_items = max_items
+        self.time_budget = time_budget
+        self.on_startup = on_startup
+        self._sources: dict[str, WarmUp] = {}
+
+    @classmethod
+    def from_settings(cls) -> "CacheWarmer":
+        config: dict[str, Any] = getattr(settings, "CACHE_WARMUP", {})
+
+        return cls(
+            max_items=config.get("MAX_ITEMS", 1000),
+            time_budget=config.get("TIME_BUDGET", 2),
+            on_startup=config.get("ON_STARTUP", True),
+        )
+
+    def register(self, name: str, warm_up: WarmUp) -> None:
+        self._sources[name] = warm_up
+
+    def warm(self, max_items: int | None = None, time_budget: float | None = None) -> dict[str, int]:
+        """Run the sources in turn until they're done or the time budget runs out.
+
+        Returns the number of items loaded per source. The sources that didn't get to run are left out.
+        """
+
+        max_items = self.max_items if max_items is None else max_items
+        deadline = time.monotonic() + (self.time_budget if time_budget is None else time_budget)
+        loaded: dict[str, int] = {}
+        for name, warm_up in self._sources.items():
+            if time.monotonic() >= deadline:
+                break
+
+            loaded[name] = warm_up(max_items, deadline)
+
+        return loaded
+
+    def warm_on_startup(self) -> None:
+        """Warm the caches if enabled, without ever failing the startup."""
+
+        if not self.on_startup:
+            return
+
+        start = time.monotonic()
+        try:
+            loaded = self.warm()
+        except Exception:
+            logger.exception("failed to warm the caches")
+        else:
+            logger.info("warmed the caches in %.2fs: %s", time.monotonic() - start, loaded)
+        finally:
+            # The connections mustn't be shared with the processes forked from this one.
+            connections.close_all()
+
+
+warmer = CacheWarmer.from_settings()
@@ -13,4 +13,17 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "doqfy.settings")
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Imported after the apps are loaded.
+from core.idfilter import id_filters  # noqa: E402
+from core.warmup import warmer  # noqa: E402
+from shorten.fastpath import RedirectFastPathASGI  # noqa: E402
+
+# The redirects skip Django's request handling, see `shorten.fastpath`.
+application = RedirectFastPathASGI(django_application)
+
+# Before serving anything, so that the first requests don't all go to the database. See `core.idfilter`
+# and `core.warmup`.
+id_filters.build_on_startup()
+warmer.warm_on_startup()
@@ -31,6 +31,7 @@ ALLOWED_HOSTS = []
 # Application definition
 
 INSTALLED_APPS = [
+    "core.apps.CoreConfig",
     "shorten.apps.ShortenConfig",
     "shareme.apps.SharemeConfig",
     "django.contrib.admin",
@@ -53,6 +54,9 @@ MIDDLEWARE = [
 
 ROOT_URLCONF = "doqfy.urls"
 
+# Runs the tests with shared memory caches and ID filters of their own, see `core.testrunner`.
+TEST_RUNNER = "core.testrunner.TestRunner"
+
 TEMPLATES = [
     {
         "BACKEND": "django.template.backends.django.DjangoTemplates",
@@ -79,29 +83,233 @@ DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": BASE_DIR / "db.sqlite3",
-    }
+        "CONN_MAX_AGE": 600,
+        "CONN_HEALTH_CHECKS": True,
+    },
+    # The same database, for the reads that don't need to wait on the writes. See `core.db`.
+    "readonly": {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": BASE_DIR / "db.sqlite3",
+        "CONN_MAX_AGE": 600,
+        "CONN_HEALTH_CHECKS": True,
+        "TEST": {"MIRROR": "default"},
+    },
+}
+
+DATABASE_ROUTERS = ["core.db.ReadWriteRouter"]
+
+DATABASE_ROUTING = {
+    "READ_ALIAS": "readonly",
+    "APPS": ["shorten", "shareme"],
+}
+
+# Run on every new SQLite connection.
+SQLITE_PRAGMAS = {
+    "journal_mode": "wal",
+    "synchronous": "normal",
+    "mmap_size": 256 * 1024 * 1024,
+    "busy_timeout": 5000,
 }
 
 # Caching
 
+# The snippets, long URLs and short IDs are cached in shared memory, once for all the server processes
+# of the host (see `core.shmcache`). The files are named after the DATABASE they cache, so that the
+# other databases opened with these settings don't share them, and after their VERSION. Bump
+# SHARED_CACHE_VERSION with any change to the classes of the cached values, so that the deploy starts
+# from empty files. The entries that don't fit in a slot aren't cached, and the files in /dev/shm have to
+# be deleted for a change of SLOTS or SLOT_SIZE to take effect. The tests use files of their own.
+SHARED_CACHE_VERSION = 1
+
 CACHES = {
     "default": {
         "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
     },
     "snippets": {
-        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
-        "LOCATION": "snippets",
+        "BACKEND": "core.shmcache.SharedMemoryCache",
+        "LOCATION": "doqfy-snippets",
+        "VERSION": SHARED_CACHE_VERSION,
+        "OPTIONS": {"SLOTS": 2048, "SLOT_SIZE": 8192, "DATABASE": "default"},
     },
     "long-url": {
-        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
-        "LOCATION": "long-url",
+        "BACKEND": "core.shmcache.SharedMemoryCache",
+        "LOCATION": "doqfy-long-url",
+        "VERSION": SHARED_CACHE_VERSION,
+        "OPTIONS": {"SLOTS": 32768, "SLOT_SIZE": 512, "DATABASE": "default"},
     },
     "short-id": {
+        "BACKEND": "core.shmcache.SharedMemoryCache",
+        "LOCATION": "doqfy-short-id",
+        "VERSION": SHARED_CACHE_VERSION,
+        "OPTIONS": {"SLOTS": 32768, "SLOT_SIZE": 128, "DATABASE": "default"},
+    },
+    "pages": {
         "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
-        "LOCATION": "short-id",
+        "LOCATION": "pages",
+        "OPTIONS": {"MAX_ENTRIES": 1000},
     },
 }
 
+SHAREME_SNIPPET_CACHE = {
+    # Larger snippets (after compression) aren't cached.
+    "MAX_ENTRY_SIZE": 256 * 1024,
+    "COMPRESS_THRESHOLD": 1024,
+}
+
+SHAREME_PAGE_CACHE = {
+    # Larger rendered snippet pages aren't cached.
+    "MAX_ENTRY_SIZE": 64 * 1024,
+}
+
+
+# ID allocation
+
+ID_ALLOCATORS = {
+    "short-url": {
+        "BACKEND": "core.ids.SequenceIdAllocator",
+        "OPTIONS": {"length": 8},
+    },
+    "snippet": {
+        "BACKEND": "core.ids.SequenceIdAllocator",
+        "OPTIONS": {"length": 10},
+    },
+}
+
+# Bloom filters of the issued IDs, so that the unknown IDs get a 404 without being looked up. Shared by
+# the processes of the host like the caches, in the LOCATION file under /dev/shm (an absolute path on
+# disk keeps it across reboots) named after the database. Built from the database by the first process
+# that starts, and checked against it by the others. Up to CAPACITY IDs, the rate of the unknown IDs
+# that are looked up anyway stays under ERROR_RATE. Remove an entry to disable its filter. See
+# `core.idfilter`.
+ID_FILTERS = {
+    "short-url": {"LOCATION": "doqfy-short-url-ids", "CAPACITY": 1_000_000, "ERROR_RATE": 0.01},
+    "snippet": {"LOCATION": "doqfy-snippet-ids", "CAPACITY": 1_000_000, "ERROR_RATE": 0.01},
+}
+
+
+# Bulk shortening
+
+# The most URLs that can be shortened with one request to /shorten/bulk/, whose body is also limited
+# by DATA_UPLOAD_MAX_MEMORY_SIZE. Larger requests get a 413.
+SHORTEN_BULK = {
+    "MAX_URLS": 10_000,
+}
+
+
+# Click analytics
+
+# The clicks are buffered in memory and written every FLUSH_INTERVAL seconds. When the buffer is
+# full, the oldest clicks are dropped.
+SHORTEN_CLICK_ANALYTICS = {
+    "BUFFER_SIZE": 100_000,
+    "FLUSH_INTERVAL": 5,
+}
+
+
+# Redirects
+
+# How long the browsers and the CDNs may cache the redirects and the 404s, in seconds. The cached
+# redirects don't count as clicks. 0 makes them revalidate every time.
+SHORTEN_REDIRECT = {
+    "MAX_AGE": 300,
+    "NOT_FOUND_MAX_AGE": 60,
+}
+
+
+# Expiry
+
+# The expired short URLs and snippets are deleted in batches of BATCH_SIZE rows, by the
+# `purge_expired` command or, with SWEEP_INTERVAL set, every SWEEP_INTERVAL seconds by each server
+# process.
+EXPIRY = {
+    "SWEEP_INTERVAL": 600,
+    "BATCH_SIZE": 500,
+}
+
+
+# Cache warm-up
+
+# Each server process preloads up to MAX_ITEMS of the most clicked short URLs and of the most recent
+# snippets into its caches on startup, spending at most TIME_BUDGET seconds on it.
+CACHE_WARMUP = {
+    "ON_STARTUP": True,
+    "MAX_ITEMS": 1000,
+    "TIME_BUDGET": 2,
+}
+
+
+# Group commit
+
+# With ENABLED, the creates of short URLs and snippets are committed by a writer thread in each process,
+# up to MAX_BATCH of them in one transaction: the ones that arrive within MAX_DELAY seconds of each
+# other. This only helps when the process serves concurrent requests, see `core.groupcommit`.
+GROUP_COMMIT = {
+    "ENABLED": False,
+    "MAX_DELAY": 0.002,
+    "MAX_BATCH": 64,
+}
+
+
+# Snippet storage
+
+# Larger snippets are stored (and encrypted) in chunks of CHUNK_SIZE bytes.
+SHAREME_CHUNKING = {
+    "THRESHOLD": 256 * 1024,
+    "CHUNK_SIZE": 64 * 1024,
+}
+
+# Snippets (and chunks) larger than COMPRESS_THRESHOLD bytes are compressed before being stored, and
+# before being encrypted. ALGORITHM is either "zstd", which falls back to zlib when the `zstandard`
+# package isn't installed, or "zlib". LEVEL is the compression level, None for the default.
+SHAREME_CODEC = {
+    "ALGORITHM": "zstd",
+    "COMPRESS_THRESHOLD": 512,
+    "LEVEL": None,
+}
+
+
+# Snippet encryption
+
+# The KDF used for the new encrypted snippets. The existing snippets keep using the KDF they were
+# created with. Either "pbkdf2-sha256" (PARAMS: iterations) or "scrypt" (PARAMS: n, r, p).
+SHAREME_KDF = {
+    "ALGORITHM": "pbkdf2-sha256",
+    "PARAMS": {"iterations": 480000},
+}
+
+SHAREME_KDF_POOL = {
+    # Either "thread" or "process".
+    "EXECUTOR": "thread",
+    "MAX_WORKERS": 2,
+    "MAX_QUEUED": 8,
+    "QUEUE_TIMEOUT": 1,
+}
+
+SHAREME_DERIVED_KEY_CACHE = {
+    "MAX_ENTRIES": 1024,
+    "TIMEOUT": 300,
+}
+
+# With ENABLED, the page offers to encrypt the snippet in the browser instead, with PBKDF2-SHA256 and
+# AES-GCM, in which case the server never sees the content or the key and never derives the key. The
+# browsers use ITERATIONS, which is also the fewest accepted. Larger ciphertexts than MAX_SIZE bytes are
+# refused. See `shareme.client`.
+SHAREME_CLIENT_ENCRYPTION = {
+    "ENABLED": True,
+    "ITERATIONS": 600000,
+    "MAX_SIZE": 1024 * 1024,
+}
+
+
+# Metrics
+
+# Per process counters and timers of the hot paths, served at /metrics in the Prometheus text
+# format. When disabled, /metrics is a 404 and the instrumentation does next to nothing. /metrics
+# isn't authenticated, so only enable it where it can't be reached from outside.
+METRICS = {
+    "ENABLED": False,
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
@@ -15,10 +15,12 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 
+from core.views import get_metrics
 from django.contrib import admin
 from django.urls import path, include
 
 urlpatterns = [
+    path("metrics", get_metrics, name="metrics"),
     path("shorten/", include("shorten.urls", namespace="shorten")),
     path("shareme/", include("shareme.urls", namespace="shareme")),
     path("admin/", admin.site.urls),
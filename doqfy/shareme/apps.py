@@ -1,6 +1,30 @@
+from core.expiry import sweeper
+from core.warmup import warmer
 from django.apps import AppConfig
+from django.db.models.signals import post_delete
 
 
 class SharemeConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "shareme"
+
+    def ready(self) -> None:
+        # Imported here since it imports the models of core.
+        from core.idfilter import id_filters  # noqa: PLC0415
+
+        from .models import Snippet  # noqa: PLC0415
+        from .services import (  # noqa: PLC0415
+            SnippetService,
+            get_burned_snippets,
+            get_expired_snippets,
+            get_unreferenced_bodies,
+            release_body,
+        )
+
+        id_filters["snippet"].track(Snippet)
+        post_delete.connect(release_body, sender=Snippet, dispatch_uid="shareme.services.release_body")
+        # After the snippets, so that the bodies they released are deleted by the same sweep.
+        sweeper.register("shareme.Snippet (expired)", get_expired_snippets)
+        sweeper.register("shareme.Snippet (burned)", get_burned_snippets)
+        sweeper.register("shareme.SnippetBody (unreferenced)", get_unreferenced_bodies)
+        warmer.register("shareme.Snippet (most recent)", SnippetService().warm_cache)
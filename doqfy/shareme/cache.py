@@ -0,0 +1,295 @@
+import json
+import struct
+import zlib
+from dataclasses import dataclass
+from typing import Any, Final, NamedTuple
+
+from core.metrics import metrics
+from django.conf import settings
+from django.core.cache.backends.base import BaseCache
+
+from .codec import bytes_to_token, decode
+from .kdf import KdfSpec
+from .models import Snippet, SnippetBody
+
+_VERSION: Final[int] = 5
+
+_FLAG_ENCRYPTED: Final[int] = 0b0001
+_FLAG_COMPRESSED: Final[int] = 0b0010
+_FLAG_CHUNKED: Final[int] = 0b0100
+_FLAG_ENCODED: Final[int] = 0b1000
+_FLAG_CLIENT_ENCRYPTED: Final[int] = 0b1_0000
+
+_HEADER: Final[struct.Struct] = struct.Struct(">BBBBHIdB")
+"""Version, flags, snippet ID length, salt length, KDF length, body length, expiry (0 if none) and
+shared body digest length.
+"""
+
+_BODY_ID_PREFIX: Final[str] = "body:"
+
+
+@dataclass
+class SnippetRecord:
+    """The cached form of a snippet."""
+
+    snippet_id: str
+    snippet: str
+    """The snippet, or the Fernet token if it's encrypted. This is empty for the chunked snippets.
+
+    For the snippets encrypted by the browser, this is the ciphertext in URL-safe base64.
+    """
+
+    encrypted: bool = False
+    encoded: bool = True
+    """Whether the encrypted content was encoded by `shareme.codec` before being encrypted."""
+
+    chunked: bool = False
+    client_encrypted: bool = False
+    salt: bytes | None = None
+    kdf: KdfSpec | None = None
+    """The KDF used for encrypting the snippet, if it was stored."""
+
+    expires_at: float | None = None
+    """POSIX timestamp."""
+
+    reads_remaining: int | None = None
+    """Not cached, since the snippets with limited reads aren't cached."""
+
+    body: str | None = None
+    """The digest of the shared `SnippetBody` with the content, in which case `snippet` is empty."""
+
+    @classmethod
+    def from_body(cls, body: SnippetBody) -> "SnippetRecord":
+        """Get the record of a shared body, which is cached by its digest rather than a snippet ID."""
+
+        return cls(snippet_id=cls.get_body_id(body.digest), snippet=_decode_data(body.data), chunked=body.chunked)
+
+    @staticmethod
+    def get_body_id(digest: str) -> str:
+        # The snippet IDs are alphanumeric, so these can't clash with them.
+        return f"{_BODY_ID_PREFIX}{digest}"
+
+    @classmethod
+    def from_model(cls, snippet: Snippet) -> "SnippetRecord":
+        return cls(
+            snippet_id=snippet.snippet_id,
+            snippet=bytes_to_token(snippet.data).decode() if snippet.encrypted else _decode_data(snippet.data),
+            encrypted=snippet.encrypted,
+            encoded=snippet.encoded,
+            chunked=snippet.chunked,
+            client_encrypted=snippet.client_encrypted,
+            salt=None if snippet.salt is None else bytes(snippet.salt),
+            kdf=None if snippet.kdf is None else KdfSpec(snippet.kdf, snippet.kdf_params or {}),
+            expires_at=None if snippet.expires_at is None else snippet.expires_at.timestamp(),
+            reads_remaining=snippet.reads_remaining,
+            body=snippet.body_id,
+        )
+
+    def to_bytes(self, compress_threshold: int) -> bytes:
+        flags = (
+            (_FLAG_ENCRYPTED if self.encrypted else 0)
+            | (_FLAG_CHUNKED if self.chunked else 0)
+            | (_FLAG_ENCODED if self.encoded else 0)
+            | (_FLAG_CLIENT_ENCRYPTED if self.client_encrypted else 0)
+        )
+        body = self.snippet.encode()
+        if len(body) > compress_threshold:
+            compressed = zlib.compress(body, level=1)
+            if len(compressed) < len(body):
+                body = compressed
+                flags |= _FLAG_COMPRESSED
+
+        snippet_id = self.snippet_id.encode()
+        salt = self.salt or b""
+        kdf = b"" if self.kdf is None else json.dumps([self.kdf.name, self.kdf.params]).encode()
+        digest = (self.body or "").encode()
+        header = _HEADER.pack(
+            _VERSION, flags, len(snippet_id), len(salt), len(kdf), len(body), self.expires_at or 0, len(digest)
+        )
+
+        return b"".join((header, snippet_id, salt, kdf, digest, body))
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "SnippetRecord":
+        version, flags, id_length, salt_length, kdf_length, body_length, expires_at, digest_length = (
+            _HEADER.unpack_from(data)
+        )
+        if version != _VERSION:
+            raise ValueError(f"unsupported snippet record version {version}")
+
+        view = memoryview(data)[_HEADER.size :]
+        snippet_id, view = bytes(view[:id_length]).decode(), view[id_length:]
+        salt, view = bytes(view[:salt_length]), view[salt_length:]
+        kdf, view = bytes(view[:kdf_length]), view[kdf_length:]
+        digest, view = bytes(view[:digest_length]).decode(), view[digest_length:]
+        body = bytes(view[:body_length])
+        if flags & _FLAG_COMPRESSED:
+            body = zlib.decompress(body)
+
+        kdf_spec = None
+        if kdf:
+            name, params = json.loads(kdf)
+            kdf_spec = KdfSpec(name, params)
+
+        return cls(
+            snippet_id=snippet_id,
+            snippet=body.decode(),
+            encrypted=bool(flags & _FLAG_ENCRYPTED),
+            encoded=bool(flags & _FLAG_ENCODED),
+            chunked=bool(flags & _FLAG_CHUNKED),
+            client_encrypted=bool(flags & _FLAG_CLIENT_ENCRYPTED),
+            salt=salt or None,
+            kdf=kdf_spec,
+            expires_at=expires_at or None,
+            body=digest or None,
+        )
+
+
+def _decode_data(data: bytes | memoryview) -> str:
+    # Empty for the chunked snippets and the ones with a shared body.
+    return decode(data).decode() if data else ""
+
+
+class SnippetCache:
+    """Caches the snippets as compact binary records.
+
+    Records larger than `max_entry_size` (after compressing the ones above `compress_threshold`)
+    aren't cached so that a few large snippets can't push everything else out of the cache. Nor are
+    the snippets with limited reads, since every read has to reach the database anyway.
+    """
+
+    def __init__(self, backend: BaseCache, *, max_entry_size: int = 256 * 1024, compress_threshold: int = 1024) -> None:
+        self.backend = backend
+        self.max_entry_size = max_entry_size
+        self.compress_threshold = compress_threshold
+
+    @classmethod
+    def from_settings(cls, backend: BaseCache) -> "SnippetCache":
+        config: dict[str, Any] = getattr(settings, "SHAREME_SNIPPET_CACHE", {})
+
+        return cls(
+            backend,
+            max_entry_size=config.get("MAX_ENTRY_SIZE", 256 * 1024),
+            compress_threshold=config.get("COMPRESS_THRESHOLD", 1024),
+        )
+
+    def get(self, snippet_id: str) -> SnippetRecord | None:
+        with metrics.timer("cache_seconds", cache="snippets", operation="get"):
+            data = self.backend.get(snippet_id)
+
+        return self._decode(data)
+
+    async def aget(self, snippet_id: str) -> SnippetRecord | None:
+        with metrics.timer("cache_seconds", cache="snippets", operation="get"):
+            data = await self.backend.aget(snippet_id)
+
+        return self._decode(data)
+
+    def set(self, record: SnippetRecord) -> bool:
+        """Cache the record. Returns whether it was small enough to be cached."""
+
+        if (data := self._encode(record)) is None:
+            return False
+
+        with metrics.timer("cache_seconds", cache="snippets", operation="set"):
+            self.backend.set(record.snippet_id, data)
+
+        return True
+
+    async def aset(self, record: SnippetRecord) -> bool:
+        if (data := self._encode(record)) is None:
+            return False
+
+        with metrics.timer("cache_seconds", cache="snippets", operation="set"):
+            await self.backend.aset(record.snippet_id, data)
+
+        return True
+
+    def clear(self) -> None:
+        self.backend.clear()
+
+    def _encode(self, record: SnippetRecord) -> bytes | None:
+        if record.reads_remaining is not None:
+            return None
+
+        # Don't bother encoding snippets that can't fit even if they compress really well.
+        if len(record.snippet) > self.max_entry_size * 20:
+            return None
+
+        data = record.to_bytes(self.compress_threshold)
+
+        return data if len(data) <= self.max_entry_size else None
+
+    def _decode(self, data: bytes | None) -> SnippetRecord | None:
+        if data is None:
+            metrics.inc("cache_requests_total", cache="snippets", result="miss")
+            return None
+
+        try:
+            record = SnippetRecord.from_bytes(data)
+        except (ValueError, struct.error, zlib.error):
+            # Written by a different version.
+            metrics.inc("cache_requests_total", cache="snippets", result="miss")
+            return None
+
+        metrics.inc("cache_requests_total", cache="snippets", result="shared_hit")
+
+        return record
+
+
+class CachedPage(NamedTuple):
+    content: bytes
+    """The rendered page. The CSRF token of the locked pages is left as a placeholder."""
+
+    etag: str
+    """Identifies the content of the snippet, see `SnippetVersion`."""
+
+    expires_at: float | None = None
+    """POSIX timestamp."""
+
+    locked: bool = False
+    """Whether the page is the form asking for the key of an encrypted snippet."""
+
+
+class PageCache:
+    """Caches the rendered snippet pages by their snippet ID.
+
+    Pages larger than `max_entry_size` aren't cached, and the number of pages is bounded by the
+    `MAX_ENTRIES` of the backend, so the pages take up at most `MAX_ENTRIES * max_entry_size` bytes.
+    """
+
+    def __init__(self, backend: BaseCache, *, max_entry_size: int = 64 * 1024) -> None:
+        self.backend = backend
+        self.max_entry_size = max_entry_size
+
+    @classmethod
+    def from_settings(cls, backend: BaseCache) -> "PageCache":
+        config: dict[str, Any] = getattr(settings, "SHAREME_PAGE_CACHE", {})
+
+        return cls(backend, max_entry_size=config.get("MAX_ENTRY_SIZE", 64 * 1024))
+
+    async def aget(self, snippet_id: str) -> CachedPage | None:
+        with metrics.timer("cache_seconds", cache="pages", operation="get"):
+            page = await self.backend.aget(snippet_id)
+
+        if not isinstance(page, CachedPage):
+            metrics.inc("cache_requests_total", cache="pages", result="miss")
+            return None
+
+        metrics.inc("cache_requests_total", cache="pages", result="shared_hit")
+
+        return page
+
+    async def aset(self, snippet_id: str, page: CachedPage) -> bool:
+        """Cache the page. Returns whether it was small enough to be cached."""
+
+        if len(page.content) > self.max_entry_size:
+            return False
+
+        with metrics.timer("cache_seconds", cache="pages", operation="set"):
+            await self.backend.aset(snippet_id, page)
+
+        return True
+
+    def clear(self) -> None:
+        self.backend.clear()
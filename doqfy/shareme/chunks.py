@@ -0,0 +1,85 @@
+"""Chunked storage of the large snippets.
+
+Snippets larger than the `SHAREME_CHUNKING["THRESHOLD"]` bytes are stored as ordered `SnippetChunk`s of at
+most `CHUNK_SIZE` bytes each, so that they can be read and decrypted a chunk at a time.
+
+Each encrypted chunk is a Fernet token of the chunk prefixed by its index and whether it's the last chunk,
+stored as the raw bytes of the token. Since the prefix is authenticated along with the chunk, chunks that
+were reordered, replaced or dropped (including the ones at the end) fail to decrypt just like a tampered
+chunk does.
+"""
+
+import struct
+from collections.abc import Iterator
+from dataclasses import dataclass
+from typing import Any, Final
+
+from cryptography.fernet import Fernet, InvalidToken
+from django.conf import settings
+
+from .codec import bytes_to_token, token_to_bytes
+
+_CHUNK_HEADER: Final[struct.Struct] = struct.Struct(">I?")
+"""The index of the chunk and whether it's the last one."""
+
+
+@dataclass(frozen=True)
+class Chunking:
+    threshold: int = 256 * 1024
+    """Snippets larger than this many bytes are chunked."""
+
+    chunk_size: int = 64 * 1024
+
+    @classmethod
+    def from_settings(cls) -> "Chunking":
+        config: dict[str, Any] = getattr(settings, "SHAREME_CHUNKING", {})
+
+        return cls(threshold=config.get("THRESHOLD", 256 * 1024), chunk_size=config.get("CHUNK_SIZE", 64 * 1024))
+
+    def split(self, content: bytes) -> list[bytes]:
+        """Split the content into chunks, or return an empty list if it's small enough to not be chunked."""
+
+        if len(content) <= self.threshold:
+            return []
+
+        view = memoryview(content)
+
+        return [bytes(view[start : start + self.chunk_size]) for start in range(0, len(content), self.chunk_size)]
+
+
+def encrypt_chunk(fernet: Fernet, index: int, chunk: bytes, *, last: bool) -> bytes:
+    return token_to_bytes(fernet.encrypt(_CHUNK_HEADER.pack(index, last) + chunk))
+
+
+def decrypt_chunk(fernet: Fernet, index: int, token: bytes | memoryview) -> tuple[bytes, bool]:
+    """Decrypt the chunk expected at `index`. Returns the chunk and whether it's the last one.
+
+    Raises `InvalidToken` if the chunk was tampered with or isn't the one expected at `index`.
+    """
+
+    data = fernet.decrypt(bytes_to_token(token))
+    if len(data) < _CHUNK_HEADER.size:
+        raise InvalidToken
+
+    actual_index, last = _CHUNK_HEADER.unpack_from(data)
+    if actual_index != index:
+        raise InvalidToken
+
+    return data[_CHUNK_HEADER.size :], last
+
+
+def decrypt_chunks(fernet: Fernet, tokens: Iterator[bytes | memoryview]) -> Iterator[bytes]:
+    """Decrypt all the chunks of a snippet in order, making sure that none of them are missing."""
+
+    last = False
+    for index, token in enumerate(tokens):
+        if last:
+            # There are chunks after the last one.
+            raise InvalidToken
+
+        chunk, last = decrypt_chunk(fernet, index, token)
+
+        yield chunk
+
+    if not last:
+        raise InvalidToken
@@ -0,0 +1,115 @@
+"""The snippets encrypted by the browser.
+
+The encrypted snippets otherwise cost the server a key derivation (see `shareme.kdf`) on every create
+and every read with a new key. With `SHAREME_CLIENT_ENCRYPTION["ENABLED"]`, the page offers to encrypt
+the snippet with WebCrypto instead: the browser derives a 256 bit AES key from the key with
+PBKDF2-SHA256 over a random 16 byte salt, encrypts the UTF-8 content with AES-GCM under a random 12
+byte IV and posts the IV followed by the ciphertext, the salt and the number of iterations, in base64.
+
+The server stores the ciphertext as it is and serves it back to the snippet page, which asks for the key
+and decrypts it in the browser. The server never sees the content or the key, so it can't check the
+key either: every view of the page counts as a read, and the raw and download views aren't available.
+"""
+
+import base64
+import binascii
+from dataclasses import dataclass
+from typing import Any, Final, NamedTuple
+
+from django.conf import settings
+
+from .cache import SnippetRecord
+from .codec import token_to_bytes
+from .kdf import KdfSpec, Pbkdf2Kdf
+
+SALT_LENGTH: Final[int] = 16
+
+_MIN_CIPHERTEXT_LENGTH: Final[int] = 12 + 16
+"""The IV and the authentication tag of AES-GCM."""
+
+_MAX_ITERATIONS_FACTOR: Final[int] = 10
+"""How many times `ITERATIONS` a snippet may use, so that its readers' browsers aren't stuck deriving."""
+
+
+class InvalidCiphertextError(ValueError):
+    """Raised when what the browser posted isn't a snippet encrypted as expected."""
+
+
+class ClientCiphertext(NamedTuple):
+    """What the browser needs to decrypt a snippet, in base64."""
+
+    ciphertext: str
+    salt: str
+    iterations: int
+
+    @classmethod
+    def from_record(cls, snippet: SnippetRecord) -> "ClientCiphertext":
+        assert snippet.salt is not None
+        assert snippet.kdf is not None
+
+        return cls(
+            base64.b64encode(token_to_bytes(snippet.snippet)).decode(),
+            base64.b64encode(snippet.salt).decode(),
+            snippet.kdf.params["iterations"],
+        )
+
+
+class ClientEncryptedSnippet(NamedTuple):
+    ciphertext: bytes
+    """The IV followed by the ciphertext and its authentication tag."""
+
+    salt: bytes
+    kdf: KdfSpec
+
+
+@dataclass(frozen=True)
+class ClientEncryption:
+    enabled: bool = True
+    iterations: int = 600000
+    """The number of PBKDF2 iterations used by the browsers, and the fewest accepted."""
+
+    max_size: int = 1024 * 1024
+    """The largest ciphertext accepted, in bytes."""
+
+    @classmethod
+    def from_settings(cls) -> "ClientEncryption":
+        config: dict[str, Any] = getattr(settings, "SHAREME_CLIENT_ENCRYPTION", {})
+
+        return cls(
+            enabled=config.get("ENABLED", True),
+            iterations=config.get("ITERATIONS", 600000),
+            max_size=config.get("MAX_SIZE", 1024 * 1024),
+        )
+
+    def parse(self, ciphertext: str, salt: str, iterations: str) -> ClientEncryptedSnippet:
+        """Check and decode what the browser posted.
+
+        Raises `InvalidCiphertextError` if it's malformed, too large, or not derived with enough iterations.
+        """
+
+        if not self.enabled:
+            raise InvalidCiphertextError("encrypting in the browser is disabled")
+
+        # Checked before decoding too, base64 takes 4 characters per 3 bytes.
+        if len(ciphertext) > (self.max_size + 2) // 3 * 4:
+            raise InvalidCiphertextError("the ciphertext is too large")
+
+        try:
+            decoded_ciphertext = base64.b64decode(ciphertext, validate=True)
+            decoded_salt = base64.b64decode(salt, validate=True)
+            iteration_count = int(iterations)
+        except (binascii.Error, ValueError) as ex:
+            raise InvalidCiphertextError("malformed ciphertext, salt or iterations") from ex
+
+        if len(decoded_ciphertext) > self.max_size:
+            raise InvalidCiphertextError("the ciphertext is too large")
+
+        if len(decoded_ciphertext) < _MIN_CIPHERTEXT_LENGTH or len(decoded_salt) != SALT_LENGTH:
+            raise InvalidCiphertextError("the ciphertext or the salt is too short")
+
+        if not self.iterations <= iteration_count <= self.iterations * _MAX_ITERATIONS_FACTOR:
+            raise InvalidCiphertextError(f"{iteration_count} iterations are out of bounds")
+
+        return ClientEncryptedSnippet(
+            decoded_ciphertext, decoded_salt, KdfSpec(Pbkdf2Kdf.name, {"iterations": iteration_count})
+        )
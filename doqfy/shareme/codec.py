@@ -0,0 +1,103 @@
+"""The storage format of the snippet contents.
+
+The contents are stored as a one byte header naming the compression, followed by the content. Contents
+larger than `SHAREME_CODEC["COMPRESS_THRESHOLD"]` bytes are compressed with zstd if the `zstandard`
+package is installed and with zlib otherwise, unless that doesn't make them any smaller. The encrypted
+snippets are compressed before they're encrypted, since the ciphertext doesn't compress.
+
+The Fernet tokens are URL-safe base64, so they're stored decoded, as the raw bytes of the token.
+"""
+
+import base64
+import zlib
+from dataclasses import dataclass
+from typing import Any, Final
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+_RAW: Final[int] = 0
+_ZLIB: Final[int] = 1
+_ZSTD: Final[int] = 2
+
+_ALGORITHMS: Final[dict[str, int]] = {"zlib": _ZLIB, "zstd": _ZSTD}
+
+
+class UnsupportedCodecError(ValueError):
+    """Raised when decoding a content that was compressed with something that isn't available."""
+
+
+@dataclass(frozen=True)
+class Codec:
+    compress_threshold: int = 512
+    algorithm: str = "zstd"
+    """Either "zstd" or "zlib". zstd falls back to zlib if `zstandard` isn't installed."""
+
+    level: int | None = None
+    """The compression level, or `None` for the default of the algorithm."""
+
+    @classmethod
+    def from_settings(cls) -> "Codec":
+        config: dict[str, Any] = getattr(settings, "SHAREME_CODEC", {})
+        algorithm = config.get("ALGORITHM", "zstd")
+        if algorithm not in _ALGORITHMS:
+            raise ImproperlyConfigured(f"unknown algorithm {algorithm!r} in SHAREME_CODEC")
+
+        return cls(
+            compress_threshold=config.get("COMPRESS_THRESHOLD", 512), algorithm=algorithm, level=config.get("LEVEL")
+        )
+
+    def encode(self, content: bytes) -> bytes:
+        if len(content) > self.compress_threshold:
+            header, compressed = self._compress(content)
+            if len(compressed) < len(content):
+                return bytes((header,)) + compressed
+
+        return bytes((_RAW,)) + content
+
+    def _compress(self, content: bytes) -> tuple[int, bytes]:
+        if self.algorithm == "zstd" and zstandard is not None:
+            compressor = zstandard.ZstdCompressor(level=3 if self.level is None else self.level)
+
+            return _ZSTD, compressor.compress(content)
+
+        return _ZLIB, zlib.compress(content, level=-1 if self.level is None else self.level)
+
+
+def decode(data: bytes | memoryview) -> bytes:
+    """Get the content back from its stored form.
+
+    Raises `UnsupportedCodecError` if it was compressed with zstd and `zstandard` isn't installed.
+    """
+
+    # The database may give a memoryview.
+    view = memoryview(data)
+    if not view:
+        raise UnsupportedCodecError("missing the header")
+
+    header, content = view[0], view[1:]
+    if header == _RAW:
+        return bytes(content)
+    if header == _ZLIB:
+        return zlib.decompress(content)
+    if header == _ZSTD and zstandard is not None:
+        return zstandard.ZstdDecompressor().decompress(content)
+
+    raise UnsupportedCodecError(f"unsupported header {header}")
+
+
+def token_to_bytes(token: bytes | str) -> bytes:
+    """Decode a Fernet token for storing it."""
+
+    return base64.urlsafe_b64decode(token)
+
+
+def bytes_to_token(data: bytes | memoryview) -> bytes:
+    """Encode a stored Fernet token back for decrypting it."""
+
+    return base64.urlsafe_b64encode(data)
@@ -0,0 +1,202 @@
+import asyncio
+import base64
+import hashlib
+import hmac
+import os
+import threading
+from abc import ABC, abstractmethod
+from collections.abc import Callable
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, ClassVar, Final, TypeVar
+
+from core.cache import LocalLRUCache
+from core.metrics import metrics
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+from cryptography.hazmat.primitives.kdf.scrypt import Scrypt
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+T = TypeVar("T")
+
+
+class KeyDerivationBusyError(Exception):
+    """Raised when there are too many key derivations running or waiting to run."""
+
+
+class UnknownKdfError(ValueError):
+    ...
+
+
+class Kdf(ABC):
+    """A key derivation function that can be used for encrypting the snippets."""
+
+    name: ClassVar[str]
+    default_params: ClassVar[dict[str, Any]]
+
+    @abstractmethod
+    def derive(self, key: bytes, salt: bytes, params: dict[str, Any]) -> bytes:
+        """Derive a 32 byte key using the given parameters."""
+
+
+class Pbkdf2Kdf(Kdf):
+    name = "pbkdf2-sha256"
+    default_params: ClassVar[dict[str, Any]] = {"iterations": 480000}
+
+    def derive(self, key: bytes, salt: bytes, params: dict[str, Any]) -> bytes:
+        kdf = PBKDF2HMAC(algorithm=hashes.SHA256(), length=32, salt=salt, iterations=params["iterations"])
+
+        return kdf.derive(key)
+
+
+class ScryptKdf(Kdf):
+    """The memory hard scrypt. The defaults use 16 MiB per derivation."""
+
+    name = "scrypt"
+    default_params: ClassVar[dict[str, Any]] = {"n": 2**14, "r": 8, "p": 1}
+
+    def derive(self, key: bytes, salt: bytes, params: dict[str, Any]) -> bytes:
+        kdf = Scrypt(salt=salt, length=32, n=params["n"], r=params["r"], p=params["p"])
+
+        return kdf.derive(key)
+
+
+KDFS: Final[dict[str, Kdf]] = {kdf.name: kdf for kdf in (Pbkdf2Kdf(), ScryptKdf())}
+"""The registry of the supported KDFs by their name."""
+
+
+@dataclass(frozen=True)
+class KdfSpec:
+    """The KDF and the parameters used for a snippet."""
+
+    name: str
+    params: dict[str, Any]
+
+    @classmethod
+    def legacy(cls) -> "KdfSpec":
+        """Get the spec of the snippets that were encrypted before the spec was stored with them."""
+
+        return cls(Pbkdf2Kdf.name, {"iterations": 480000})
+
+    @classmethod
+    def from_settings(cls) -> "KdfSpec":
+        config: dict[str, Any] = getattr(settings, "SHAREME_KDF", {})
+        name = config.get("ALGORITHM", Pbkdf2Kdf.name)
+        if name not in KDFS:
+            raise ImproperlyConfigured(f"unknown KDF {name!r} in SHAREME_KDF")
+
+        return cls(name, {**KDFS[name].default_params, **config.get("PARAMS", {})})
+
+
+def derive_fernet_key(key: str, salt: bytes, spec: KdfSpec) -> bytes:
+    try:
+        kdf = KDFS[spec.name]
+    except KeyError as ex:
+        raise UnknownKdfError(f"unknown KDF {spec.name!r}") from ex
+
+    return base64.urlsafe_b64encode(kdf.derive(key.encode(), salt, spec.params))
+
+
+class KeyDerivationPool:
+    """Runs the key derivations on a bounded pool of worker threads or processes.
+
+    At most `max_workers + max_queued` derivations are accepted at a time. Beyond that, callers
+    wait for up to `queue_timeout` seconds for a slot (the async callers don't wait at all) and
+    then get a `KeyDerivationBusyError`, so an overload is rejected instead of piling up.
+
+    The executor is created on first use so that it isn't inherited by forked worker processes.
+    """
+
+    def __init__(
+        self, *, executor: str = "thread", max_workers: int = 2, max_queued: int = 8, queue_timeout: float = 1
+    ) -> None:
+        if executor not in ("thread", "process"):
+            raise ImproperlyConfigured(f"unknown key derivation executor {executor!r}")
+
+        self.executor = executor
+        self.max_workers = max_workers
+        self.queue_timeout = queue_timeout
+        self._slots = threading.BoundedSemaphore(max_workers + max_queued)
+        self._executor: Executor | None = None
+        self._executor_lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls) -> "KeyDerivationPool":
+        config: dict[str, Any] = getattr(settings, "SHAREME_KDF_POOL", {})
+
+        return cls(
+            executor=config.get("EXECUTOR", "thread"),
+            max_workers=config.get("MAX_WORKERS", 2),
+            max_queued=config.get("MAX_QUEUED", 8),
+            queue_timeout=config.get("QUEUE_TIMEOUT", 1),
+        )
+
+    def run(self, fn: Callable[..., T], *args: Any) -> T:  # noqa: ANN401
+        """Run the function in the pool and wait for the result.
+
+        With the process executor, the function and the arguments must be picklable.
+        """
+
+        return self._submit(fn, args, self.queue_timeout).result()
+
+    async def arun(self, fn: Callable[..., T], *args: Any) -> T:  # noqa: ANN401
+        return await asyncio.wrap_future(self._submit(fn, args, 0))
+
+    def _submit(self, fn: Callable[..., T], args: tuple[Any, ...], timeout: float) -> Future[T]:
+        if not self._slots.acquire(timeout=timeout):
+            metrics.inc("kdf_rejected_total")
+            raise KeyDerivationBusyError
+
+        try:
+            future = self._get_executor().submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+
+        future.add_done_callback(lambda _: self._slots.release())
+
+        return future
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    if self.executor == "process":
+                        self._executor = ProcessPoolExecutor(self.max_workers)
+                    else:
+                        self._executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix="shareme-kdf")
+
+        return self._executor
+
+
+class DerivedKeyCache:
+    """A short lived, in-process cache of the keys derived for decrypting the snippets.
+
+    The entries are keyed by the snippet ID and an HMAC of the user's key under a random
+    per-process secret, so the user's key isn't kept in memory as is.
+    """
+
+    _secret: Final[bytes] = os.urandom(32)
+
+    def __init__(self, *, max_entries: int = 1024, timeout: float = 300) -> None:
+        self.timeout = timeout
+        self._cache = LocalLRUCache(max_entries)
+
+    @classmethod
+    def from_settings(cls) -> "DerivedKeyCache":
+        config: dict[str, Any] = getattr(settings, "SHAREME_DERIVED_KEY_CACHE", {})
+
+        return cls(max_entries=config.get("MAX_ENTRIES", 1024), timeout=config.get("TIMEOUT", 300))
+
+    def get(self, snippet_id: str, key: str) -> bytes | None:
+        return self._cache.get(self._cache_key(snippet_id, key))
+
+    def set(self, snippet_id: str, key: str, derived_key: bytes) -> None:
+        self._cache.set(self._cache_key(snippet_id, key), derived_key, self.timeout)
+
+    def clear(self) -> None:
+        self._cache.clear()
+
+    def _cache_key(self, snippet_id: str, key: str) -> tuple[str, bytes]:
+        return snippet_id, hmac.digest(self._secret, key.encode(), hashlib.sha256)
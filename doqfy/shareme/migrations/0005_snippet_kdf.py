@@ -0,0 +1,22 @@
+# Generated by Django 5.0.3 on 2026-10-18 07:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("shareme", "0004_alter_snippet_salt"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="snippet",
+            name="kdf",
+            field=models.CharField(default=None, max_length=32, null=True),
+        ),
+        migrations.AddField(
+            model_name="snippet",
+            name="kdf_params",
+            field=models.JSONField(default=None, null=True),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.0.3 on 2026-10-18 07:31
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("shareme", "0005_snippet_kdf"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="snippet",
+            name="chunked",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.CreateModel(
+            name="SnippetChunk",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("index", models.PositiveIntegerField()),
+                ("data", models.BinaryField()),
+                (
+                    "snippet",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="chunks",
+                        to="shareme.snippet",
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name="snippetchunk",
+            constraint=models.UniqueConstraint(
+                fields=("snippet", "index"), name="unique_snippet_chunk_index"
+            ),
+        ),
+    ]
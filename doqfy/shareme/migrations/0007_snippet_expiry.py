@@ -0,0 +1,38 @@
+# Generated by Django 5.0.3 on 2026-10-18 07:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("shareme", "0006_snippet_chunks"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="snippet",
+            name="expires_at",
+            field=models.DateTimeField(default=None, null=True),
+        ),
+        migrations.AddField(
+            model_name="snippet",
+            name="reads_remaining",
+            field=models.PositiveIntegerField(default=None, null=True),
+        ),
+        migrations.AddIndex(
+            model_name="snippet",
+            index=models.Index(
+                condition=models.Q(("expires_at__isnull", False)),
+                fields=["expires_at"],
+                name="snippet_expires_at",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="snippet",
+            index=models.Index(
+                condition=models.Q(("reads_remaining", 0)),
+                fields=["reads_remaining"],
+                name="snippet_burned",
+            ),
+        ),
+    ]
@@ -0,0 +1,82 @@
+# Generated by Django 5.0.3 on 2026-10-18 07:48
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("shareme", "0007_snippet_expiry"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="snippetchunk",
+            name="snippet",
+            field=models.ForeignKey(
+                default=None,
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="chunks",
+                to="shareme.snippet",
+            ),
+        ),
+        migrations.CreateModel(
+            name="SnippetBody",
+            fields=[
+                (
+                    "digest",
+                    models.CharField(max_length=64, primary_key=True, serialize=False),
+                ),
+                ("content", models.TextField()),
+                ("chunked", models.BooleanField(default=False)),
+                ("ref_count", models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        condition=models.Q(("ref_count", 0)),
+                        fields=["ref_count"],
+                        name="snippet_body_unreferenced",
+                    )
+                ],
+            },
+        ),
+        migrations.AddField(
+            model_name="snippet",
+            name="body",
+            field=models.ForeignKey(
+                default=None,
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="snippets",
+                to="shareme.snippetbody",
+            ),
+        ),
+        migrations.AddField(
+            model_name="snippetchunk",
+            name="body",
+            field=models.ForeignKey(
+                default=None,
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="chunks",
+                to="shareme.snippetbody",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="snippetchunk",
+            constraint=models.UniqueConstraint(
+                fields=("body", "index"), name="unique_snippet_body_chunk_index"
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="snippetchunk",
+            constraint=models.CheckConstraint(
+                check=models.Q(
+                    ("snippet__isnull", True), ("body__isnull", True), _connector="XOR"
+                ),
+                name="snippet_chunk_owner",
+            ),
+        ),
+    ]
@@ -0,0 +1,175 @@
+# Generated by Django 5.0.3 on 2026-10-18 07:52
+
+import base64
+import zlib
+from typing import Any
+
+from django.db import migrations, models
+from django.db.backends.base.schema import BaseDatabaseSchemaEditor
+from django.db.migrations.state import StateApps
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+_BATCH_SIZE = 500
+
+# Frozen copies of `shareme.codec` as of this migration, so that changing the codec or its settings
+# doesn't change what the migration does. The contents are compressed with zlib only.
+_RAW = 0
+_ZLIB = 1
+_ZSTD = 2
+_COMPRESS_THRESHOLD = 512
+
+
+def _encode(content: bytes) -> bytes:
+    if len(content) > _COMPRESS_THRESHOLD:
+        compressed = zlib.compress(content)
+        if len(compressed) < len(content):
+            return bytes((_ZLIB,)) + compressed
+
+    return bytes((_RAW,)) + content
+
+
+def _decode(data: bytes | memoryview) -> bytes:
+    # The snippets created since the migration may have been compressed with zstd.
+    view = memoryview(data)
+    header, content = view[0], view[1:]
+    if header == _RAW:
+        return bytes(content)
+    if header == _ZLIB:
+        return zlib.decompress(content)
+    if header == _ZSTD and zstandard is not None:
+        return zstandard.ZstdDecompressor().decompress(content)
+
+    raise RuntimeError(f"unsupported header {header}")
+
+
+def _token_to_bytes(token: bytes | str) -> bytes:
+    return base64.urlsafe_b64decode(token)
+
+
+def _bytes_to_token(data: bytes | memoryview) -> bytes:
+    return base64.urlsafe_b64encode(data)
+
+
+def encode_contents(apps: StateApps, schema_editor: BaseDatabaseSchemaEditor) -> None:  # noqa: ARG001
+    """Encode the contents with the codec and store the Fernet tokens as raw bytes.
+
+    The existing encrypted snippets were encrypted without the codec, so they're marked as not encoded.
+    """
+
+    snippet_model = apps.get_model("shareme", "Snippet")
+    body_model = apps.get_model("shareme", "SnippetBody")
+    chunk_model = apps.get_model("shareme", "SnippetChunk")
+
+    def encode_snippet(snippet: Any) -> None:  # noqa: ANN401
+        if snippet.encrypted:
+            snippet.data = _token_to_bytes(snippet.snippet) if snippet.snippet else b""
+            snippet.encoded = False
+        else:
+            snippet.data = _encode(snippet.snippet.encode()) if snippet.snippet else b""
+
+    def encode_body(body: Any) -> None:  # noqa: ANN401
+        body.data = b"" if body.chunked else _encode(body.content.encode())
+
+    def encode_chunk(chunk: Any) -> None:  # noqa: ANN401
+        if chunk.snippet_id is not None and chunk.snippet.encrypted:
+            chunk.data = _token_to_bytes(bytes(chunk.data))
+        else:
+            chunk.data = _encode(bytes(chunk.data))
+
+    _update(snippet_model.objects.all(), encode_snippet, ("data", "encoded"))
+    _update(body_model.objects.all(), encode_body, ("data",))
+    _update(chunk_model.objects.select_related("snippet"), encode_chunk, ("data",))
+
+
+def decode_contents(apps: StateApps, schema_editor: BaseDatabaseSchemaEditor) -> None:  # noqa: ARG001
+    snippet_model = apps.get_model("shareme", "Snippet")
+    body_model = apps.get_model("shareme", "SnippetBody")
+    chunk_model = apps.get_model("shareme", "SnippetChunk")
+
+    def decode_snippet(snippet: Any) -> None:  # noqa: ANN401
+        if not snippet.data:
+            snippet.snippet = ""
+        elif not snippet.encrypted:
+            snippet.snippet = _decode(snippet.data).decode()
+        elif snippet.encoded:
+            # The tokens of the compressed content can't be decrypted by the previous version.
+            raise RuntimeError(f"snippet {snippet.snippet_id} was encrypted with the codec")
+        else:
+            snippet.snippet = _bytes_to_token(snippet.data).decode()
+
+    def decode_body(body: Any) -> None:  # noqa: ANN401
+        body.content = _decode(body.data).decode() if body.data else ""
+
+    def decode_chunk(chunk: Any) -> None:  # noqa: ANN401
+        if chunk.snippet_id is not None and chunk.snippet.encrypted:
+            if chunk.snippet.encoded:
+                raise RuntimeError(f"snippet {chunk.snippet_id} was encrypted with the codec")
+
+            chunk.data = _bytes_to_token(chunk.data)
+        else:
+            chunk.data = _decode(chunk.data)
+
+    _update(snippet_model.objects.all(), decode_snippet, ("snippet",))
+    _update(body_model.objects.all(), decode_body, ("content",))
+    _update(chunk_model.objects.select_related("snippet"), decode_chunk, ("data",))
+
+
+def _update(queryset: models.QuerySet, convert: Any, fields: tuple[str, ...]) -> None:  # noqa: ANN401
+    batch = []
+    for instance in queryset.iterator(chunk_size=_BATCH_SIZE):
+        convert(instance)
+        batch.append(instance)
+        if len(batch) == _BATCH_SIZE:
+            queryset.model.objects.bulk_update(batch, fields)
+            batch.clear()
+
+    if batch:
+        queryset.model.objects.bulk_update(batch, fields)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("shareme", "0008_snippet_bodies"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="snippet",
+            name="data",
+            field=models.BinaryField(default=b""),
+        ),
+        migrations.AddField(
+            model_name="snippet",
+            name="encoded",
+            field=models.BooleanField(default=True),
+        ),
+        migrations.AddField(
+            model_name="snippetbody",
+            name="data",
+            field=models.BinaryField(default=b""),
+        ),
+        migrations.RunPython(encode_contents, decode_contents),
+        # So that the columns can be added back to the existing rows when migrating backwards.
+        migrations.AlterField(
+            model_name="snippet",
+            name="snippet",
+            field=models.TextField(default=""),
+        ),
+        migrations.AlterField(
+            model_name="snippetbody",
+            name="content",
+            field=models.TextField(default=""),
+        ),
+        migrations.RemoveField(
+            model_name="snippet",
+            name="snippet",
+        ),
+        migrations.RemoveField(
+            model_name="snippetbody",
+            name="content",
+        ),
+    ]
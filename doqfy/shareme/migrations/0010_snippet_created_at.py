@@ -0,0 +1,28 @@
+# Generated by Django 5.0.3 on 2026-10-18 07:55
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("shareme", "0009_snippet_codec"),
+    ]
+
+    operations = [
+        # Added without the default first, so that the existing snippets don't all look just created.
+        migrations.AddField(
+            model_name="snippet",
+            name="created_at",
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AlterField(
+            model_name="snippet",
+            name="created_at",
+            field=models.DateTimeField(default=django.utils.timezone.now, null=True),
+        ),
+        migrations.AddIndex(
+            model_name="snippet",
+            index=models.Index(fields=["-created_at"], name="snippet_created_at"),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.0.3 on 2026-10-18 08:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("shareme", "0010_snippet_created_at"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="snippet",
+            name="client_encrypted",
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -1,11 +1,117 @@
 from django.db import models
+from django.utils import timezone
+
+
+class SnippetBody(models.Model):
+    """The content of the unencrypted snippets, stored once for all the snippets with the same content.
+
+    `ref_count` is the number of snippets pointing at the body. The bodies that aren't referenced
+    anymore are deleted by the sweeper (see `core.expiry`).
+    """
+
+    digest = models.CharField(primary_key=True, max_length=64)
+    """SHA-256 hex digest of the content."""
+
+    data = models.BinaryField(default=b"")
+    """The content, encoded by `shareme.codec`."""
+
+    chunked = models.BooleanField(default=False)
+    """Whether the content is stored as `SnippetChunk`s, in which case `data` is empty."""
+
+    ref_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        """The index for the sweeper of the unreferenced bodies."""
+
+        indexes = (
+            models.Index(fields=("ref_count",), name="snippet_body_unreferenced", condition=models.Q(ref_count=0)),
+        )
+
+    def __str__(self) -> str:
+        return f"SnippetBody(digest={self.digest}, ref_count={self.ref_count})"
 
 
 class Snippet(models.Model):
     snippet_id = models.CharField(primary_key=True, max_length=20)
-    snippet = models.TextField()
+    data = models.BinaryField(default=b"")
+    """The snippet encoded by `shareme.codec`, or the Fernet token of it if the snippet is encrypted."""
+
+    encoded = models.BooleanField(default=True)
+    """Whether the encrypted content was encoded by `shareme.codec` before being encrypted.
+
+    This is `False` only for the snippets encrypted before the codec existed, whose tokens are of the
+    plain content.
+    """
+
     encrypted = models.BooleanField(default=False)
     salt = models.BinaryField(max_length=16, default=None, null=True)
+    kdf = models.CharField(max_length=32, default=None, null=True)  # noqa: DJ001
+    """The name of the KDF used to derive the encryption key.
+
+    This is `None` for the unencrypted snippets and the ones encrypted before the KDF was stored,
+    which all used PBKDF2 with 480000 iterations.
+    """
+
+    kdf_params = models.JSONField(default=None, null=True)
+    chunked = models.BooleanField(default=False)
+    """Whether the snippet is stored as `SnippetChunk`s, in which case `data` is empty."""
+
+    client_encrypted = models.BooleanField(default=False)
+    """Whether the snippet was encrypted by the browser, in which case `data` is the AES-GCM ciphertext
+    that only the browser can decrypt. See `shareme.client`.
+    """
+
+    body = models.ForeignKey(SnippetBody, on_delete=models.PROTECT, related_name="snippets", default=None, null=True)
+    """The shared content of the snippet, in which case `data` is empty and `chunked` is `False`.
+
+    This is `None` for the encrypted snippets and the ones created before the bodies were shared.
+    """
+
+    created_at = models.DateTimeField(default=timezone.now, null=True)
+    """This is `None` for the snippets created before the column existed."""
+
+    expires_at = models.DateTimeField(default=None, null=True)
+    """When the snippet stops being readable. See `core.expiry`."""
+
+    reads_remaining = models.PositiveIntegerField(default=None, null=True)
+    """The number of reads left before the snippet stops being readable, if it's limited."""
+
+    class Meta:
+        """The indexes for the sweeper and for warming the cache with the recent snippets."""
+
+        indexes = (
+            models.Index(
+                fields=("expires_at",), name="snippet_expires_at", condition=models.Q(expires_at__isnull=False)
+            ),
+            models.Index(fields=("reads_remaining",), name="snippet_burned", condition=models.Q(reads_remaining=0)),
+            models.Index(fields=("-created_at",), name="snippet_created_at"),
+        )
 
     def __str__(self) -> str:
-        return f"Snippet(snippet_id={self.snippet_id}, snippet={self.snippet}, encrypted={self.encrypted})"
+        return f"Snippet(snippet_id={self.snippet_id}, encrypted={self.encrypted})"
+
+
+class SnippetChunk(models.Model):
+    """A part of a large snippet or snippet body. See `shareme.chunks`."""
+
+    snippet = models.ForeignKey(Snippet, on_delete=models.CASCADE, related_name="chunks", default=None, null=True)
+    body = models.ForeignKey(SnippetBody, on_delete=models.CASCADE, related_name="chunks", default=None, null=True)
+    index = models.PositiveIntegerField()
+    data = models.BinaryField()
+    """The chunk encoded by `shareme.codec`, or the Fernet token of it if the snippet is encrypted."""
+
+    class Meta:
+        """A chunk belongs to either a snippet or a body, once per index."""
+
+        constraints = (
+            models.UniqueConstraint(fields=("snippet", "index"), name="unique_snippet_chunk_index"),
+            models.UniqueConstraint(fields=("body", "index"), name="unique_snippet_body_chunk_index"),
+            models.CheckConstraint(
+                check=models.Q(snippet__isnull=True) ^ models.Q(body__isnull=True), name="snippet_chunk_owner"
+            ),
+        )
+
+    def __str__(self) -> str:
+        owner = f"snippet_id={self.snippet_id}" if self.body_id is None else f"body_id={self.body_id}"
+
+        return f"SnippetChunk({owner}, index={self.index})"
@@ -1,18 +1,29 @@
-import base64
+import hashlib
+import itertools
 import os
-import secrets
-import string
-from dataclasses import dataclass
-from typing import Final
-
+import time
+from collections.abc import Callable, Iterator
+from dataclasses import dataclass, replace
+from datetime import datetime
+from typing import Any, Final, NamedTuple
+
+from core.expiry import is_expired
+from core.groupcommit import group_commit
+from core.idfilter import IdFilter, id_filters
+from core.ids import IdAllocator, allocators
+from core.metrics import metrics
 from cryptography.fernet import Fernet, InvalidToken
-from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
 from django.core.cache import caches
-from django.core.cache.backends.base import BaseCache
 from django.db import IntegrityError
+from django.db.models import F, Q, QuerySet
+from django.utils import timezone
 
-from .models import Snippet
+from .cache import SnippetCache, SnippetRecord
+from .chunks import Chunking, decrypt_chunk, decrypt_chunks, encrypt_chunk
+from .client import ClientCiphertext, ClientEncryptedSnippet
+from .codec import Codec, decode, token_to_bytes
+from .kdf import DerivedKeyCache, KdfSpec, KeyDerivationPool, derive_fernet_key
+from .models import Snippet, SnippetBody, SnippetChunk
 
 
 class SnippetCreationError(Exception):
@@ -27,6 +38,36 @@ class DecryptionError(Exception):
     ...
 
 
+class KeyRequiredError(Exception):
+    """Raised when an encrypted snippet is read without a key."""
+
+
+class BrowserEncryptedError(KeyRequiredError):
+    """Raised when a snippet encrypted by the browser is read, which only the browser can decrypt."""
+
+
+class SnippetContent(NamedTuple):
+    snippet: str
+    encrypted: bool
+    """Whether `snippet` is still encrypted, in which case it shouldn't be shown."""
+
+    truncated: bool = False
+    """Whether `snippet` is only the beginning of a chunked snippet."""
+
+    ciphertext: ClientCiphertext | None = None
+    """The snippet encrypted by the browser, for the browser to decrypt. `snippet` is then empty."""
+
+
+class SnippetVersion(NamedTuple):
+    """Identifies the content of a snippet, for caching what's rendered from it."""
+
+    digest: str
+    """SHA-256 hex digest of the content, or empty if the snippet is encrypted."""
+
+    expires_at: float | None
+    """POSIX timestamp."""
+
+
 @dataclass
 class EncryptedSnippet:
     snippet: str
@@ -35,57 +76,197 @@ class EncryptedSnippet:
     salt: bytes
     """The salt used to encrypt the snippet."""
 
+    kdf: KdfSpec
+    """The KDF used to derive the encryption key."""
+
+    encoded: bool = True
+    """Whether the snippet was encoded by `shareme.codec` before being encrypted."""
+
 
 class SnippetService:
-    _max_retry_count: Final[int] = 5
-    _min_length: Final[int] = 10
+    _max_retry_count: Final[int] = 3
     _salt_length: Final[int] = 16
 
-    _snippet_cache: Final[BaseCache] = caches["snippets"]
+    _snippet_cache: Final[SnippetCache] = SnippetCache.from_settings(caches["snippets"])
+    _id_allocator: Final[IdAllocator] = allocators["snippet"]
+    _id_filter: Final[IdFilter] = id_filters["snippet"]
+    """Answers the unknown snippet IDs without looking them up, and skips the known ones when allocating."""
+
+    _kdf_pool: Final[KeyDerivationPool] = KeyDerivationPool.from_settings()
+    _derived_key_cache: Final[DerivedKeyCache] = DerivedKeyCache.from_settings()
+    _kdf: Final[KdfSpec] = KdfSpec.from_settings()
+    """The KDF used for the new snippets."""
+
+    _codec: Final[Codec] = Codec.from_settings()
+    _chunking: Final[Chunking] = Chunking.from_settings()
+    _chunk_batch_size: Final[int] = 100
 
-    def get_snippet(self, snippet_id: str, key: str | None = None) -> tuple[str, bool]:
+    def get_snippet(self, snippet_id: str, key: str | None = None) -> SnippetContent:
         """Get the snippet for the given snippet ID.
 
-        Returns a tuple containing the snippet and a boolean indicating whether the returned
-        snippet is encrypted or not. If `True`, then it's encrypted and if `False`, then it's
-        decrypted.
+        Returns the snippet and whether it's still encrypted. The snippet is decrypted if a key is
+        given. Only the first chunk of the chunked snippets is returned, use `iter_snippet` to get
+        all of it. Returning the snippet other than still encrypted counts as a read of it.
+
+        Decrypting raises `KeyDerivationBusyError` if the server is already busy deriving keys.
         """
 
-        if (snippet := self._snippet_cache.get(snippet_id, None)) is None:
-            try:
-                snippet = Snippet.objects.get(snippet_id=snippet_id)
-            except Snippet.DoesNotExist as ex:
-                raise SnippetNotFoundError from ex
+        snippet = self._get_record(snippet_id)
 
-        if key:
-            if snippet.salt is None:
-                raise ValueError("snippet does not have a salt")
+        first_chunk = _get_chunks(snippet).filter(index=0).first() if snippet.chunked else None
+        # The snippets encrypted by the browser can only be decrypted by the browser.
+        if not key or snippet.client_encrypted:
+            content = _get_content(snippet, first_chunk)
+            if _is_readable_without_key(snippet):
+                _consume_read(snippet)
 
-            try:
-                encrypted_snippet = EncryptedSnippet(snippet=snippet.snippet, salt=snippet.salt)
-                return self._decrypt(key, encrypted_snippet), False
-            except InvalidToken as ex:
-                raise DecryptionError from ex
+            return content
+
+        encrypted_snippet = _get_encrypted_snippet(snippet)
+        encryption_key = self._get_encryption_key(snippet_id, key, encrypted_snippet)
+        content = self._get_decrypted_content(snippet, key, encryption_key, encrypted_snippet, first_chunk)
+        _consume_read(snippet)
+
+        return content
+
+    async def aget_snippet(self, snippet_id: str, key: str | None = None) -> SnippetContent:
+        """Get the snippet like `get_snippet`, without blocking the event loop."""
+
+        snippet = await self._aget_record(snippet_id)
+
+        first_chunk = await _get_chunks(snippet).filter(index=0).afirst() if snippet.chunked else None
+        if not key or snippet.client_encrypted:
+            content = _get_content(snippet, first_chunk)
+            if _is_readable_without_key(snippet):
+                await _aconsume_read(snippet)
+
+            return content
+
+        encrypted_snippet = _get_encrypted_snippet(snippet)
+        encryption_key = await self._aget_encryption_key(snippet_id, key, encrypted_snippet)
+        content = self._get_decrypted_content(snippet, key, encryption_key, encrypted_snippet, first_chunk)
+        await _aconsume_read(snippet)
+
+        return content
+
+    async def aget_cacheable_snippet(self, snippet_id: str) -> tuple[SnippetContent, SnippetVersion | None]:
+        """Get the snippet like `aget_snippet` does without a key, along with its version.
+
+        The version is `None` for the snippets with limited reads, since what's rendered from them
+        can't be cached when every read has to be counted.
+        """
+
+        snippet = await self._aget_record(snippet_id)
+
+        first_chunk = await _get_chunks(snippet).filter(index=0).afirst() if snippet.chunked else None
+        content = _get_content(snippet, first_chunk)
+        if snippet.reads_remaining is not None:
+            if _is_readable_without_key(snippet):
+                await _aconsume_read(snippet)
+
+            return content, None
+
+        if snippet.client_encrypted:
+            return content, SnippetVersion(hashlib.sha256(snippet.snippet.encode()).hexdigest(), snippet.expires_at)
+
+        if content.encrypted:
+            return content, SnippetVersion("", snippet.expires_at)
 
-        return snippet.snippet, snippet.encrypted
+        digest = snippet.body or hashlib.sha256(content.snippet.encode()).hexdigest()
 
-    def add_and_get_shareable_link(self, snippet: str, base_url: str, key: str | None = None) -> str:
+        return content, SnippetVersion(digest, snippet.expires_at)
+
+    def iter_snippet(self, snippet_id: str, key: str | None = None) -> Iterator[bytes]:
+        """Get the whole snippet, decrypted, as UTF-8 encoded parts.
+
+        The chunked snippets are read and decrypted one chunk at a time as the parts are consumed.
+        The key is checked against the first chunk before returning, so a wrong key raises a
+        `DecryptionError` right away while the chunks that were tampered with raise it later on.
+        Counts as a read of the snippet.
+
+        Raises `KeyRequiredError` if the snippet is encrypted and no key is given, or
+        `BrowserEncryptedError` if it was encrypted by the browser.
+        """
+
+        snippet = self._get_record(snippet_id)
+
+        if not snippet.encrypted:
+            _consume_read(snippet)
+            if snippet.chunked:
+                return map(decode, _get_chunks(snippet).iterator(chunk_size=1))
+
+            return iter((snippet.snippet.encode(),))
+
+        if snippet.client_encrypted:
+            raise BrowserEncryptedError
+
+        if not key:
+            raise KeyRequiredError
+
+        encrypted_snippet = _get_encrypted_snippet(snippet)
+        encryption_key = self._get_encryption_key(snippet_id, key, encrypted_snippet)
+
+        if not snippet.chunked:
+            decrypted = self._decrypt(snippet_id, key, encryption_key, encrypted_snippet)
+            _consume_read(snippet)
+
+            return iter((decrypted.encode(),))
+
+        chunks = decrypt_chunks(Fernet(encryption_key), _get_chunks(snippet).iterator(chunk_size=1))
+        if snippet.encoded:
+            chunks = map(decode, chunks)
+        try:
+            first_chunk = next(chunks)
+        except InvalidToken as ex:
+            metrics.inc("decryption_failures_total")
+            raise DecryptionError from ex
+
+        self._derived_key_cache.set(snippet_id, key, encryption_key)
+        _consume_read(snippet)
+
+        return _iter_decrypted_chunks(first_chunk, chunks)
+
+    def add_and_get_shareable_link(
+        self,
+        snippet: str,
+        base_url: str,
+        key: str | None = None,
+        *,
+        expires_at: datetime | None = None,
+        max_reads: int | None = None,
+    ) -> str:
         """Create a shareable link for the given snippet.
 
         If a key is provided, then the snippet is encrypted before saving it.
         """
 
-        snippet_id = self.add_snipppet(snippet, key)
+        snippet_id = self.add_snipppet(snippet, key, expires_at=expires_at, max_reads=max_reads)
+
+        return _build_link(snippet_id, base_url)
+
+    def add_client_encrypted_snippet_and_get_shareable_link(
+        self,
+        snippet: ClientEncryptedSnippet,
+        base_url: str,
+        *,
+        expires_at: datetime | None = None,
+        max_reads: int | None = None,
+    ) -> str:
+        """Create a shareable link for the snippet encrypted by the browser, see `shareme.client`."""
 
-        if base_url.endswith("/"):
-            return f"{base_url}{snippet_id}"
+        snippet_id = self.add_client_encrypted_snippet(snippet, expires_at=expires_at, max_reads=max_reads)
 
-        return f"{base_url}/{snippet_id}"
+        return _build_link(snippet_id, base_url)
 
-    def add_snipppet(self, snippet: str, key: str | None = None) -> str:
+    def add_snipppet(
+        self, snippet: str, key: str | None = None, *, expires_at: datetime | None = None, max_reads: int | None = None
+    ) -> str:
         """Add the snippet to the database.
 
-        If the key is provided, then the snippet will be encrypted.
+        If the key is provided, then the snippet will be encrypted. Otherwise, the content is
+        stored once for all the snippets with the same content, as a `SnippetBody`. Large snippets
+        are stored in chunks. The snippet stops being readable at `expires_at`, or after
+        `max_reads` reads.
 
         Returns
         -------
@@ -93,60 +274,388 @@ class SnippetService:
 
         """
 
-        encrypted_snippet = None
+        salt = None
+        encryption_key = None
         if key:
-            encrypted_snippet = self._encrypt(snippet, key)
-
-        if encrypted_snippet is None:
-            snippet_instance = Snippet(snippet=snippet, encrypted=False, salt=None)
+            salt = os.urandom(self._salt_length)
+            with metrics.timer("kdf_seconds", kdf=self._kdf.name):
+                encryption_key = self._kdf_pool.run(derive_fernet_key, key, salt, self._kdf)
+
+        content = snippet
+        digest = None
+        chunks: list[bytes] = []
+        if encryption_key is None:
+            digest = hashlib.sha256(content.encode()).hexdigest()
+            snippet = ""
+        elif chunks := self._chunking.split(content.encode()):
+            fernet = Fernet(encryption_key)
+            # Compressed before encrypting, since the ciphertext doesn't compress.
+            chunks = [
+                encrypt_chunk(fernet, index, self._codec.encode(chunk), last=index == len(chunks) - 1)
+                for index, chunk in enumerate(chunks)
+            ]
+            snippet = ""
         else:
-            snippet_instance = Snippet(snippet=encrypted_snippet.snippet, salt=encrypted_snippet.salt, encrypted=True)
+            snippet = self._encrypt(snippet, encryption_key, salt, self._kdf).snippet
+
+        snippet_instance = Snippet(
+            data=token_to_bytes(snippet) if snippet else b"",
+            encrypted=encryption_key is not None,
+            chunked=bool(chunks),
+            body_id=digest,
+            expires_at=expires_at,
+            reads_remaining=max_reads,
+        )
+        if salt is not None:
+            snippet_instance.salt = salt
+            snippet_instance.kdf = self._kdf.name
+            snippet_instance.kdf_params = self._kdf.params
+
+        def save() -> SnippetBody | None:
+            body = self._acquire_body(digest, content) if digest is not None else None
+            snippet_instance.save(force_insert=True)
+            SnippetChunk.objects.bulk_create(
+                [SnippetChunk(snippet=snippet_instance, index=index, data=chunk) for index, chunk in enumerate(chunks)],
+                batch_size=self._chunk_batch_size,
+            )
+
+            return body
+
+        snippet_id = self._insert(snippet_instance, save)
+        if key and encryption_key is not None:
+            self._derived_key_cache.set(snippet_id, key, encryption_key)
+
+        return snippet_id
+
+    def add_client_encrypted_snippet(
+        self, snippet: ClientEncryptedSnippet, *, expires_at: datetime | None = None, max_reads: int | None = None
+    ) -> str:
+        """Add the snippet encrypted by the browser as it is, without deriving any key.
+
+        Returns the ID of the created snippet.
+        """
+
+        snippet_instance = Snippet(
+            data=snippet.ciphertext,
+            encrypted=True,
+            encoded=False,
+            client_encrypted=True,
+            salt=snippet.salt,
+            kdf=snippet.kdf.name,
+            kdf_params=snippet.kdf.params,
+            expires_at=expires_at,
+            reads_remaining=max_reads,
+        )
+
+        def save() -> None:
+            snippet_instance.save(force_insert=True)
+
+        return self._insert(snippet_instance, save)
+
+    def warm_cache(self, max_items: int, deadline: float) -> int:
+        """Preload the most recent snippets, and their bodies, into the cache. See `core.warmup`.
+
+        The snippets with limited reads are skipped since they aren't cached anyway. Returns the number
+        of snippets loaded.
+        """
+
+        snippets = (
+            Snippet.objects.filter(
+                Q(expires_at__isnull=True) | Q(expires_at__gt=timezone.now()),
+                created_at__isnull=False,
+                reads_remaining__isnull=True,
+            )
+            .order_by("-created_at")
+            .iterator(chunk_size=self._chunk_batch_size)
+        )
+        loaded = 0
+        for batch in itertools.batched(itertools.islice(snippets, max_items), self._chunk_batch_size):
+            if time.monotonic() >= deadline:
+                break
+
+            for snippet in batch:
+                self._snippet_cache.set(SnippetRecord.from_model(snippet))
+            bodies = SnippetBody.objects.filter(digest__in={snippet.body_id for snippet in batch if snippet.body_id})
+            for body in bodies:
+                self._snippet_cache.set(SnippetRecord.from_body(body))
+            loaded += len(batch)
+
+        return loaded
+
+    def _acquire_body(self, digest: str, content: str) -> SnippetBody | None:
+        """Add a reference to the body with the digest, creating it if it doesn't exist.
+
+        Returns the body if it was created. Has to be called within a transaction, which fails with
+        an `IntegrityError` if someone else creates the same body concurrently.
+        """
+
+        if SnippetBody.objects.filter(digest=digest).update(ref_count=F("ref_count") + 1):
+            metrics.inc("snippet_bodies_total", result="shared")
+            return None
+
+        chunks = self._chunking.split(content.encode())
+        data = b"" if chunks else self._codec.encode(content.encode())
+        body = SnippetBody(digest=digest, data=data, chunked=bool(chunks), ref_count=1)
+        body.save(force_insert=True)
+        SnippetChunk.objects.bulk_create(
+            [
+                SnippetChunk(body=body, index=index, data=self._codec.encode(chunk))
+                for index, chunk in enumerate(chunks)
+            ],
+            batch_size=self._chunk_batch_size,
+        )
+        metrics.inc("snippet_bodies_total", result="created")
+
+        return body
+
+    def _insert(self, snippet_instance: Snippet, save: Callable[[], SnippetBody | None]) -> str:
+        """Save the new snippet under a newly allocated ID, and cache it along with the body it uses.
+
+        Returns the ID of the snippet.
+        """
 
         count = 0
         while count < self._max_retry_count:
-            snippet_instance.snippet_id = _generate_short_id(self._min_length + count)
+            # Only IDs from before the allocator was introduced can collide with the allocated one.
+            snippet_instance.snippet_id = self._id_filter.allocate(self._id_allocator)
             try:
-                snippet_instance.save(force_insert=True)
-                self._snippet_cache.set(snippet_instance.snippet_id, snippet_instance)
+                body = group_commit.run(save)
+                self._snippet_cache.set(SnippetRecord.from_model(snippet_instance))
+                if body is not None:
+                    self._snippet_cache.set(SnippetRecord.from_body(body))
 
                 return snippet_instance.snippet_id
             except IntegrityError:
+                metrics.inc("id_collisions_total", allocator="snippet")
                 count += 1
 
                 continue
 
         raise SnippetCreationError("max tries to add snippet exceeded")
 
-    def _encrypt(self, content: str, key: str) -> EncryptedSnippet:
-        salt = os.urandom(self._salt_length)
-        encryption_key = self._generate_key(key, salt)
+    def _get_record(self, snippet_id: str) -> SnippetRecord:
+        if self._id_filter.is_unknown(snippet_id):
+            raise SnippetNotFoundError
+
+        if (snippet := self._snippet_cache.get(snippet_id)) is None:
+            try:
+                snippet = SnippetRecord.from_model(Snippet.objects.get(snippet_id=snippet_id))
+            except Snippet.DoesNotExist as ex:
+                raise SnippetNotFoundError from ex
+
+            self._snippet_cache.set(snippet)
+
+        # Refused without writing anything, the row is deleted later on by the sweeper.
+        if is_expired(snippet.expires_at) or snippet.reads_remaining == 0:
+            raise SnippetNotFoundError
+
+        return self._resolve_body(snippet) if snippet.body else snippet
+
+    async def _aget_record(self, snippet_id: str) -> SnippetRecord:
+        if self._id_filter.is_unknown(snippet_id):
+            raise SnippetNotFoundError
+
+        if (snippet := await self._snippet_cache.aget(snippet_id)) is None:
+            try:
+                snippet = SnippetRecord.from_model(await Snippet.objects.aget(snippet_id=snippet_id))
+            except Snippet.DoesNotExist as ex:
+                raise SnippetNotFoundError from ex
+
+            await self._snippet_cache.aset(snippet)
+
+        if is_expired(snippet.expires_at) or snippet.reads_remaining == 0:
+            raise SnippetNotFoundError
+
+        return await self._aresolve_body(snippet) if snippet.body else snippet
+
+    def _resolve_body(self, snippet: SnippetRecord) -> SnippetRecord:
+        """Fill in the content of a snippet from its shared body."""
+
+        assert snippet.body is not None
+
+        if (body := self._snippet_cache.get(SnippetRecord.get_body_id(snippet.body))) is None:
+            try:
+                body = SnippetRecord.from_body(SnippetBody.objects.get(digest=snippet.body))
+            except SnippetBody.DoesNotExist as ex:
+                raise SnippetNotFoundError from ex
+
+            self._snippet_cache.set(body)
+
+        return replace(snippet, snippet=body.snippet, chunked=body.chunked)
+
+    async def _aresolve_body(self, snippet: SnippetRecord) -> SnippetRecord:
+        assert snippet.body is not None
+
+        if (body := await self._snippet_cache.aget(SnippetRecord.get_body_id(snippet.body))) is None:
+            try:
+                body = SnippetRecord.from_body(await SnippetBody.objects.aget(digest=snippet.body))
+            except SnippetBody.DoesNotExist as ex:
+                raise SnippetNotFoundError from ex
+
+            await self._snippet_cache.aset(body)
+
+        return replace(snippet, snippet=body.snippet, chunked=body.chunked)
+
+    def _get_encryption_key(self, snippet_id: str, key: str, encrypted_snippet: EncryptedSnippet) -> bytes:
+        if (encryption_key := self._derived_key_cache.get(snippet_id, key)) is not None:
+            metrics.inc("cache_requests_total", cache="derived-keys", result="local_hit")
+            return encryption_key
+
+        metrics.inc("cache_requests_total", cache="derived-keys", result="miss")
+        with metrics.timer("kdf_seconds", kdf=encrypted_snippet.kdf.name):
+            return self._kdf_pool.run(derive_fernet_key, key, encrypted_snippet.salt, encrypted_snippet.kdf)
+
+    async def _aget_encryption_key(self, snippet_id: str, key: str, encrypted_snippet: EncryptedSnippet) -> bytes:
+        if (encryption_key := self._derived_key_cache.get(snippet_id, key)) is not None:
+            metrics.inc("cache_requests_total", cache="derived-keys", result="local_hit")
+            return encryption_key
+
+        metrics.inc("cache_requests_total", cache="derived-keys", result="miss")
+        with metrics.timer("kdf_seconds", kdf=encrypted_snippet.kdf.name):
+            return await self._kdf_pool.arun(derive_fernet_key, key, encrypted_snippet.salt, encrypted_snippet.kdf)
 
+    def _encrypt(self, content: str, encryption_key: bytes, salt: bytes, kdf: KdfSpec) -> EncryptedSnippet:
         fernet = Fernet(encryption_key)
-        encrypted = fernet.encrypt(content.encode())
+        encrypted = fernet.encrypt(self._codec.encode(content.encode()))
 
-        return EncryptedSnippet(encrypted.decode(), salt)
+        return EncryptedSnippet(encrypted.decode(), salt, kdf)
 
-    def _decrypt(self, key: str, encrypted_snippet: EncryptedSnippet) -> str:
-        encryption_key = self._generate_key(key, encrypted_snippet.salt)
+    def _get_decrypted_content(
+        self,
+        snippet: SnippetRecord,
+        key: str,
+        encryption_key: bytes,
+        encrypted_snippet: EncryptedSnippet,
+        first_chunk: bytes | None,
+    ) -> SnippetContent:
+        if not snippet.chunked:
+            decrypted = self._decrypt(snippet.snippet_id, key, encryption_key, encrypted_snippet)
 
+            return SnippetContent(decrypted, encrypted=False)
+
+        try:
+            chunk, last = decrypt_chunk(Fernet(encryption_key), 0, first_chunk or b"")
+        except InvalidToken as ex:
+            metrics.inc("decryption_failures_total")
+            raise DecryptionError from ex
+
+        self._derived_key_cache.set(snippet.snippet_id, key, encryption_key)
+        if encrypted_snippet.encoded:
+            chunk = decode(chunk)
+
+        return SnippetContent(chunk.decode(errors="ignore"), encrypted=False, truncated=not last)
+
+    def _decrypt(self, snippet_id: str, key: str, encryption_key: bytes, encrypted_snippet: EncryptedSnippet) -> str:
         fernet = Fernet(encryption_key)
-        decrypted = fernet.decrypt(encrypted_snippet.snippet.encode())
+        try:
+            decrypted = fernet.decrypt(encrypted_snippet.snippet.encode())
+        except InvalidToken as ex:
+            metrics.inc("decryption_failures_total")
+            raise DecryptionError from ex
 
-        return decrypted.decode()
+        # Only keys that worked are cached, so guessing keys always costs a full key derivation.
+        self._derived_key_cache.set(snippet_id, key, encryption_key)
 
-    def _generate_key(self, key: str, salt: bytes) -> bytes:
-        kdf = PBKDF2HMAC(
-            algorithm=hashes.SHA256(),
-            length=32,
-            salt=salt,
-            iterations=480000,
-        )
-        derived_key = kdf.derive(key.encode())
+        return (decode(decrypted) if encrypted_snippet.encoded else decrypted).decode()
+
+
+def get_expired_snippets() -> QuerySet[Snippet]:
+    return Snippet.objects.filter(expires_at__lte=timezone.now())
+
+
+def get_burned_snippets() -> QuerySet[Snippet]:
+    """Get the snippets that ran out of reads."""
+
+    return Snippet.objects.filter(reads_remaining=0)
+
+
+def get_unreferenced_bodies() -> QuerySet[SnippetBody]:
+    return SnippetBody.objects.filter(ref_count=0)
+
+
+def release_body(sender: Any, instance: Snippet, **kwargs: Any) -> None:  # noqa: ANN401, ARG001
+    """Drop the reference of the deleted snippet to its body. Connected to `post_delete` of `Snippet`."""
+
+    if instance.body_id is not None:
+        SnippetBody.objects.filter(digest=instance.body_id).update(ref_count=F("ref_count") - 1)
+
+
+def _consume_read(snippet: SnippetRecord) -> None:
+    if snippet.reads_remaining is not None and not _get_unread(snippet).update(
+        reads_remaining=F("reads_remaining") - 1
+    ):
+        # Someone else read it in the meantime.
+        raise SnippetNotFoundError
+
+
+async def _aconsume_read(snippet: SnippetRecord) -> None:
+    if snippet.reads_remaining is not None and not await _get_unread(snippet).aupdate(
+        reads_remaining=F("reads_remaining") - 1
+    ):
+        raise SnippetNotFoundError
+
+
+def _get_unread(snippet: SnippetRecord) -> QuerySet[Snippet]:
+    # Decrementing only the rows with reads left means the concurrent reads can't go over the limit.
+    return Snippet.objects.filter(snippet_id=snippet.snippet_id, reads_remaining__gt=0)
+
+
+def _get_encrypted_snippet(snippet: SnippetRecord) -> EncryptedSnippet:
+    if snippet.salt is None:
+        raise ValueError("snippet does not have a salt")
+
+    return EncryptedSnippet(
+        snippet=snippet.snippet, salt=snippet.salt, kdf=snippet.kdf or KdfSpec.legacy(), encoded=snippet.encoded
+    )
+
+
+def _build_link(snippet_id: str, base_url: str) -> str:
+    if base_url.endswith("/"):
+        return f"{base_url}{snippet_id}"
+
+    return f"{base_url}/{snippet_id}"
+
+
+def _is_readable_without_key(snippet: SnippetRecord) -> bool:
+    """Whether the snippet is served without a key, which then counts as a read of it.
+
+    Besides the unencrypted snippets, those are the ones encrypted by the browser, which are served for
+    the browser to decrypt.
+    """
+
+    return not snippet.encrypted or snippet.client_encrypted
+
+
+def _get_content(snippet: SnippetRecord, first_chunk: bytes | None) -> SnippetContent:
+    if snippet.client_encrypted:
+        return SnippetContent("", encrypted=True, ciphertext=ClientCiphertext.from_record(snippet))
+
+    if not snippet.chunked:
+        return SnippetContent(snippet.snippet, snippet.encrypted)
+
+    if snippet.encrypted:
+        return SnippetContent("", encrypted=True, truncated=True)
+
+    # The chunk may end in the middle of a character.
+    content = decode(first_chunk).decode(errors="ignore") if first_chunk else ""
+
+    return SnippetContent(content, encrypted=False, truncated=True)
+
+
+def _get_chunks(snippet: SnippetRecord) -> QuerySet:
+    if snippet.body is not None:
+        chunks = SnippetChunk.objects.filter(body_id=snippet.body)
+    else:
+        chunks = SnippetChunk.objects.filter(snippet_id=snippet.snippet_id)
 
-        return base64.urlsafe_b64encode(derived_key)
+    return chunks.order_by("index").values_list("data", flat=True)
 
 
-def _generate_short_id(length: int) -> str:
-    letters = [secrets.choice(string.ascii_letters) for _ in range(length)]
+def _iter_decrypted_chunks(first_chunk: bytes, chunks: Iterator[bytes]) -> Iterator[bytes]:
+    yield first_chunk
 
-    return "".join(letters)
+    try:
+        yield from chunks
+    except InvalidToken as ex:
+        metrics.inc("decryption_failures_total")
+        raise DecryptionError from ex
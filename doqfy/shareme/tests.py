@@ -1,3 +1,458 @@
-from django.test import TestCase
+import base64
+import os
+import re
+import threading
+import time
+from datetime import timedelta
+from http import HTTPStatus
+from unittest.mock import patch
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from core.expiry import sweeper
+from cryptography.fernet import Fernet
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.test import SimpleTestCase, TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from . import views
+from .cache import SnippetCache, SnippetRecord
+from .chunks import Chunking
+from .client import ClientEncryption, InvalidCiphertextError
+from .codec import Codec, decode, token_to_bytes
+from .kdf import KdfSpec, KeyDerivationBusyError, KeyDerivationPool, derive_fernet_key
+from .models import Snippet, SnippetBody, SnippetChunk
+from .services import DecryptionError, KeyRequiredError, SnippetNotFoundError, SnippetService
+
+
+class SnippetServiceTest(TestCase):
+    def setUp(self) -> None:
+        caches["snippets"].clear()
+        SnippetService._derived_key_cache.clear()  # noqa: SLF001
+
+    def test_get_snippet(self) -> None:
+        snippet_id = SnippetService().add_snipppet("hello")
+        caches["snippets"].clear()
+
+        assert SnippetService().get_snippet(snippet_id) == ("hello", False, False, None)
+        with self.assertNumQueries(0):
+            assert SnippetService().get_snippet(snippet_id) == ("hello", False, False, None)
+
+    def test_get_snippet_decrypts_with_the_key(self) -> None:
+        snippet_id = SnippetService().add_snipppet("secret", key="key")
+
+        assert SnippetService().get_snippet(snippet_id)[1]
+        assert SnippetService().get_snippet(snippet_id, key="key") == ("secret", False, False, None)
+        with self.assertRaisesMessage(DecryptionError, ""):
+            SnippetService().get_snippet(snippet_id, key="wrong")
+
+    def test_get_snippet_caches_only_the_working_keys(self) -> None:
+        snippet_id = SnippetService().add_snipppet("secret", key="key")
+        derived_key_cache = SnippetService._derived_key_cache  # noqa: SLF001
+        derived_key_cache.clear()
+
+        SnippetService().get_snippet(snippet_id, key="key")
+        with self.assertRaisesMessage(DecryptionError, ""):
+            SnippetService().get_snippet(snippet_id, key="wrong")
+
+        assert derived_key_cache.get(snippet_id, "key") is not None
+        assert derived_key_cache.get(snippet_id, "wrong") is None
+
+    async def test_aget_snippet(self) -> None:
+        snippet_id = await sync_to_async(SnippetService().add_snipppet)("hello")
+        await caches["snippets"].aclear()
+
+        assert await SnippetService().aget_snippet(snippet_id) == ("hello", False, False, None)
+        with self.assertRaisesMessage(SnippetNotFoundError, ""):
+            await SnippetService().aget_snippet("unknown")
+
+    def test_get_snippet_uses_the_kdf_of_the_snippet(self) -> None:
+        scrypt = KdfSpec("scrypt", {"n": 2**10, "r": 8, "p": 1})
+        with patch.object(SnippetService, "_kdf", scrypt):
+            snippet_id = SnippetService().add_snipppet("secret", key="key")
+        SnippetService._derived_key_cache.clear()  # noqa: SLF001
+        caches["snippets"].clear()
+
+        snippet = Snippet.objects.get(snippet_id=snippet_id)
+        assert (snippet.kdf, snippet.kdf_params) == ("scrypt", scrypt.params)
+        assert SnippetService().get_snippet(snippet_id, key="key") == ("secret", False, False, None)
+
+    def test_get_snippet_decrypts_snippets_without_a_kdf(self) -> None:
+        salt = b"0" * 16
+        encryption_key = derive_fernet_key("key", salt, KdfSpec.legacy())
+        token = Fernet(encryption_key).encrypt(b"secret")
+        Snippet.objects.create(
+            snippet_id="legacy", data=token_to_bytes(token), encoded=False, encrypted=True, salt=salt
+        )
+
+        assert SnippetService().get_snippet("legacy", key="key") == ("secret", False, False, None)
+
+    def test_large_snippets_are_compressed(self) -> None:
+        content = "hello, world\n" * 1000
+        snippet_id = SnippetService().add_snipppet(content)
+        encrypted = SnippetService().add_snipppet(content, key="key")
+        caches["snippets"].clear()
+
+        assert len(SnippetBody.objects.get().data) < len(content) // 10
+        assert len(Snippet.objects.get(snippet_id=encrypted).data) < len(content) // 10
+        assert SnippetService().get_snippet(snippet_id) == (content, False, False, None)
+        assert SnippetService().get_snippet(encrypted, key="key") == (content, False, False, None)
+
+
+class SnippetExpiryTest(TestCase):
+    def setUp(self) -> None:
+        caches["snippets"].clear()
+
+    def test_expired_snippets_are_refused(self) -> None:
+        snippet_id = SnippetService().add_snipppet("hello", expires_at=timezone.now() - timedelta(seconds=1))
+
+        with self.assertNumQueries(0), self.assertRaisesMessage(SnippetNotFoundError, ""):
+            SnippetService().get_snippet(snippet_id)
+
+        caches["snippets"].clear()
+        with self.assertRaisesMessage(SnippetNotFoundError, ""):
+            SnippetService().get_snippet(snippet_id)
+
+    def test_snippets_burn_after_their_reads(self) -> None:
+        snippet_id = SnippetService().add_snipppet("secret", key="key", max_reads=2)
+
+        # Reading it still encrypted doesn't count.
+        assert SnippetService().get_snippet(snippet_id).encrypted
+        assert SnippetService().get_snippet(snippet_id, key="key").snippet == "secret"
+        assert b"".join(SnippetService().iter_snippet(snippet_id, key="key")) == b"secret"
+        with self.assertRaisesMessage(SnippetNotFoundError, ""):
+            SnippetService().get_snippet(snippet_id, key="key")
+
+        assert Snippet.objects.get(snippet_id=snippet_id).reads_remaining == 0
+
+
+class SnippetCacheWarmUpTest(TestCase):
+    def setUp(self) -> None:
+        caches["snippets"].clear()
+
+    def test_warm_cache_loads_the_most_recent_snippets(self) -> None:
+        old = SnippetService().add_snipppet("old")
+        recent = SnippetService().add_snipppet("recent")
+        limited = SnippetService().add_snipppet("limited", max_reads=1)
+        Snippet.objects.filter(snippet_id=old).update(created_at=timezone.now() - timedelta(days=1))
+        caches["snippets"].clear()
+
+        assert SnippetService().warm_cache(1, time.monotonic() + 10) == 1
+
+        with self.assertNumQueries(0):
+            assert SnippetService().get_snippet(recent) == ("recent", False, False, None)
+        with self.assertNumQueries(2):
+            # The snippet, then its body.
+            SnippetService().get_snippet(old)
+        assert SnippetService().get_snippet(limited) == ("limited", False, False, None)
+
+
+class SnippetBodyTest(TestCase):
+    def setUp(self) -> None:
+        caches["snippets"].clear()
+
+    def test_identical_snippets_share_their_body(self) -> None:
+        first = SnippetService().add_snipppet("hello")
+        second = SnippetService().add_snipppet("hello")
+        encrypted = SnippetService().add_snipppet("hello", key="key")
+
+        assert first != second
+        assert list(SnippetBody.objects.values_list("ref_count", flat=True)) == [2]
+        assert Snippet.objects.get(snippet_id=encrypted).body is None
+        caches["snippets"].clear()
+        assert SnippetService().get_snippet(second) == ("hello", False, False, None)
+        with self.assertNumQueries(1):
+            # Only the snippet itself, the body is cached.
+            assert SnippetService().get_snippet(first) == ("hello", False, False, None)
+
+    def test_unreferenced_bodies_are_swept(self) -> None:
+        first = SnippetService().add_snipppet("hello")
+        SnippetService().add_snipppet("hello")
+        Snippet.objects.filter(snippet_id=first).delete()
+
+        assert SnippetBody.objects.get().ref_count == 1
+
+        Snippet.objects.all().delete()
+        sweeper.sweep()
+
+        assert not SnippetBody.objects.exists()
+
+
+@patch.object(SnippetService, "_chunking", Chunking(threshold=10, chunk_size=4))
+class ChunkedSnippetTest(TestCase):
+    def setUp(self) -> None:
+        caches["snippets"].clear()
+        SnippetService._derived_key_cache.clear()  # noqa: SLF001
+
+    def test_large_snippets_are_chunked(self) -> None:
+        snippet_id = SnippetService().add_snipppet("hello, world")
+
+        chunks = SnippetChunk.objects.filter(body__snippets=snippet_id).order_by("index")
+        assert list(chunks.values_list("index", flat=True)) == [0, 1, 2]
+        assert SnippetService().get_snippet(snippet_id) == ("hell", False, True, None)
+        assert b"".join(SnippetService().iter_snippet(snippet_id)) == b"hello, world"
+
+    def test_small_snippets_are_not_chunked(self) -> None:
+        snippet_id = SnippetService().add_snipppet("hello")
+
+        assert not SnippetChunk.objects.filter(body__snippets=snippet_id).exists()
+        assert b"".join(SnippetService().iter_snippet(snippet_id)) == b"hello"
+
+    def test_encrypted_chunks(self) -> None:
+        snippet_id = SnippetService().add_snipppet("hello, world", key="key")
+
+        assert SnippetService().get_snippet(snippet_id) == ("", True, True, None)
+        assert SnippetService().get_snippet(snippet_id, key="key") == ("hell", False, True, None)
+        assert b"".join(SnippetService().iter_snippet(snippet_id, key="key")) == b"hello, world"
+        with self.assertRaisesMessage(KeyRequiredError, ""):
+            SnippetService().iter_snippet(snippet_id)
+        with self.assertRaisesMessage(DecryptionError, ""):
+            SnippetService().iter_snippet(snippet_id, key="wrong")
+
+    def test_missing_or_reordered_chunks_are_detected(self) -> None:
+        snippet_id = SnippetService().add_snipppet("hello, world", key="key")
+        chunks = SnippetChunk.objects.filter(snippet_id=snippet_id)
+
+        chunks.filter(index=2).delete()
+        with self.assertRaisesMessage(DecryptionError, ""):
+            b"".join(SnippetService().iter_snippet(snippet_id, key="key"))
+
+        first, second = chunks.order_by("index")
+        first.data, second.data = second.data, first.data
+        SnippetChunk.objects.bulk_update([first, second], ["data"])
+        with self.assertRaisesMessage(DecryptionError, ""):
+            SnippetService().iter_snippet(snippet_id, key="key")
+
+    def test_raw_and_download_views_stream_the_snippet(self) -> None:
+        snippet_id = SnippetService().add_snipppet("hello, world")
+
+        response = self.client.get(reverse("shareme:raw", kwargs={"snippet_id": snippet_id}))
+        assert response.streaming
+        assert b"".join(response.streaming_content) == b"hello, world"
+
+        response = self.client.get(reverse("shareme:download", kwargs={"snippet_id": snippet_id}))
+        assert response["Content-Disposition"] == f'attachment; filename="{snippet_id}.txt"'
+
+    def test_snippets_with_an_unknown_kdf_cannot_be_decrypted(self) -> None:
+        snippet_id = SnippetService().add_snipppet("secret", key="key")
+        Snippet.objects.filter(snippet_id=snippet_id).update(kdf="argon2")
+        SnippetService._derived_key_cache.clear()  # noqa: SLF001
+        caches["snippets"].clear()
+
+        page = self.client.post(reverse("shareme:snippet", kwargs={"snippet_id": snippet_id}), {"key": "key"})
+        raw = self.client.post(reverse("shareme:raw", kwargs={"snippet_id": snippet_id}), {"key": "key"})
+
+        assert b"Invalid encryption key." in page.content
+        assert b"Invalid encryption key." in raw.content
+
+    def test_raw_view_asks_for_the_key_of_encrypted_snippets(self) -> None:
+        snippet_id = SnippetService().add_snipppet("secret", key="secret-key")
+        url = reverse("shareme:raw", kwargs={"snippet_id": snippet_id})
+
+        page = self.client.post(reverse("shareme:snippet", kwargs={"snippet_id": snippet_id}), {"key": "secret-key"})
+        form = self.client.get(url)
+        response = self.client.post(url, {"key": "secret-key"})
+
+        assert b"secret-key" not in page.content
+        assert f'action="{url}"'.encode() in form.content
+        assert b"".join(response.streaming_content) == b"secret"
+
+
+class SnippetPageTest(TestCase):
+    def setUp(self) -> None:
+        caches["snippets"].clear()
+        caches["pages"].clear()
+
+    def test_pages_are_cached_and_revalidated(self) -> None:
+        snippet_id = SnippetService().add_snipppet("hello")
+        url = reverse("shareme:snippet", kwargs={"snippet_id": snippet_id})
+
+        response = self.client.get(url)
+        assert response.status_code == HTTPStatus.OK
+        assert b"hello" in response.content
+        etag = response["ETag"]
+
+        with self.assertNumQueries(0):
+            assert self.client.get(url).content == response.content
+            response = self.client.get(url, headers={"If-None-Match": etag})
+        assert response.status_code == HTTPStatus.NOT_MODIFIED
+
+    def test_locked_pages_get_the_csrf_token(self) -> None:
+        snippet_id = SnippetService().add_snipppet("hello", key="key")
+        url = reverse("shareme:snippet", kwargs={"snippet_id": snippet_id})
+
+        response = self.client.get(url)
+        assert b"csrfmiddlewaretoken" in response.content
+        assert b"csrf-token-placeholder" not in response.content
+        etag = response["ETag"]
+
+        with self.assertNumQueries(0):
+            assert self.client.get(url, headers={"If-None-Match": etag}).status_code == HTTPStatus.NOT_MODIFIED
+        self.client.cookies.clear()
+        assert self.client.get(url, headers={"If-None-Match": etag}).status_code == HTTPStatus.OK
+
+    def test_pages_of_snippets_with_limited_reads_are_not_cached(self) -> None:
+        snippet_id = SnippetService().add_snipppet("hello", max_reads=1)
+        url = reverse("shareme:snippet", kwargs={"snippet_id": snippet_id})
+
+        response = self.client.get(url)
+        assert b"hello" in response.content
+        assert not response.has_header("ETag")
+        assert b"hello" not in self.client.get(url).content
+
+
+class ClientEncryptionTest(TestCase):
+    def setUp(self) -> None:
+        caches["snippets"].clear()
+        caches["pages"].clear()
+        client_encryption = ClientEncryption(iterations=1000)
+        patcher = patch.object(views, "_client_encryption", client_encryption)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_snippets_are_stored_and_served_without_deriving_keys(self) -> None:
+        with (
+            patch.object(SnippetService._kdf_pool, "run") as run,  # noqa: SLF001
+            patch.object(SnippetService._kdf_pool, "arun") as arun,  # noqa: SLF001
+        ):
+            response = self.client.post(reverse("shareme:index"), _encrypt_like_the_browser("secret", "key"))
+            snippet = Snippet.objects.get()
+            page = self.client.get(reverse("shareme:snippet", kwargs={"snippet_id": snippet.snippet_id}))
+            posted = self.client.post(
+                reverse("shareme:snippet", kwargs={"snippet_id": snippet.snippet_id}), {"key": "key"}
+            )
+
+        assert response.status_code == HTTPStatus.FOUND
+        assert snippet.client_encrypted
+        assert b"secret" not in bytes(snippet.data)
+        assert _decrypt_like_the_browser(page.content.decode(), "key") == "secret"
+        assert _decrypt_like_the_browser(posted.content.decode(), "key") == "secret"
+        assert not run.called
+        assert not arun.called
+
+    def test_every_view_counts_as_a_read(self) -> None:
+        snippet = views._client_encryption.parse(**_encrypt_like_the_browser("secret", "key"))  # noqa: SLF001
+        snippet_id = SnippetService().add_client_encrypted_snippet(snippet, max_reads=1)
+        url = reverse("shareme:snippet", kwargs={"snippet_id": snippet_id})
+
+        assert _decrypt_like_the_browser(self.client.get(url).content.decode(), "key") == "secret"
+        assert b"data-ciphertext" not in self.client.get(url).content
+
+    def test_raw_view_redirects_to_the_page(self) -> None:
+        snippet = views._client_encryption.parse(**_encrypt_like_the_browser("secret", "key"))  # noqa: SLF001
+        snippet_id = SnippetService().add_client_encrypted_snippet(snippet)
+
+        response = self.client.post(reverse("shareme:raw", kwargs={"snippet_id": snippet_id}), {"key": "key"})
+
+        assert response.status_code == HTTPStatus.FOUND
+        assert response["Location"] == reverse("shareme:snippet", kwargs={"snippet_id": snippet_id})
+
+    def test_parse_refuses_what_the_browser_did_not_encrypt_as_expected(self) -> None:
+        client_encryption = ClientEncryption(iterations=1000, max_size=100)
+        fields = _encrypt_like_the_browser("secret", "key")
+
+        for invalid, message in (
+            ({"iterations": "999"}, "999 iterations are out of bounds"),
+            ({"iterations": "many"}, "malformed ciphertext, salt or iterations"),
+            ({"salt": base64.b64encode(b"short").decode()}, "the ciphertext or the salt is too short"),
+            ({"ciphertext": "not base64!"}, "malformed ciphertext, salt or iterations"),
+            ({"ciphertext": base64.b64encode(os.urandom(101)).decode()}, "the ciphertext is too large"),
+        ):
+            with self.assertRaisesMessage(InvalidCiphertextError, message):
+                client_encryption.parse(**{**fields, **invalid})
+
+        with self.assertRaisesMessage(InvalidCiphertextError, "encrypting in the browser is disabled"):
+            ClientEncryption(enabled=False).parse(**fields)
+
+
+def _encrypt_like_the_browser(content: str, key: str, iterations: int = 1000) -> dict[str, str]:
+    """Encrypt the content as the page does with WebCrypto, see `client-encryption.html`."""
+
+    salt = os.urandom(16)
+    iv = os.urandom(12)
+    aes_key = PBKDF2HMAC(algorithm=hashes.SHA256(), length=32, salt=salt, iterations=iterations).derive(key.encode())
+    ciphertext = iv + AESGCM(aes_key).encrypt(iv, content.encode(), None)
+
+    return {
+        "ciphertext": base64.b64encode(ciphertext).decode(),
+        "salt": base64.b64encode(salt).decode(),
+        "iterations": str(iterations),
+    }
+
+
+def _decrypt_like_the_browser(page: str, key: str) -> str:
+    form = re.search(r'data-ciphertext="([^"]+)" data-salt="([^"]+)" data-iterations="(\d+)"', page)
+    assert form is not None
+    data = base64.b64decode(form[1])
+    aes_key = PBKDF2HMAC(
+        algorithm=hashes.SHA256(), length=32, salt=base64.b64decode(form[2]), iterations=int(form[3])
+    ).derive(key.encode())
+
+    return AESGCM(aes_key).decrypt(data[:12], data[12:], None).decode()
+
+
+class KeyDerivationPoolTest(SimpleTestCase):
+    def test_run_rejects_when_full(self) -> None:
+        pool = KeyDerivationPool(max_workers=1, max_queued=1, queue_timeout=0.1)
+        release = threading.Event()
+        running = [pool._submit(release.wait, (), 0) for _ in range(2)]  # noqa: SLF001
+
+        with self.assertRaisesMessage(KeyDerivationBusyError, ""):
+            pool.run(str.upper, "key")
+
+        release.set()
+        for future in running:
+            future.result()
+
+        assert pool.run(str.upper, "key") == "KEY"
+
+
+class CodecTest(SimpleTestCase):
+    def test_round_trip(self) -> None:
+        codec = Codec(compress_threshold=10)
+
+        for content in (b"", b"hello", b"hello" * 100, os.urandom(100)):
+            assert decode(codec.encode(content)) == content
+
+    def test_only_compresses_above_the_threshold(self) -> None:
+        codec = Codec(compress_threshold=100)
+
+        assert codec.encode(b"hello" * 10) == b"\x00" + b"hello" * 10
+        assert len(codec.encode(b"hello" * 100)) < len(b"hello" * 100)
+        # Incompressible content is kept as it is.
+        incompressible = os.urandom(200)
+        assert codec.encode(incompressible) == b"\x00" + incompressible
+
+
+class SnippetRecordTest(SimpleTestCase):
+    def test_round_trip(self) -> None:
+        record = SnippetRecord(
+            "abcdefghij",
+            "token" * 1000,
+            encrypted=True,
+            encoded=False,
+            salt=b"0" * 16,
+            kdf=KdfSpec("scrypt", {"n": 2}),
+        )
+
+        data = record.to_bytes(compress_threshold=1024)
+
+        assert len(data) < len(record.snippet)
+        assert SnippetRecord.from_bytes(data) == record
+
+
+class SnippetCacheTest(SimpleTestCase):
+    def setUp(self) -> None:
+        self.cache = SnippetCache(LocMemCache("snippet-cache-test", {}), max_entry_size=100, compress_threshold=50)
+        self.cache.clear()
+
+    def test_set_skips_large_records(self) -> None:
+        assert self.cache.set(SnippetRecord("small", "hello"))
+        assert not self.cache.set(SnippetRecord("large", os.urandom(100).hex()))
+
+        assert self.cache.get("small") == SnippetRecord("small", "hello")
+        assert self.cache.get("large") is None
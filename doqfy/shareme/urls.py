@@ -3,4 +3,9 @@ from django.urls import path
 from . import views
 
 app_name = "shorten"
-urlpatterns = [path("", views.index, name="index"), path("<str:snippet_id>/", views.get_snippet, name="snippet"),]
+urlpatterns = [
+    path("", views.index, name="index"),
+    path("<str:snippet_id>/", views.get_snippet, name="snippet"),
+    path("<str:snippet_id>/raw/", views.get_raw_snippet, name="raw"),
+    path("<str:snippet_id>/download/", views.download_snippet, name="download"),
+]
@@ -1,65 +1,259 @@
-from typing import Any
+import hashlib
+from typing import Any, Final
 
+from core.expiry import EXPIRY_CHOICES, get_expires_at, is_expired
+from core.shortcuts import render, render_to_string
+from django.core.cache import caches
 from django.http import HttpRequest, QueryDict
-from django.http.response import HttpResponse, HttpResponseRedirect
-from django.shortcuts import render
+from django.http.response import (
+    HttpResponse,
+    HttpResponseBase,
+    HttpResponseNotModified,
+    HttpResponseRedirect,
+    StreamingHttpResponse,
+)
+from django.middleware.csrf import get_token
 from django.urls import reverse
+from django.utils.http import parse_etags
 
-from .services import DecryptionError, SnippetCreationError, SnippetNotFoundError, SnippetService
+from .cache import CachedPage, PageCache
+from .client import ClientEncryption, InvalidCiphertextError
+from .kdf import KeyDerivationBusyError, UnknownKdfError
+from .services import (
+    BrowserEncryptedError,
+    DecryptionError,
+    KeyRequiredError,
+    SnippetCreationError,
+    SnippetNotFoundError,
+    SnippetService,
+    SnippetVersion,
+)
+
+_BUSY_ERROR_MESSAGE: Final[str] = "The server is busy right now. Please try again in a few seconds."
+
+_CSRF_PLACEHOLDER: Final[str] = "csrf-token-placeholder"
+"""Rendered in place of the CSRF token of the cached pages, which is different for every visitor."""
+
+_page_cache: Final[PageCache] = PageCache.from_settings(caches["pages"])
+
+_client_encryption: Final[ClientEncryption] = ClientEncryption.from_settings()
 
 
 def index(request: HttpRequest) -> HttpResponse:
     if request.method == "POST":
         return create_shareable_link(request)
 
-    context: dict[str, str] = {}
+    context: dict[str, Any] = {"expiry_choices": EXPIRY_CHOICES, "client_encryption": _client_encryption}
     if link := request.GET.get("link"):
         context["link"] = link
 
     return render(request, "index.html", context)
 
 
-def get_snippet(request: HttpRequest, snippet_id: str) -> HttpResponse:
+async def get_snippet(request: HttpRequest, snippet_id: str) -> HttpResponse:
+    """Show the snippet, or the form asking for its key if it's encrypted.
+
+    The pages shown without a key are cached once rendered (see `PageCache`) and served with an
+    `ETag`, so the browsers revalidating them get a 304 from the cache alone.
+    """
+
     key = None
     if request.method == "POST":
         # Encryption key.
         key = request.POST.get("key", None)
+    elif (page := await _page_cache.aget(snippet_id)) is not None and not is_expired(page.expires_at):
+        return _get_page_response(request, snippet_id, page)
 
     share_service = SnippetService()
     try:
-        snippet, encrypted = share_service.get_snippet(snippet_id, key)
-        context = {"snippet": snippet, "encrypted": encrypted, "snippet_id": snippet_id}
+        if request.method == "POST":
+            content = await share_service.aget_snippet(snippet_id, key)
+            version = None
+        else:
+            content, version = await share_service.aget_cacheable_snippet(snippet_id)
+        context = {
+            "snippet": content.snippet,
+            "encrypted": content.encrypted,
+            "truncated": content.truncated,
+            # Decrypted by the browser, see `shareme.client`.
+            "ciphertext": content.ciphertext,
+            "snippet_id": snippet_id,
+        }
+        if version is not None:
+            return await _render_cached_page(request, snippet_id, context, version)
 
         return render(request, "snippet.html", context)
     except SnippetNotFoundError:
         return render(request, "not-found.html")
-    except DecryptionError:
+    except (DecryptionError, UnknownKdfError):
         context = {"encrypted": True, "snippet_id": snippet_id, "error_message": "Invalid encryption key."}
 
         return render(request, "snippet.html", context)
+    except KeyDerivationBusyError:
+        context = {"encrypted": True, "snippet_id": snippet_id, "error_message": _BUSY_ERROR_MESSAGE}
+
+        return _service_unavailable(render(request, "snippet.html", context, status=503))
+
+
+def get_raw_snippet(request: HttpRequest, snippet_id: str) -> HttpResponseBase:
+    return _stream_snippet(request, snippet_id, as_attachment=False)
+
+
+def download_snippet(request: HttpRequest, snippet_id: str) -> HttpResponseBase:
+    return _stream_snippet(request, snippet_id, as_attachment=True)
 
 
 def create_shareable_link(request: HttpRequest) -> HttpResponse:
-    context: dict[str, str] = {}
+    context: dict[str, Any] = {"expiry_choices": EXPIRY_CHOICES, "client_encryption": _client_encryption}
 
+    # Encrypted by the browser, see `shareme.client`.
+    ciphertext = request.POST.get("ciphertext", None)
     snippet = request.POST.get("snippet", None)
-    if not snippet:
+    if not snippet and not ciphertext:
         context["error_message"] = "Please provide a snippet."
 
         return render(request, "index.html", context)
 
+    try:
+        expires_at = get_expires_at(request.POST.get("expires_in"))
+        max_reads = _get_max_reads(request.POST.get("max_reads"))
+    except ValueError:
+        context["error_message"] = "Please choose a valid expiry."
+
+        return render(request, "index.html", context)
+
     base_url = request.build_absolute_uri()
     key = request.POST.get("key", None)
     share_service = SnippetService()
 
     try:
-        link = share_service.add_and_get_shareable_link(snippet, base_url, key)
+        if ciphertext:
+            client_snippet = _client_encryption.parse(
+                ciphertext, request.POST.get("salt", ""), request.POST.get("iterations", "")
+            )
+            link = share_service.add_client_encrypted_snippet_and_get_shareable_link(
+                client_snippet, base_url, expires_at=expires_at, max_reads=max_reads
+            )
+        else:
+            assert snippet is not None
+            link = share_service.add_and_get_shareable_link(
+                snippet, base_url, key, expires_at=expires_at, max_reads=max_reads
+            )
 
         return HttpResponseRedirect(_get_route_with_query_params("shareme:index", {"link": link}))
+    except InvalidCiphertextError:
+        context["error_message"] = "The snippet couldn't be encrypted in the browser, please try again."
+
+        return render(request, "index.html", context)
     except SnippetCreationError:
         context["error_message"] = "Something went wrong! Please try again later."
 
         return render(request, "index.html", context)
+    except KeyDerivationBusyError:
+        context["error_message"] = _BUSY_ERROR_MESSAGE
+
+        return _service_unavailable(render(request, "index.html", context, status=503))
+
+
+def _stream_snippet(request: HttpRequest, snippet_id: str, *, as_attachment: bool) -> HttpResponseBase:
+    key = request.POST.get("key", None) if request.method == "POST" else None
+
+    share_service = SnippetService()
+    try:
+        content = share_service.iter_snippet(snippet_id, key)
+    except SnippetNotFoundError:
+        return render(request, "not-found.html")
+    except BrowserEncryptedError:
+        return HttpResponseRedirect(reverse("shareme:snippet", kwargs={"snippet_id": snippet_id}))
+    except KeyRequiredError:
+        # The key is asked for again rather than put in the snippet page, which would keep it around.
+        context = {"encrypted": True, "snippet_id": snippet_id, "form_action": request.path}
+
+        return render(request, "snippet.html", context)
+    except (DecryptionError, UnknownKdfError):
+        context = {
+            "encrypted": True,
+            "snippet_id": snippet_id,
+            "form_action": request.path,
+            "error_message": "Invalid encryption key.",
+        }
+
+        return render(request, "snippet.html", context)
+    except KeyDerivationBusyError:
+        context = {
+            "encrypted": True,
+            "snippet_id": snippet_id,
+            "form_action": request.path,
+            "error_message": _BUSY_ERROR_MESSAGE,
+        }
+
+        return _service_unavailable(render(request, "snippet.html", context, status=503))
+
+    response = StreamingHttpResponse(content, content_type="text/plain; charset=utf-8")
+    response["X-Content-Type-Options"] = "nosniff"
+    if as_attachment:
+        response["Content-Disposition"] = f'attachment; filename="{snippet_id}.txt"'
+
+    return response
+
+
+async def _render_cached_page(
+    request: HttpRequest, snippet_id: str, context: dict[str, Any], version: SnippetVersion
+) -> HttpResponse:
+    # Rendered without the request so that the page is the same for everyone, none of the context
+    # processors are used by the template.
+    content = render_to_string("snippet.html", {**context, "csrf_token": _CSRF_PLACEHOLDER}).encode()
+    # The pages of the snippets encrypted by the browser don't have a form.
+    locked = context["encrypted"] and context["ciphertext"] is None
+    page = CachedPage(content, _get_etag(snippet_id, version.digest), version.expires_at, locked=locked)
+    await _page_cache.aset(snippet_id, page)
+
+    return _get_page_response(request, snippet_id, page)
+
+
+def _get_page_response(request: HttpRequest, snippet_id: str, page: CachedPage) -> HttpResponse:
+    content = page.content
+    etag = page.etag
+    if page.locked:
+        # The cached copy of the form is only good for as long as its CSRF token is, which is for as long
+        # as the CSRF cookie doesn't change.
+        token = get_token(request)
+        content = content.replace(_CSRF_PLACEHOLDER.encode(), token.encode())
+        etag = _get_etag(snippet_id, f"{page.etag}\n{request.META['CSRF_COOKIE']}")
+
+    if (if_none_match := request.headers.get("If-None-Match")) is not None and (
+        if_none_match.strip() == "*" or etag in parse_etags(if_none_match)
+    ):
+        response: HttpResponse = HttpResponseNotModified()
+    else:
+        response = HttpResponse(content)
+
+    response["ETag"] = etag
+    response["Cache-Control"] = "private, no-cache"
+
+    return response
+
+
+def _get_etag(snippet_id: str, digest: str) -> str:
+    digest = hashlib.blake2b(f"{snippet_id}\n{digest}".encode(), digest_size=16).hexdigest()
+
+    return f'"{digest}"'
+
+
+def _get_max_reads(value: str | None) -> int | None:
+    if not value:
+        return None
+
+    if (max_reads := int(value)) < 1:
+        raise ValueError("the snippet has to be readable at least once")
+
+    return max_reads
+
+
+def _service_unavailable(response: HttpResponse) -> HttpResponse:
+    response["Retry-After"] = "5"
+
+    return response
 
 
 def _get_route_with_query_params(viewname: str, query_params: dict[str, Any]) -> str:
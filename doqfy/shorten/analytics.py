@@ -0,0 +1,201 @@
+"""Click analytics for the short URLs.
+
+The redirects only append the click to an in-process buffer (see `ClickRecorder.record`). A background
+thread periodically aggregates the buffered clicks into per minute and per referrer counts and adds them
+to the database with one batch of upserts, so recording a click never waits on the database.
+
+The counts are written every `FLUSH_INTERVAL` seconds, so the stats lag behind by up to that long. The
+clicks that are still buffered when the process is killed are lost, and so are the oldest ones once the
+buffer is full.
+"""
+
+import atexit
+import itertools
+import logging
+import threading
+import time
+from collections import Counter, deque
+from collections.abc import Iterable
+from dataclasses import dataclass, field
+from datetime import UTC, datetime, timedelta
+from typing import Any, Final
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.db import close_old_connections, connection, models, transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from .models import ClickCount, ReferrerCount, Url
+
+logger = logging.getLogger(__name__)
+
+_UPSERT_BATCH_SIZE: Final[int] = 250
+
+
+class ClickRecorder:
+    """Buffers the clicks and writes them to the database in batches.
+
+    The flusher thread is started by the first recorded click. With a `flush_interval` of `None`,
+    there's no flusher thread and `flush` has to be called explicitly.
+    """
+
+    def __init__(self, *, buffer_size: int = 100_000, flush_interval: float | None = 5) -> None:
+        # Appending to and popping from a deque are atomic, so the clicks are recorded without locking.
+        self._clicks: deque[tuple[str, float, str | None]] = deque(maxlen=buffer_size)
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        """The number of clicks that were dropped since the buffer was full. Approximate."""
+
+        self._flush_lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+        self._thread_lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls) -> "ClickRecorder":
+        config: dict[str, Any] = getattr(settings, "SHORTEN_CLICK_ANALYTICS", {})
+
+        return cls(buffer_size=config.get("BUFFER_SIZE", 100_000), flush_interval=config.get("FLUSH_INTERVAL", 5))
+
+    def record(self, short_id: str, referrer: str | None = None) -> None:
+        """Record a redirect through the short URL. `referrer` is the value of the `Referer` header."""
+
+        if len(self._clicks) == self._clicks.maxlen:
+            self.dropped += 1
+
+        self._clicks.append((short_id, time.time(), referrer))
+
+        if self._thread is None and self.flush_interval is not None:
+            self._start()
+
+    def flush(self) -> int:
+        """Write the buffered clicks to the database. Returns the number of clicks written."""
+
+        with self._flush_lock:
+            clicks: list[tuple[str, float, str | None]] = []
+            try:
+                while True:
+                    clicks.append(self._clicks.popleft())
+            except IndexError:
+                pass
+
+            if clicks:
+                _write_clicks(clicks)
+
+            return len(clicks)
+
+    def _start(self) -> None:
+        with self._thread_lock:
+            if self._thread is not None:
+                return
+
+            self._thread = threading.Thread(
+                target=self._run, args=(self.flush_interval,), name="shorten-click-flusher", daemon=True
+            )
+            self._thread.start()
+            atexit.register(self.flush)
+
+    def _run(self, flush_interval: float) -> None:
+        while True:
+            time.sleep(flush_interval)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("failed to write the clicks")
+            finally:
+                close_old_connections()
+
+
+click_recorder = ClickRecorder.from_settings()
+
+
+@dataclass
+class ClickStats:
+    total: int
+    per_minute: list[tuple[datetime, int]]
+    """The counts for the recent minutes, oldest first. Minutes without clicks are included."""
+
+    referrers: list[tuple[str, int]] = field(default_factory=list)
+    """The top referring hosts with their counts, most clicks first."""
+
+    @property
+    def peak(self) -> int:
+        """The most clicks within one of the recent minutes."""
+
+        return max((count for _, count in self.per_minute), default=0)
+
+
+def get_click_stats(short_id: str, *, minutes: int = 60, referrers: int = 10) -> ClickStats | None:
+    """Get the stats of the short URL, or `None` if it doesn't exist."""
+
+    if not Url.objects.filter(short_id=short_id).exists():
+        return None
+
+    total = ClickCount.objects.filter(url_id=short_id).aggregate(total=Sum("count"))["total"] or 0
+
+    end = _truncate_to_minute(timezone.now().timestamp())
+    start = end - timedelta(minutes=minutes - 1)
+    counts = dict(
+        ClickCount.objects.filter(url_id=short_id, minute__gte=start).values_list("minute", "count"),
+    )
+    per_minute = [(minute, counts.get(minute, 0)) for minute in (start + timedelta(minutes=i) for i in range(minutes))]
+
+    top_referrers = list(
+        ReferrerCount.objects.filter(url_id=short_id).order_by("-count").values_list("referrer", "count")[:referrers]
+    )
+
+    return ClickStats(total=total, per_minute=per_minute, referrers=top_referrers)
+
+
+def _write_clicks(clicks: Iterable[tuple[str, float, str | None]]) -> None:
+    per_minute: Counter[tuple[str, datetime]] = Counter()
+    per_referrer: Counter[tuple[str, str]] = Counter()
+    for short_id, timestamp, referrer in clicks:
+        per_minute[short_id, _truncate_to_minute(timestamp)] += 1
+        per_referrer[short_id, _get_referrer_host(referrer)] += 1
+
+    with transaction.atomic():
+        _upsert_counts(ClickCount, "minute", per_minute)
+        _upsert_counts(ReferrerCount, "referrer", per_referrer)
+
+
+def _upsert_counts(model: type[models.Model], key_field: str, counts: Counter[tuple[str, Any]]) -> None:
+    """Add the counts to the rows keyed by the short ID and `key_field`, creating the missing rows."""
+
+    opts = model._meta  # noqa: SLF001
+    table = connection.ops.quote_name(opts.db_table)
+    url_column = connection.ops.quote_name(opts.get_field("url").column)
+    key = opts.get_field(key_field)
+    key_column = connection.ops.quote_name(key.column)
+    count_column = connection.ops.quote_name(opts.get_field("count").column)
+
+    for batch in itertools.batched(counts.items(), _UPSERT_BATCH_SIZE):
+        values = ", ".join(["(%s, %s, %s)"] * len(batch))
+        params = [
+            param
+            for (short_id, key_value), count in batch
+            for param in (short_id, key.get_db_prep_value(key_value, connection), count)
+        ]
+        sql = (
+            f"INSERT INTO {table} ({url_column}, {key_column}, {count_column}) VALUES {values} "  # noqa: S608
+            f"ON CONFLICT ({url_column}, {key_column}) "
+            f"DO UPDATE SET {count_column} = {table}.{count_column} + excluded.{count_column}"
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+
+
+def _truncate_to_minute(timestamp: float) -> datetime:
+    return datetime.fromtimestamp(timestamp - timestamp % 60, tz=UTC)
+
+
+def _get_referrer_host(referrer: str | None) -> str:
+    if not referrer:
+        return ""
+
+    try:
+        host = urlsplit(referrer).hostname
+    except ValueError:
+        return ""
+
+    return (host or "")[:255]
@@ -1,6 +1,19 @@
+from core.expiry import sweeper
+from core.warmup import warmer
 from django.apps import AppConfig
 
 
 class ShortenConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "shorten"
+
+    def ready(self) -> None:
+        # Imported here since it imports the models of core.
+        from core.idfilter import id_filters  # noqa: PLC0415
+
+        from .models import Url  # noqa: PLC0415
+        from .services import ShortenerService, get_expired_urls  # noqa: PLC0415
+
+        id_filters["short-url"].track(Url)
+        sweeper.register("shorten.Url", get_expired_urls)
+        warmer.register("shorten.Url (most clicked)", ShortenerService().warm_cache)
@@ -0,0 +1,214 @@
+"""A fast path for the redirects that skips Django's request handling.
+
+`RedirectFastPathASGI` and `RedirectFastPathWSGI` wrap the Django application and answer the `GET` and
+`HEAD` requests for the `shorten:shortener-redirect` route themselves: a lookup in the URL cache, a
+click recorded in memory for the actual redirects (not for the revalidations answered with a 304), and
+a response built from a few pre-encoded headers. None of the middleware or the template engine are
+involved, and the 404 page is rendered only once. Everything else is passed on to the Django
+application.
+
+The paths are resolved with the URLconf like Django does, after removing the script name, so the fast
+path takes the same requests as `views.redirect_to_long_url` would. The resolved paths are memoized.
+
+The redirects can be cached by the browsers and the CDNs for `SHORTEN_REDIRECT["MAX_AGE"]` seconds,
+or until the short URL expires if that's sooner, in which case the clicks aren't counted.
+
+Since the request signals aren't sent, the database connections used on a cache miss are only
+checked and recycled by the next request that goes through Django on the same thread, and the fast
+path starts the expiry sweeper itself (see `core.expiry.start_sweeper`).
+"""
+
+import functools
+import hashlib
+import time
+from collections.abc import Awaitable, Callable, Iterable, MutableMapping
+from http import HTTPStatus
+from typing import Any, Final
+
+from core.expiry import sweeper
+from django.conf import settings
+from django.core.handlers.asgi import get_script_prefix as get_asgi_script_name
+from django.core.handlers.wsgi import get_path_info
+from django.template.loader import render_to_string
+from django.urls import Resolver404, get_script_prefix, resolve, reverse
+from django.utils.encoding import iri_to_uri
+
+from .analytics import click_recorder
+from .services import ExpiringUrl, LongUrlNotFoundError, ShortenerService
+
+_REDIRECT_VIEW_NAME: Final[str] = "shorten:shortener-redirect"
+
+_RESOLVED_PATHS_CACHE_SIZE: Final[int] = 10_000
+
+_STATUS_REASONS: Final[dict[int, str]] = {302: "Found", 304: "Not Modified", 404: "Not Found"}
+
+Headers = list[tuple[str, str]]
+
+
+def get_redirect_headers(short_id: str, long_url: str | ExpiringUrl) -> Headers:
+    """Get the headers of the redirect to the long URL, other than `Location`.
+
+    The redirects of the short URLs that expire aren't cached past their expiry.
+    """
+
+    if isinstance(long_url, ExpiringUrl):
+        cache_control = _get_cache_control("MAX_AGE", 300, expires_at=long_url.expires_at)
+        long_url = long_url.long_url
+    else:
+        cache_control = _get_cache_control("MAX_AGE", 300)
+
+    return [("Cache-Control", cache_control), ("ETag", _get_etag(short_id, long_url))]
+
+
+def get_not_found_headers() -> Headers:
+    return [
+        ("Content-Type", "text/html; charset=utf-8"),
+        ("Cache-Control", _get_cache_control("NOT_FOUND_MAX_AGE", 60)),
+    ]
+
+
+@functools.cache
+def get_not_found_page() -> bytes:
+    """Render `not-found.html`, which doesn't depend on the request."""
+
+    return render_to_string("not-found.html").encode()
+
+
+def get_short_id(method: str, path_info: str) -> str | None:
+    """Get the short ID if the request is a redirect that can take the fast path.
+
+    `path_info` is the path without the script name, as in `HttpRequest.path_info`.
+    """
+
+    if method not in ("GET", "HEAD") or not path_info.startswith(_get_redirect_prefix()):
+        return None
+
+    return _resolve_short_id(path_info)
+
+
+def build_response(
+    short_id: str, long_url: str | ExpiringUrl | None, *, if_none_match: str | None, head: bool
+) -> tuple[int, Headers, bytes]:
+    """Build the status, the headers and the body of the response to the redirect.
+
+    `long_url` is as given by `ShortenerService.get_live_long_url`, or `None` if there's no such short URL.
+    """
+
+    if long_url is None:
+        body = get_not_found_page()
+        headers = [*get_not_found_headers(), ("Content-Length", str(len(body)))]
+
+        return 404, headers, b"" if head else body
+
+    headers = get_redirect_headers(short_id, long_url)
+    if isinstance(long_url, ExpiringUrl):
+        long_url = long_url.long_url
+    if if_none_match is not None and (if_none_match.strip() == "*" or _get_etag(short_id, long_url) in if_none_match):
+        return 304, headers, b""
+
+    return 302, [("Location", iri_to_uri(long_url)), *headers, ("Content-Length", "0")], b""
+
+
+class RedirectFastPathASGI:
+    def __init__(self, application: Callable[..., Awaitable[None]]) -> None:
+        self.application = application
+
+    async def __call__(
+        self,
+        scope: MutableMapping[str, Any],
+        receive: Callable[[], Awaitable[Any]],
+        send: Callable[[Any], Awaitable[None]],
+    ) -> None:
+        if scope["type"] != "http" or (short_id := get_short_id(scope["method"], _get_path_info(scope))) is None:
+            await self.application(scope, receive, send)
+            return
+
+        sweeper.start()
+        headers = {name.decode("latin-1"): value.decode("latin-1") for name, value in scope["headers"]}
+        try:
+            long_url = await ShortenerService().aget_live_long_url(short_id)
+        except LongUrlNotFoundError:
+            long_url = None
+
+        status, response_headers, body = build_response(
+            short_id, long_url, if_none_match=headers.get("if-none-match"), head=scope["method"] == "HEAD"
+        )
+        if status == HTTPStatus.FOUND:
+            click_recorder.record(short_id, headers.get("referer"))
+        await send(
+            {
+                "type": "http.response.start",
+                "status": status,
+                "headers": [(name.lower().encode(), value.encode("latin-1")) for name, value in response_headers],
+            }
+        )
+        await send({"type": "http.response.body", "body": body})
+
+
+class RedirectFastPathWSGI:
+    def __init__(self, application: Callable[..., Iterable[bytes]]) -> None:
+        self.application = application
+
+    def __call__(self, environ: dict[str, Any], start_response: Callable[..., Any]) -> Iterable[bytes]:
+        if (short_id := get_short_id(environ["REQUEST_METHOD"], get_path_info(environ))) is None:
+            return self.application(environ, start_response)
+
+        sweeper.start()
+        try:
+            long_url = ShortenerService().get_live_long_url(short_id)
+        except LongUrlNotFoundError:
+            long_url = None
+
+        status, headers, body = build_response(
+            short_id,
+            long_url,
+            if_none_match=environ.get("HTTP_IF_NONE_MATCH"),
+            head=environ["REQUEST_METHOD"] == "HEAD",
+        )
+        if status == HTTPStatus.FOUND:
+            click_recorder.record(short_id, environ.get("HTTP_REFERER"))
+        start_response(f"{status} {_STATUS_REASONS[status]}", headers)
+
+        return [body]
+
+
+@functools.cache
+def _get_redirect_prefix() -> str:
+    """Get the path of the redirects up to the short ID, for skipping the resolver on the other paths."""
+
+    sentinel = "short-id"
+    path = reverse(_REDIRECT_VIEW_NAME, kwargs={"short_id": sentinel})
+
+    return "/" + path.removeprefix(get_script_prefix()).partition(sentinel)[0]
+
+
+@functools.lru_cache(maxsize=_RESOLVED_PATHS_CACHE_SIZE)
+def _resolve_short_id(path_info: str) -> str | None:
+    try:
+        match = resolve(path_info)
+    except Resolver404:
+        return None
+
+    return match.kwargs["short_id"] if match.view_name == _REDIRECT_VIEW_NAME else None
+
+
+def _get_path_info(scope: MutableMapping[str, Any]) -> str:
+    # As in `django.core.handlers.asgi.ASGIRequest`.
+    script_name = get_asgi_script_name(scope)
+
+    return scope["path"].removeprefix(script_name) if script_name else scope["path"]
+
+
+def _get_etag(short_id: str, long_url: str) -> str:
+    digest = hashlib.blake2b(f"{short_id}\n{long_url}".encode(), digest_size=8).hexdigest()
+
+    return f'"{digest}"'
+
+
+def _get_cache_control(name: str, default: int, *, expires_at: float | None = None) -> str:
+    config: dict[str, Any] = getattr(settings, "SHORTEN_REDIRECT", {})
+    max_age = config.get(name, default)
+    if expires_at is not None:
+        max_age = max(min(max_age, int(expires_at - time.time())), 0)
+
+    return f"public, max-age={max_age}" if max_age else "no-cache"
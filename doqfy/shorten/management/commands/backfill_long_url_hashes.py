@@ -0,0 +1,64 @@
+from typing import Any
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandParser
+from django.db import transaction
+
+from shorten.models import Url, long_url_digest
+from shorten.normalize import normalize_url
+
+
+class Command(BaseCommand):
+    help = "Populate `long_url_hash` for the URLs that were created before the column existed."
+
+    def add_arguments(self, parser: CommandParser) -> None:
+        parser.add_argument("--batch-size", type=int, default=1000, help="Number of rows updated per transaction.")
+
+    def handle(self, *_: Any, **options: Any) -> None:  # noqa: ANN401
+        batch_size: int = options["batch_size"]
+        updated = 0
+        skipped = 0
+        last_short_id = ""
+
+        while True:
+            batch = list(
+                # The URLs that expire aren't deduplicated.
+                Url.objects.filter(long_url_hash__isnull=True, expires_at__isnull=True, short_id__gt=last_short_id)
+                .only("short_id", "long_url")
+                .order_by("short_id")[:batch_size]
+            )
+            if not batch:
+                break
+
+            last_short_id = batch[-1].short_id
+            with transaction.atomic():
+                digests = {url.short_id: long_url_digest(_canonicalize(url.long_url)) for url in batch}
+                taken = set(
+                    Url.objects.filter(long_url_hash__in=set(digests.values())).values_list("long_url_hash", flat=True)
+                )
+
+                to_update: list[Url] = []
+                for url in batch:
+                    digest = digests[url.short_id]
+                    if digest in taken:
+                        # Duplicate long URL. The row still redirects fine through its short ID, it's
+                        # just not used for the deduplication.
+                        skipped += 1
+                        continue
+
+                    taken.add(digest)
+                    url.long_url_hash = digest
+                    to_update.append(url)
+
+                Url.objects.bulk_update(to_update, ["long_url_hash"])
+                updated += len(to_update)
+
+        self.stdout.write(self.style.SUCCESS(f"Backfilled {updated} URL(s), skipped {skipped} duplicate(s)."))
+
+
+def _canonicalize(long_url: str) -> str:
+    # The new URLs are looked up by the digest of their canonical form.
+    try:
+        return normalize_url(long_url)
+    except ValidationError:
+        return long_url
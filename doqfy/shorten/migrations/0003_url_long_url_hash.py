@@ -0,0 +1,22 @@
+# Generated by Django 5.0.3 on 2026-10-18 07:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("shorten", "0002_alter_url_long_url"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="url",
+            name="long_url_hash",
+            field=models.CharField(default=None, max_length=64, null=True, unique=True),
+        ),
+        migrations.AlterField(
+            model_name="url",
+            name="long_url",
+            field=models.TextField(),
+        ),
+    ]
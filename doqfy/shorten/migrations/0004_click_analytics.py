@@ -0,0 +1,75 @@
+# Generated by Django 5.0.3 on 2026-10-18 07:33
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("shorten", "0003_url_long_url_hash"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ClickCount",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("minute", models.DateTimeField()),
+                ("count", models.PositiveBigIntegerField(default=0)),
+                (
+                    "url",
+                    models.ForeignKey(
+                        db_constraint=False,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="click_counts",
+                        to="shorten.url",
+                    ),
+                ),
+            ],
+        ),
+        migrations.CreateModel(
+            name="ReferrerCount",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("referrer", models.CharField(blank=True, max_length=255)),
+                ("count", models.PositiveBigIntegerField(default=0)),
+                (
+                    "url",
+                    models.ForeignKey(
+                        db_constraint=False,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="referrer_counts",
+                        to="shorten.url",
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name="clickcount",
+            constraint=models.UniqueConstraint(
+                fields=("url", "minute"), name="unique_click_count_minute"
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="referrercount",
+            constraint=models.UniqueConstraint(
+                fields=("url", "referrer"), name="unique_referrer_count_referrer"
+            ),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.0.3 on 2026-10-18 07:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("shorten", "0004_click_analytics"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="url",
+            name="expires_at",
+            field=models.DateTimeField(default=None, null=True),
+        ),
+        migrations.AddIndex(
+            model_name="url",
+            index=models.Index(
+                condition=models.Q(("expires_at__isnull", False)),
+                fields=["expires_at"],
+                name="url_expires_at",
+            ),
+        ),
+    ]
@@ -0,0 +1,16 @@
+# Generated by Django 5.0.3 on 2026-10-18 07:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("shorten", "0005_url_expiry"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="clickcount",
+            index=models.Index(fields=["minute"], name="click_count_minute"),
+        ),
+    ]
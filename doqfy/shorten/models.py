@@ -1,9 +1,75 @@
+import hashlib
+
 from django.db import models
 
 
+def long_url_digest(long_url: str) -> str:
+    """Get the fixed width digest used to look up a long URL."""
+
+    return hashlib.sha256(long_url.encode()).hexdigest()
+
+
 class Url(models.Model):
     short_id = models.CharField(primary_key=True, max_length=20)
-    long_url = models.TextField(db_index=True)
+    long_url = models.TextField()
+    long_url_hash = models.CharField(max_length=64, unique=True, null=True, default=None)  # noqa: DJ001
+    """SHA-256 hex digest of `long_url`.
+
+    This is `None` only for rows created before the column existed and that haven't been
+    backfilled yet (see the `backfill_long_url_hashes` command), and for the URLs that expire, which
+    aren't deduplicated.
+    """
+
+    expires_at = models.DateTimeField(default=None, null=True)
+    """When the short URL stops redirecting. See `core.expiry`."""
+
+    class Meta:
+        """The index for the sweeper."""
+
+        indexes = (
+            models.Index(fields=("expires_at",), name="url_expires_at", condition=models.Q(expires_at__isnull=False)),
+        )
 
     def __str__(self) -> str:
         return f"{self.long_url} ({self.short_id})"
+
+
+class ClickCount(models.Model):
+    """The number of redirects through a short URL within a minute.
+
+    These are written by `shorten.analytics`. The foreign keys aren't enforced by the database since
+    the URL may be deleted before the clicks on it are written.
+    """
+
+    url = models.ForeignKey(Url, on_delete=models.CASCADE, related_name="click_counts", db_constraint=False)
+    minute = models.DateTimeField()
+    count = models.PositiveBigIntegerField(default=0)
+
+    class Meta:
+        """One count per short URL and minute."""
+
+        constraints = (models.UniqueConstraint(fields=("url", "minute"), name="unique_click_count_minute"),)
+        # For finding the most clicked URLs of the last day, see `ShortenerService.warm_cache`.
+        indexes = (models.Index(fields=("minute",), name="click_count_minute"),)
+
+    def __str__(self) -> str:
+        return f"ClickCount(short_id={self.url_id}, minute={self.minute}, count={self.count})"
+
+
+class ReferrerCount(models.Model):
+    """The number of redirects through a short URL from a referring host.
+
+    The host is empty for the redirects without a referrer.
+    """
+
+    url = models.ForeignKey(Url, on_delete=models.CASCADE, related_name="referrer_counts", db_constraint=False)
+    referrer = models.CharField(max_length=255, blank=True)
+    count = models.PositiveBigIntegerField(default=0)
+
+    class Meta:
+        """One count per short URL and referrer."""
+
+        constraints = (models.UniqueConstraint(fields=("url", "referrer"), name="unique_referrer_count_referrer"),)
+
+    def __str__(self) -> str:
+        return f"ReferrerCount(short_id={self.url_id}, referrer={self.referrer}, count={self.count})"
@@ -0,0 +1,86 @@
+"""Validation and canonicalization of the long URLs.
+
+The URLs are stored and deduplicated in their canonical form, so that the different ways of writing the
+same URL share a short ID. The canonical form has:
+
+- a lowercase scheme and host, with the internationalized host names IDNA encoded;
+- no port if it's the default one for the scheme;
+- a `/` path instead of an empty one;
+- uppercase percent-encodings;
+- the query parameters sorted by their name. The parameters with the same name keep their order.
+
+Everything else, including a trailing slash on a non-empty path, is kept as is since servers may
+treat it differently.
+"""
+
+import re
+from typing import Final
+from urllib.parse import urlsplit, urlunsplit
+
+from django.core.exceptions import ValidationError
+from django.core.validators import URLValidator
+
+_url_validator: Final[URLValidator] = URLValidator()
+
+_DEFAULT_PORTS: Final[dict[str, int]] = {"http": 80, "https": 443, "ftp": 21, "ftps": 990}
+
+_LOWERCASE_PERCENT_ENCODING: Final[re.Pattern[str]] = re.compile(r"%(?:[0-9A-Fa-f][a-f]|[a-f][0-9A-F])")
+
+
+def normalize_url(url: str) -> str:
+    """Get the canonical form of the URL.
+
+    Raises `ValidationError` if the URL isn't valid.
+    """
+
+    url = url.strip()
+    if len(url) > _url_validator.max_length:
+        raise ValidationError(_url_validator.message, code=_url_validator.code)
+
+    try:
+        parts = urlsplit(url)
+        port = parts.port
+    except ValueError as ex:
+        raise ValidationError(_url_validator.message, code=_url_validator.code) from ex
+
+    # Already lowercased by `urlsplit`.
+    host = parts.hostname
+    if not host:
+        raise ValidationError(_url_validator.message, code=_url_validator.code)
+
+    if not host.isascii():
+        try:
+            host = host.encode("idna").decode("ascii")
+        except UnicodeError as ex:
+            raise ValidationError(_url_validator.message, code=_url_validator.code) from ex
+
+    netloc = f"[{host}]" if ":" in host else host
+    userinfo, _, _ = parts.netloc.rpartition("@")
+    if userinfo:
+        netloc = f"{userinfo}@{netloc}"
+    if port is not None and port != _DEFAULT_PORTS.get(parts.scheme):
+        netloc = f"{netloc}:{port}"
+
+    path = parts.path or "/"
+    query = parts.query
+    if "&" in query:
+        query = "&".join(sorted((param for param in query.split("&") if param), key=_get_param_name))
+
+    normalized = urlunsplit(
+        (parts.scheme, netloc, _uppercase_percent_encodings(path), _uppercase_percent_encodings(query), parts.fragment)
+    )
+    # The host is ASCII by now, so this doesn't need the validator's fallback to IDNA encoding.
+    _url_validator(normalized)
+
+    return normalized
+
+
+def _get_param_name(param: str) -> str:
+    return param.partition("=")[0]
+
+
+def _uppercase_percent_encodings(value: str) -> str:
+    if "%" not in value:
+        return value
+
+    return _LOWERCASE_PERCENT_ENCODING.sub(lambda match: match.group().upper(), value)
@@ -1,66 +1,287 @@
-import secrets
-import string
-from typing import Final
-
+import functools
+import itertools
+import threading
+import time
+from collections.abc import Iterable, Sequence
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Final, NamedTuple
+
+from core.cache import TieredCache
+from core.expiry import is_expired
+from core.groupcommit import group_commit
+from core.idfilter import IdFilter, id_filters
+from core.ids import IdAllocator, allocators
+from core.metrics import metrics
 from django.core.cache import caches
 from django.core.cache.backends.base import BaseCache
 from django.core.exceptions import ValidationError
-from django.core.validators import URLValidator
-from django.db import IntegrityError
+from django.db import IntegrityError, transaction
+from django.db.models import Q, QuerySet, Sum
+from django.utils import timezone
+
+from .models import ClickCount, Url, long_url_digest
+from .normalize import normalize_url
+
+
+class ShortIdGenerationError(Exception): ...
+
+
+class InvalidUrlError(Exception): ...
+
+
+class LongUrlNotFoundError(Exception): ...
+
+
+@dataclass
+class BulkShortenResult:
+    long_url: str
+    short_id: str | None = None
+    created: bool = False
+    error: str | None = None
+    """Why the URL couldn't be shortened. Set only if `short_id` is `None`."""
+
+
+class ExpiringUrl(NamedTuple):
+    """The cached long URL of a short URL that expires."""
+
+    long_url: str
+    expires_at: float
+    """POSIX timestamp."""
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+
+
+class UrlMappingCache:
+    """Caches the mapping between the short IDs and the long URLs in both directions.
+
+    Both directions are always written together. Since either of them can be evicted on its own,
+    a hit on the long URL to short ID direction is only trusted if the other direction agrees
+    with it (and the other direction is filled back in if it was evicted).
+
+    The short URLs that expire are only cached in the short ID to long URL direction, along with
+    their expiry so that they stop resolving once they expire.
+
+    The stats are per process and, since they're updated without locking, approximate.
+    """
+
+    def __init__(self, long_urls: TieredCache, short_ids: BaseCache) -> None:
+        self._long_urls = long_urls
+        """Short ID -> long URL."""
+
+        self._short_ids = short_ids
+        """Digest of the long URL -> short ID."""
+
+        self._lock = threading.Lock()
+        self.long_url_stats = CacheStats()
+        self.short_id_stats = CacheStats()
+
+    def get_long_url(self, short_id: str) -> str | None:
+        """Get the long URL for the short ID, loading it from the database on a miss."""
+
+        long_url = self.get_live_long_url(short_id)
+
+        return None if long_url is None else _unwrap_long_url(long_url)
+
+    async def aget_long_url(self, short_id: str) -> str | None:
+        long_url = await self.aget_live_long_url(short_id)
 
-from .models import Url
+        return None if long_url is None else _unwrap_long_url(long_url)
 
+    def get_live_long_url(self, short_id: str) -> str | ExpiringUrl | None:
+        """Get the long URL for the short ID along with its expiry if it expires, `None` once it expired."""
 
-class ShortIdGenerationError(Exception):
-    ...
+        loaded = False
 
+        def load() -> str | ExpiringUrl | None:
+            nonlocal loaded
+            loaded = True
+            return _load_long_url(short_id)
 
-class InvalidUrlError(Exception):
-    ...
+        long_url = self._long_urls.get_or_load(short_id, load)
+        if loaded:
+            self.long_url_stats.misses += 1
+        else:
+            self.long_url_stats.hits += 1
 
+        return _drop_expired(long_url)
 
-class LongUrlNotFoundError(Exception):
-    ...
+    async def aget_live_long_url(self, short_id: str) -> str | ExpiringUrl | None:
+        loaded = False
+
+        async def load() -> str | ExpiringUrl | None:
+            nonlocal loaded
+            loaded = True
+            return await _aload_long_url(short_id)
+
+        long_url = await self._long_urls.aget_or_load(short_id, load)
+        if loaded:
+            self.long_url_stats.misses += 1
+        else:
+            self.long_url_stats.hits += 1
+
+        return _drop_expired(long_url)
+
+    def get_short_id(self, long_url: str) -> str | None:
+        """Get the cached short ID for the long URL."""
+
+        long_url_hash = long_url_digest(long_url)
+        short_id = self._short_ids.get(long_url_hash)
+        if short_id is None:
+            self.short_id_stats.misses += 1
+            return None
+
+        cached_long_url = self._long_urls.get(short_id)
+        if cached_long_url is None:
+            # The other direction was evicted.
+            self._long_urls.set(short_id, long_url)
+        elif cached_long_url != long_url:
+            # Also covers the short ID being cached as unknown.
+            self._short_ids.delete(long_url_hash)
+            self.short_id_stats.misses += 1
+            return None
+
+        self.short_id_stats.hits += 1
+
+        return short_id
+
+    def set(self, short_id: str, long_url: str, expires_at: datetime | None = None) -> None:
+        if expires_at is not None:
+            self._long_urls.set(short_id, ExpiringUrl(long_url, expires_at.timestamp()))
+            return
+
+        with self._lock:
+            self._long_urls.set(short_id, long_url)
+            self._short_ids.set(long_url_digest(long_url), short_id)
+
+    def discard(self, short_id: str, long_url: str) -> None:
+        with self._lock:
+            self._short_ids.delete(long_url_digest(long_url))
+            self._long_urls.delete(short_id)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._short_ids.clear()
+            self._long_urls.clear()
+            self.long_url_stats = CacheStats()
+            self.short_id_stats = CacheStats()
 
 
 class ShortenerService:
     """Service that handles the URL shortening/retrieval."""
 
-    MIN_SHORT_ID_LEN: Final[int] = 8
-    MAX_SHORT_ID_LEN: Final[int] = 12
+    _max_insert_attempts: Final[int] = 3
+    """The number of IDs tried before giving up.
+
+    The allocator doesn't hand out the same ID twice, so this only matters if an ID collides
+    with one that was created by a different allocator.
+    """
 
-    _short_id_cache: Final[BaseCache] = caches["short-id"]
-    """Caches the mapping from long url to the corresponding short ID."""
+    _id_allocator: Final[IdAllocator] = allocators["short-url"]
+    _id_filter: Final[IdFilter] = id_filters["short-url"]
+    """Answers the unknown short IDs without looking them up, and skips the known ones when allocating."""
 
-    _long_url_cache: Final[BaseCache] = caches["long-url"]
-    """Caches the mapping from short ID to the long url."""
+    _bulk_batch_size: Final[int] = 500
+    """The maximum number of rows per query in the bulk operations.
+
+    This keeps the number of query parameters within SQLite's limit.
+    """
+
+    _url_cache: Final[UrlMappingCache] = UrlMappingCache(
+        TieredCache(
+            caches["long-url"],
+            max_local_entries=10_000,
+            local_timeout=60,
+            timeout=24 * 60 * 60,
+            negative_timeout=60,
+            name="long-url",
+        ),
+        caches["short-id"],
+    )
+    """Caches the mapping between the short IDs and the long URLs.
+
+    Unknown short IDs are cached as well so that scanning for IDs doesn't hit the database.
+    """
+
+    _hot_period: Final[timedelta] = timedelta(days=1)
+    """How far back the clicks are counted to find the short URLs worth preloading."""
 
     def get_long_url(self, short_id: str) -> str:
-        if long_url := self._long_url_cache.get(short_id, None):
-            return long_url
+        return _unwrap_long_url(self.get_live_long_url(short_id))
 
-        try:
-            url = Url.objects.get(short_id=short_id)
-            long_url = url.long_url
-            self._long_url_cache.set(short_id, long_url)
+    async def aget_long_url(self, short_id: str) -> str:
+        return _unwrap_long_url(await self.aget_live_long_url(short_id))
+
+    def get_live_long_url(self, short_id: str) -> str | ExpiringUrl:
+        """Get the long URL for the short ID along with its expiry if it expires, for redirecting to it."""
+
+        if self._id_filter.is_unknown(short_id):
+            raise LongUrlNotFoundError
 
-            return long_url
-        except Url.DoesNotExist as ex:
-            raise LongUrlNotFoundError from ex
+        long_url = self._url_cache.get_live_long_url(short_id)
+        if long_url is None:
+            raise LongUrlNotFoundError
 
-    def get_short_url(self, long_url: str, base_url: str) -> str:
-        short_id = self.get_or_create_short_id(long_url)
+        return long_url
+
+    async def aget_live_long_url(self, short_id: str) -> str | ExpiringUrl:
+        if self._id_filter.is_unknown(short_id):
+            raise LongUrlNotFoundError
+
+        long_url = await self._url_cache.aget_live_long_url(short_id)
+        if long_url is None:
+            raise LongUrlNotFoundError
+
+        return long_url
+
+    def warm_cache(self, max_items: int, deadline: float) -> int:
+        """Preload the most clicked short URLs of the last day into the cache. See `core.warmup`.
+
+        Returns the number of short URLs loaded.
+        """
 
+        short_ids = list(
+            ClickCount.objects.filter(minute__gte=timezone.now() - self._hot_period)
+            .values("url")
+            .annotate(clicks=Sum("count"))
+            .order_by("-clicks")
+            .values_list("url", flat=True)[:max_items]
+        )
+        loaded = 0
+        for batch in itertools.batched(short_ids, self._bulk_batch_size):
+            if time.monotonic() >= deadline:
+                break
+
+            urls = Url.objects.filter(_is_live(), short_id__in=batch)
+            for short_id, long_url, expires_at in urls.values_list("short_id", "long_url", "expires_at"):
+                self._url_cache.set(short_id, long_url, expires_at)
+                loaded += 1
+
+        return loaded
+
+    def get_short_url(self, long_url: str, base_url: str, *, expires_at: datetime | None = None) -> str:
+        short_id = self.get_or_create_short_id(long_url, expires_at=expires_at)
+
+        return self.build_short_url(short_id, base_url)
+
+    @staticmethod
+    def build_short_url(short_id: str, base_url: str) -> str:
         if base_url.endswith("/"):
             return f"{base_url}{short_id}"
 
         return f"{base_url}/{short_id}"
 
-    def get_or_create_short_id(self, long_url: str) -> str:
+    def get_or_create_short_id(self, long_url: str, *, expires_at: datetime | None = None) -> str:
         """Get the short ID for the given URL.
 
         If the short ID already exists, then that is given and if not,
-        then a new ID is created and returned.
+        then a new ID is created and returned. The URLs are deduplicated by their
+        canonical form (see `shorten.normalize`), except for the ones that expire
+        which always get a new ID.
 
 
         Exceptions:
@@ -68,25 +289,32 @@ class ShortenerService:
         """
 
         try:
-            validator = URLValidator()
-            validator(long_url)
+            long_url = normalize_url(long_url)
         except ValidationError as ex:
             raise InvalidUrlError from ex
 
-        if short_id := self._short_id_cache.get(long_url, None):
+        if expires_at is not None:
+            return self._create_expiring_short_id(long_url, expires_at)
+
+        if short_id := self._url_cache.get_short_id(long_url):
             return short_id
 
+        long_url_hash = long_url_digest(long_url)
         try:
-            url = Url.objects.get(long_url=long_url)
+            url = Url.objects.get(long_url_hash=long_url_hash)
         except Url.DoesNotExist:
-            url = Url(long_url=long_url)
-            for length in range(self.MIN_SHORT_ID_LEN, self.MAX_SHORT_ID_LEN):
-                # Some error is raised. Catch that.
-                url.short_id = _generate_short_id(length)
+            url = Url(long_url=long_url, long_url_hash=long_url_hash)
+            for _ in range(self._max_insert_attempts):
+                url.short_id = self._id_filter.allocate(self._id_allocator)
                 try:
-                    url.save(force_insert=True)
+                    group_commit.run(functools.partial(url.save, force_insert=True))
                 except IntegrityError:
-                    # Try with a longer key length.
+                    # Someone else may have shortened the same URL in the meantime.
+                    if existing := Url.objects.filter(long_url_hash=long_url_hash).first():
+                        url = existing
+                        break
+
+                    metrics.inc("id_collisions_total", allocator="short-url")
                     continue
                 break
             else:
@@ -95,14 +323,159 @@ class ShortenerService:
         assert url.short_id is not None
 
         short_id = url.short_id
-        self._short_id_cache.set(short_id, long_url)
-        self._long_url_cache.set(long_url, short_id)
+        self._url_cache.set(short_id, url.long_url)
 
         return short_id
 
+    def bulk_get_or_create_short_ids(self, long_urls: Sequence[str]) -> list[BulkShortenResult]:
+        """Get or create the short IDs for a batch of URLs.
+
+        The existing URLs are looked up with a single query and the rest are inserted in a single
+        transaction. The results are in the same order as the given URLs, and an invalid URL only
+        fails its own result.
+        """
+
+        results = [BulkShortenResult(long_url) for long_url in long_urls]
+        pending = self._resolve_cached(results)
+        if not pending:
+            return results
+
+        hashes = {long_url_digest(long_url): long_url for long_url in pending}
+        short_ids = _get_short_ids_by_hash(hashes)
+        if missing := {long_url_hash: hashes[long_url_hash] for long_url_hash in hashes.keys() - short_ids.keys()}:
+            inserted, created = self._bulk_create(missing)
+            short_ids.update(inserted)
+            for long_url_hash in created:
+                for result in pending[hashes[long_url_hash]]:
+                    result.created = True
+
+        for long_url_hash, long_url in hashes.items():
+            if (short_id := short_ids.get(long_url_hash)) is None:
+                # Only happens if the allocated ID collided with an older one.
+                metrics.inc("id_collisions_total", allocator="short-url")
+                try:
+                    short_id = self.get_or_create_short_id(long_url)
+                except ShortIdGenerationError:
+                    for result in pending[long_url]:
+                        result.error = "failed to generate a unique short ID"
+                    continue
+            else:
+                self._url_cache.set(short_id, long_url)
+
+            for result in pending[long_url]:
+                result.short_id = short_id
+
+        return results
+
+    def _create_expiring_short_id(self, long_url: str, expires_at: datetime) -> str:
+        # Without a digest, so that a URL that expires is never handed out for one that doesn't.
+        url = Url(long_url=long_url, expires_at=expires_at)
+        for _ in range(self._max_insert_attempts):
+            url.short_id = self._id_filter.allocate(self._id_allocator)
+            try:
+                group_commit.run(functools.partial(url.save, force_insert=True))
+            except IntegrityError:
+                metrics.inc("id_collisions_total", allocator="short-url")
+                continue
+
+            self._url_cache.set(url.short_id, long_url, expires_at)
+
+            return url.short_id
+
+        raise ShortIdGenerationError
+
+    def _resolve_cached(self, results: list[BulkShortenResult]) -> dict[str, list[BulkShortenResult]]:
+        """Validate the URLs and fill in the cached short IDs.
+
+        Returns the results that still need a short ID grouped by their canonical long URL.
+        """
+
+        pending: dict[str, list[BulkShortenResult]] = {}
+        for result in results:
+            try:
+                long_url = normalize_url(result.long_url)
+            except ValidationError:
+                result.error = "invalid URL"
+                continue
+
+            if short_id := self._url_cache.get_short_id(long_url):
+                result.short_id = short_id
+            else:
+                pending.setdefault(long_url, []).append(result)
+
+        return pending
+
+    def _bulk_create(self, long_urls: dict[str, str]) -> tuple[dict[str, str], set[str]]:
+        """Insert the long URLs keyed by their digest.
+
+        Returns the short IDs of the long URLs that exist after the insert along with the digests
+        of the ones that were inserted by this call. The rest were created concurrently by someone
+        else. A long URL can be missing from the result if its ID collided with an older one.
+        """
+
+        # The IDs are allocated before the transaction since a rolled back transaction would
+        # otherwise give the same block of IDs to someone else.
+        short_ids = self._id_filter.allocate_many(self._id_allocator, len(long_urls))
+        new_urls = {
+            long_url_hash: Url(short_id=short_id, long_url=long_url, long_url_hash=long_url_hash)
+            for short_id, (long_url_hash, long_url) in zip(short_ids, long_urls.items(), strict=True)
+        }
+        with transaction.atomic():
+            # `bulk_create` doesn't send `post_save`. The IDs that conflicted are added for nothing.
+            self._id_filter.add_many(short_ids)
+            Url.objects.bulk_create(new_urls.values(), batch_size=self._bulk_batch_size, ignore_conflicts=True)
+
+        inserted = _get_short_ids_by_hash(long_urls)
+        created = {
+            long_url_hash for long_url_hash, url in new_urls.items() if inserted.get(long_url_hash) == url.short_id
+        }
+
+        return inserted, created
+
+
+def get_expired_urls() -> QuerySet[Url]:
+    return Url.objects.filter(expires_at__lte=timezone.now())
+
+
+def _load_long_url(short_id: str) -> str | ExpiringUrl | None:
+    return _to_cached_long_url(_get_live_urls(short_id).values_list("long_url", "expires_at").first())
+
+
+async def _aload_long_url(short_id: str) -> str | ExpiringUrl | None:
+    return _to_cached_long_url(await _get_live_urls(short_id).values_list("long_url", "expires_at").afirst())
+
+
+def _get_live_urls(short_id: str) -> QuerySet[Url]:
+    return Url.objects.filter(_is_live(), short_id=short_id)
+
+
+def _is_live() -> Q:
+    return Q(expires_at__isnull=True) | Q(expires_at__gt=timezone.now())
+
+
+def _to_cached_long_url(row: tuple[str, datetime | None] | None) -> str | ExpiringUrl | None:
+    if row is None:
+        return None
+
+    long_url, expires_at = row
+
+    return long_url if expires_at is None else ExpiringUrl(long_url, expires_at.timestamp())
+
+
+def _drop_expired(long_url: str | ExpiringUrl | None) -> str | ExpiringUrl | None:
+    if isinstance(long_url, ExpiringUrl) and is_expired(long_url.expires_at):
+        return None
+
+    return long_url
+
+
+def _unwrap_long_url(long_url: str | ExpiringUrl) -> str:
+    return long_url.long_url if isinstance(long_url, ExpiringUrl) else long_url
+
 
-def _generate_short_id(length: int) -> str:
-    # TODO: change this to use nanoID
-    letters = [secrets.choice(string.ascii_letters) for _ in range(length)]
+def _get_short_ids_by_hash(long_url_hashes: Iterable[str]) -> dict[str, str]:
+    short_ids: dict[str, str] = {}
+    for batch in itertools.batched(long_url_hashes, ShortenerService._bulk_batch_size):  # noqa: SLF001
+        short_ids.update(Url.objects.filter(long_url_hash__in=batch).values_list("long_url_hash", "short_id"))
 
-    return "".join(letters)
+    return short_ids
@@ -5,5 +5,7 @@ from . import views
 app_name = "shorten"
 urlpatterns = [
     path("", views.index, name="index"),
+    path("bulk/", views.bulk_shorten, name="bulk"),
     path("<str:short_id>/", views.redirect_to_long_url, name="shortener-redirect"),
+    path("<str:short_id>/stats/", views.get_stats, name="stats"),
 ]
@@ -1,19 +1,39 @@
-from typing import Any
-
-from django.core.exceptions import ValidationError
-from django.http import HttpResponse, HttpResponseRedirect, QueryDict
+import itertools
+import json
+from collections.abc import Iterable, Iterator
+from http import HTTPStatus
+from typing import Any, Final
+
+from core.expiry import EXPIRY_CHOICES, get_expires_at
+from core.shortcuts import render
+from django.conf import settings
+from django.core.exceptions import RequestDataTooBig, ValidationError
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseRedirect, QueryDict, StreamingHttpResponse
 from django.http.request import HttpRequest
-from django.shortcuts import render
 from django.urls import reverse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+
+from .analytics import click_recorder, get_click_stats
+from .fastpath import build_response
+from .services import (
+    BulkShortenResult,
+    InvalidUrlError,
+    LongUrlNotFoundError,
+    ShortenerService,
+    ShortIdGenerationError,
+)
+
+NDJSON_CONTENT_TYPE: Final[str] = "application/x-ndjson"
 
-from .services import InvalidUrlError, LongUrlNotFoundError, ShortenerService, ShortIdGenerationError
+_BULK_BATCH_SIZE: Final[int] = 1000
 
 
 def index(request: HttpRequest) -> HttpResponse:
     if request.method == "POST":
         return shorten_url(request)
 
-    context: dict[str, str] = {}
+    context: dict[str, Any] = {"expiry_choices": EXPIRY_CHOICES}
     if long_url := request.GET.get("long_url"):
         if short_url := request.GET.get("short_url"):
             context["long_url"] = long_url
@@ -24,28 +44,52 @@ def index(request: HttpRequest) -> HttpResponse:
     return render(request, "shorten.html", context)
 
 
-def redirect_to_long_url(request: HttpRequest, short_id: str) -> HttpResponse:
+async def redirect_to_long_url(request: HttpRequest, short_id: str) -> HttpResponse:
+    """Redirect for the deployments that don't use the fast path in `shorten.fastpath`."""
+
     shortener = ShortenerService()
     try:
-        long_url = shortener.get_long_url(short_id)
-
-        return HttpResponseRedirect(long_url)
+        long_url = await shortener.aget_live_long_url(short_id)
     except LongUrlNotFoundError:
+        long_url = None
+
+    status, headers, body = build_response(
+        short_id, long_url, if_none_match=request.headers.get("if-none-match"), head=False
+    )
+    if status == HTTPStatus.FOUND:
+        click_recorder.record(short_id, request.headers.get("referer"))
+
+    return HttpResponse(body, status=status, headers=dict(headers))
+
+
+def get_stats(request: HttpRequest, short_id: str) -> HttpResponse:
+    if (stats := get_click_stats(short_id)) is None:
         return render(request, "not-found.html")
 
+    return render(request, "stats.html", {"short_id": short_id, "stats": stats})
+
 
 def shorten_url(request: HttpRequest) -> HttpResponse:
     long_url = request.POST["long_url"]
 
+    context: dict[str, Any] = {"long_url": long_url, "expiry_choices": EXPIRY_CHOICES}
     if not long_url:
-        return render(request, "shorten.html", context={"error_message": "Please enter some value for the URL."})
+        context["error_message"] = "Please enter some value for the URL."
+
+        return render(request, "shorten.html", context)
+
+    try:
+        expires_at = get_expires_at(request.POST.get("expires_in"))
+    except ValueError:
+        context["error_message"] = "Please choose a valid expiry."
+
+        return render(request, "shorten.html", context)
 
     base_url = request.build_absolute_uri()
-    context: dict[str, str] = {"long_url": long_url}
 
     try:
         shortener = ShortenerService()
-        short_url = shortener.get_short_url(long_url, base_url)
+        short_url = shortener.get_short_url(long_url, base_url, expires_at=expires_at)
 
         return HttpResponseRedirect(
             _get_route_with_query_params("shorten:index", {"long_url": long_url, "short_url": short_url})
@@ -61,6 +105,95 @@ def shorten_url(request: HttpRequest) -> HttpResponse:
         return render(request, "shorten.html", context)
 
 
+@csrf_exempt
+@require_POST
+def bulk_shorten(request: HttpRequest) -> HttpResponse:
+    """Shorten a batch of URLs.
+
+    The body is either a JSON array of URLs or, if the content type is `application/x-ndjson`,
+    one JSON string per line. The results are streamed back in the same format and order as the
+    URLs, with each result being an object with either the `short_url` or an `error`.
+
+    The body is limited by `DATA_UPLOAD_MAX_MEMORY_SIZE`, and the number of URLs by
+    `SHORTEN_BULK["MAX_URLS"]`.
+    """
+
+    try:
+        body = request.body
+    except RequestDataTooBig:
+        return HttpResponse("The body is too large.", status=413)
+
+    ndjson = request.content_type == NDJSON_CONTENT_TYPE
+    if ndjson:
+        long_urls: list[object] = list(_read_ndjson(body))
+    else:
+        try:
+            long_urls = json.loads(body)
+        except ValueError:
+            return HttpResponseBadRequest("The body must be a JSON array of URLs.")
+
+        if not isinstance(long_urls, list):
+            return HttpResponseBadRequest("The body must be a JSON array of URLs.")
+
+    max_urls = _get_bulk_max_urls()
+    if len(long_urls) > max_urls:
+        return HttpResponse(f"At most {max_urls} URLs can be shortened at once.", status=413)
+
+    base_url = request.build_absolute_uri(reverse("shorten:index"))
+    results = _shorten_in_batches(long_urls, base_url)
+    if ndjson:
+        return StreamingHttpResponse((f"{line}\n" for line in results), content_type=NDJSON_CONTENT_TYPE)
+
+    return StreamingHttpResponse(_as_json_array(results), content_type="application/json")
+
+
+def _read_ndjson(body: bytes) -> Iterator[object]:
+    for line in body.splitlines():
+        if not line.strip():
+            continue
+
+        try:
+            yield json.loads(line)
+        except ValueError:
+            yield None
+
+
+def _shorten_in_batches(long_urls: Iterable[object], base_url: str) -> Iterator[str]:
+    shortener = ShortenerService()
+    for batch in itertools.batched(long_urls, _BULK_BATCH_SIZE):
+        results = iter(shortener.bulk_get_or_create_short_ids([url for url in batch if isinstance(url, str)]))
+        for long_url in batch:
+            if isinstance(long_url, str):
+                yield json.dumps(_bulk_result_to_dict(next(results), base_url))
+            else:
+                yield json.dumps({"error": "expected a JSON string"})
+
+
+def _get_bulk_max_urls() -> int:
+    config: dict[str, Any] = getattr(settings, "SHORTEN_BULK", {})
+
+    return config.get("MAX_URLS", 10_000)
+
+
+def _bulk_result_to_dict(result: BulkShortenResult, base_url: str) -> dict[str, Any]:
+    if result.short_id is None:
+        return {"long_url": result.long_url, "error": result.error}
+
+    return {
+        "long_url": result.long_url,
+        "short_id": result.short_id,
+        "short_url": ShortenerService.build_short_url(result.short_id, base_url),
+        "created": result.created,
+    }
+
+
+def _as_json_array(items: Iterator[str]) -> Iterator[str]:
+    yield "["
+    for index, item in enumerate(items):
+        yield f",{item}" if index else item
+    yield "]"
+
+
 def _get_route_with_query_params(viewname: str, query_params: dict[str, Any]) -> str:
     query_dict = QueryDict("", True)
     query_dict.update(query_params)